@@ -24,4 +24,4 @@ class Article(models.Model):
     tags = models.ManyToManyField(Tag)
 
     def get_absolute_url(self):
-        return reverse("blogapp:article", kwargs={"pk": self.pk})
+        return reverse("blogapp:article_details", kwargs={"pk": self.pk})
@@ -14,7 +14,6 @@ from pathlib import Path
 from django.utils.translation import gettext_lazy as __
 from django.urls import reverse_lazy
 import sentry_sdk
-import logging.config
 
 sentry_sdk.init(
     dsn="https://examplePublicKey@o0.ingest.sentry.io/0",
@@ -84,6 +83,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "requestdataapp.middlewares.RequestIdMiddleware",
+    "requestdataapp.middlewares.QueryProfilerMiddleware",
     # "django.middleware.cache.UpdateCacheMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -93,7 +94,7 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "requestdataapp.middlewares.set_useragent_on_request_middleware",
-    "requestdataapp.middlewares.CountRequestsMiddleware",
+    "requestdataapp.middlewares.MetricsMiddleware",
     "requestdataapp.middlewares.ThrottlingMiddleware",
     "django.middleware.locale.LocaleMiddleware",
     "django.contrib.admindocs.middleware.XViewMiddleware",
@@ -137,10 +138,53 @@ CACHES = {
         "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
         "LOCATION": "/var/tmp/django_cache",
     },
+    # общие для всех воркеров счётчики (ограничение частоты запросов)
+    "throttle": {
+        "BACKEND": "requestdataapp.cache_backends.SQLiteCache",
+        "LOCATION": "/var/tmp/django_shared_cache.sqlite3",
+        "OPTIONS": {
+            "MAX_ENTRIES": 100_000,
+        },
+    },
 }
 
 CACHE_MIDDLEWARE_SECONDS = 200
 
+# requestdataapp.middlewares.MetricsMiddleware: файлы метрик воркеров для /metrics
+METRICS_DIR = getenv("DJANGO_METRICS_DIR", "/var/tmp/django_metrics") or None
+METRICS_FLUSH_INTERVAL = 1.0
+# кроме них /metrics и /metrics/queries доступны персоналу
+METRICS_ALLOWED_IPS = INTERNAL_IPS
+
+# requestdataapp.middlewares.QueryProfilerMiddleware
+QUERY_PROFILER_ENABLED = getenv("DJANGO_QUERY_PROFILER", "1") == "1"
+QUERY_BUDGET = {
+    "queries": 30,
+    "seconds": 0.25,
+}
+# выгрузки читают все строки пачками: долго по определению
+QUERY_ROUTE_BUDGETS = {
+    "shopapp:orders-export": {"seconds": None},
+    "shopapp:products-export": {"seconds": None},
+    "shopapp:columnar-export": {"seconds": None},
+    "shopapp:sales-analytics": {"seconds": 1},
+}
+# для SELECT дольше этого в лог и на /metrics/queries попадает план
+SLOW_QUERY_SECONDS = 0.05
+
+# requestdataapp.middlewares.ThrottlingMiddleware
+THROTTLE_ENABLED = getenv("DJANGO_THROTTLE", "1") == "1"
+THROTTLE_CACHE = "throttle"
+THROTTLE_RATES = {
+    "anon": "30/min",
+    "user": "120/min",
+}
+THROTTLE_ROUTE_RATES = {
+    "myauth:login": {"anon": "10/min"},
+    "shopapp:product-bulk": {"user": "10/min"},
+    "shopapp:sales-analytics": {"user": "30/min"},
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -215,47 +259,24 @@ SPECTACULAR_SETTINGS = {
     "SERVE_INCLUDE_SCHEMA": False,
 }
 
-LOGFILE_NAME = BASE_DIR / "log.txt"
+LOGFILE_NAME = getenv("DJANGO_LOGFILE", BASE_DIR / "log.jsonl")
 LOGFILE_SIZE = 1 * 1024 * 1024
 LOGFILE_COUNT = 3
 LOGLEVEL = getenv("DJANGO_LOGLEVEL", "info").upper()
-# LOGGING = {
-#     "version": 1,
-#     "disable_existing_loggers": False,
-#     "formatters": {
-#         "verbose": {
-#             "format": "%(asctime)s - [%(levelname)s] %(name)s: %(message)s",
-#         },
-#     },
-#     "handlers": {
-#         "console": {
-#             "class": "logging.StreamHandler",
-#             "formatter": "verbose",
-#         },
-#         "logfile": {
-#             "class": "logging.handlers.RotatingFileHandler",
-#             "filename": LOGFILE_NAME,
-#             "maxBytes": LOGFILE_SIZE,
-#             "backupCount": LOGFILE_COUNT,
-#             "formatter": "verbose",
-#             "delay": True,
-#         },
-#     },
-#     "root": {
-#         "handlers": [
-#             "console",
-#             "logfile",
-#         ],
-#         "level": "INFO",
-#     },
-# }
-
-logging.config.dictConfig({
+LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
+    "filters": {
+        "request_id": {
+            "()": "requestdataapp.logs.RequestIdFilter",
+        },
+    },
     "formatters": {
         "console": {
-            "format": "%(asctime)s - [%(levelname)s] %(name)s: %(message)s",
+            "format": "%(asctime)s - [%(levelname)s] %(name)s [%(request_id)s]: %(message)s",
+        },
+        "json": {
+            "()": "requestdataapp.logs.JsonFormatter",
         },
     },
     "handlers": {
@@ -263,13 +284,25 @@ logging.config.dictConfig({
             "class": "logging.StreamHandler",
             "formatter": "console",
         },
-    },
-    "loggers": {
-        "": {
-            "level": LOGLEVEL,
-            "handlers": [
-                "console",
-            ],
+        "logfile": {
+            "class": "logging.handlers.RotatingFileHandler",
+            "filename": LOGFILE_NAME,
+            "maxBytes": LOGFILE_SIZE,
+            "backupCount": LOGFILE_COUNT,
+            "formatter": "json",
+            "delay": True,
+        },
+        # обработчики настраиваются по алфавиту: console и logfile к этому моменту уже созданы
+        "queue": {
+            "()": "requestdataapp.logs.QueueListenerHandler",
+            "handlers": ["console", "logfile"],
+            "filters": ["request_id"],
         },
     },
-})
+    "root": {
+        "level": LOGLEVEL,
+        "handlers": [
+            "queue",
+        ],
+    },
+}
@@ -0,0 +1,19 @@
+"""
+Настройки для тестов: ``python manage.py test`` выбирает их сам,
+другим запускам нужен ``DJANGO_SETTINGS_MODULE=mysite.test_settings``.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import LOGGING
+
+# все запросы тестов идут с одного адреса, тесты лимитов включают ограничение сами
+THROTTLE_ENABLED = False
+# метрики только в памяти процесса, без файлов в /var/tmp
+METRICS_DIR = None
+
+LOGGING = {
+    **LOGGING,
+    "handlers": {
+        **LOGGING["handlers"],
+        "queue": {**LOGGING["handlers"]["queue"], "handlers": ["console"]},
+    },
+}
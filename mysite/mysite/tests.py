@@ -0,0 +1,189 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from importlib import import_module
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, reverse
+from django.utils import timezone
+
+from blogapp.models import Article, Author, Category, Tag
+from myauth.models import Profile
+from shopapp.models import ImportJob, Order, Product
+
+# python manage.py test mysite с QUERY_COUNTS_UPDATE=1 перезаписывает файл
+BASELINE_PATH = Path(__file__).with_name("query_counts.json")
+URLCONFS = ["shopapp.urls", "blogapp.urls", "myauth.urls", "myapiapp.urls"]
+
+# какой объект подставить в маршруты с аргументами
+ROUTE_OBJECTS = {
+    "shopapp:product-detail": "product",
+    "shopapp:product-related": "product",
+    "shopapp:order-detail": "order",
+    "shopapp:importjob-detail": "import_job",
+    "shopapp:product_details": "product",
+    "shopapp:product_update": "product",
+    "shopapp:product_delete": "product",
+    "shopapp:user_orders_list": "user",
+    "shopapp:export_user_orders": "user",
+    "shopapp:orders_details": "order",
+    "shopapp:order_update": "order",
+    "shopapp:order_delete": "order",
+    "blogapp:article_details": "article",
+    "myauth:profile_details": "user",
+    "myauth:profile_update": "profile",
+    "myauth:profile_delete": "user",
+}
+
+# маршруты только для POST измеряются настоящим запросом, а не ответом 405 на GET
+POST_ROUTES = {
+    "shopapp:product-bulk": lambda test: {
+        "data": json.dumps([
+            {"name": f"Bulk {i}", "price": "1.50", "count": 1, "created_by": test.admin.pk} for i in range(2)
+        ]),
+        "content_type": "application/json",
+    },
+    "shopapp:product-upload-csv": lambda test: {
+        "data": {"file": SimpleUploadedFile("products.csv", b"name,price,count\nUploaded,1.50,1\n")},
+    },
+    "shopapp:order-upload-csv": lambda test: {
+        "data": {"file": SimpleUploadedFile("orders.csv", b"delivery_address\nUploaded\n")},
+    },
+}
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def routes(patterns, namespace):
+    """``(view_name, аргументы)`` маршрутов, включая вложенные и роутеры DRF, без ``.<format>``."""
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from routes(pattern.url_patterns, ":".join(filter(None, [namespace, pattern.namespace])))
+        elif pattern.name:
+            arguments = set(pattern.pattern.regex.groupindex)
+            if "format" not in arguments:
+                yield f"{namespace}:{pattern.name}", arguments
+
+
+# без профиля SQL: его EXPLAIN медленных запросов попал бы в подсчёт
+@override_settings(LANGUAGE_CODE="en", CACHES=LOCMEM_CACHES, QUERY_PROFILER_ENABLED=False)
+class QueryCountRegressionTestCase(TestCase):
+    """
+    Число SQL-запросов каждого маршрута при 10 и 1000 строках в таблицах:
+    оно не должно расти с данными и не должно превышать ``query_counts.json``.
+    """
+    SMALL = 10
+    LARGE = 1000
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.settings_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='query_counter', password='password')
+        Profile.objects.create(user=cls.admin)
+        cls.author = Author.objects.create(name="Author", bio="")
+        cls.category = Category.objects.create(name="Category")
+        cls.tags = Tag.objects.bulk_create([Tag(name=f"tag {i}") for i in range(3)])
+
+    def seed(self, start, stop):
+        users = User.objects.bulk_create([User(username=f"counted_{i}", password="!") for i in range(start, stop)])
+        Profile.objects.bulk_create([Profile(user=user) for user in users])
+        products = Product.objects.bulk_create([
+            Product(name=f"Product {i}", description="Description", price=i % 100 + 1, count=10,
+                    created_by=users[i % len(users)])
+            for i in range(stop - start)
+        ])
+        orders = Order.objects.bulk_create([
+            Order(user=users[i], delivery_address=f"Address {i}", total=10, products_count=2)
+            for i in range(stop - start)
+        ])
+        Order.products.through.objects.bulk_create([
+            Order.products.through(order=order, product=product)
+            for i, order in enumerate(orders)
+            for product in (products[i], products[(i + 1) % len(products)])
+        ])
+        articles = Article.objects.bulk_create([
+            Article(title=f"Article {i}", content="Content", pub_date=timezone.now() - timedelta(hours=i),
+                    author=self.author, category=self.category)
+            for i in range(start, stop)
+        ])
+        Article.tags.through.objects.bulk_create([
+            Article.tags.through(article=article, tag=tag) for article in articles for tag in self.tags
+        ])
+        ImportJob.objects.bulk_create([
+            ImportJob(target=ImportJob.TARGET_PRODUCTS, file="imports/products.csv", created_by=users[0])
+            for _ in range(stop - start)
+        ])
+
+    def arguments(self, route, names):
+        if not names:
+            return {}
+        kind = ROUTE_OBJECTS.get(route)
+        self.assertIsNotNone(kind, f"Add an object for {route} to ROUTE_OBJECTS")
+        # первые созданные объекты: одни и те же при обоих размерах данных
+        objects = {
+            "product": Product.objects.order_by("pk").first(),
+            "order": Order.objects.order_by("pk").first(),
+            "import_job": ImportJob.objects.order_by("pk").first(),
+            "article": Article.objects.order_by("pk").first(),
+            "user": self.admin,
+            "profile": self.admin.profile,
+        }
+        return {name: objects[kind].pk for name in names}
+
+    def count_queries(self) -> dict:
+        counts = {}
+        for urlconf in URLCONFS:
+            module = import_module(urlconf)
+            for route, names in routes(module.urlpatterns, module.app_name):
+                url = reverse(route, kwargs=self.arguments(route, names))
+                cache.clear()
+                # выход на myauth:logout не должен влиять на следующие маршруты
+                self.client.force_login(self.admin)
+                method, kwargs = "get", {}
+                if route in POST_ROUTES:
+                    method, kwargs = "post", POST_ROUTES[route](self)
+                with CaptureQueriesContext(connection) as queries:
+                    response = getattr(self.client, method)(url, HTTP_USER_AGENT='Mozilla/5.0', **kwargs)
+                    if response.streaming:
+                        b"".join(response.streaming_content)
+                self.assertNotEqual(response.status_code, 405, f"Add a request for {route} to POST_ROUTES")
+                if route in POST_ROUTES:
+                    self.assertLess(response.status_code, 400, f"{route}: {response.content[:200]}")
+                counts[route] = len(queries)
+        return counts
+
+    def test_query_counts(self):
+        self.seed(0, self.SMALL)
+        small = self.count_queries()
+        self.seed(self.SMALL, self.LARGE)
+        large = self.count_queries()
+
+        grown = {route: [small[route], count] for route, count in large.items() if count > small[route]}
+        self.assertEqual(grown, {}, f"Query count grows with data ({self.SMALL} -> {self.LARGE} rows)")
+
+        if os.environ.get("QUERY_COUNTS_UPDATE"):
+            BASELINE_PATH.write_text(json.dumps(large, indent=4, sort_keys=True) + "\n")
+        baseline = json.loads(BASELINE_PATH.read_text())
+        self.assertEqual(set(large) - set(baseline), set(), "Routes missing from query_counts.json")
+        risen = {route: [baseline[route], count] for route, count in large.items() if count > baseline[route]}
+        self.assertEqual(risen, {}, "Query count rose above query_counts.json")
@@ -22,6 +22,7 @@ from django.conf.urls.i18n import i18n_patterns
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
 from django.contrib.sitemaps.views import sitemap
 from .sitemaps import sitemaps
+from requestdataapp.views import metrics_view, query_profile_view
 
 urlpatterns = [
     path('admin/doc/', include('django.contrib.admindocs.urls')),
@@ -31,6 +32,8 @@ urlpatterns = [
     path('api/', include("myapiapp.urls")),
     path("req/", include("requestdataapp.urls")),
     path("blog/", include("blogapp.urls")),
+    path("metrics", metrics_view, name="metrics"),
+    path("metrics/queries", query_profile_view, name="query-profile"),
 
     path(
         "sitemap.xml",
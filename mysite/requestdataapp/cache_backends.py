@@ -0,0 +1,137 @@
+"""
+Кеш Django в отдельном файле SQLite.
+
+Общий для всех процессов на машине (воркеры gunicorn), а ``incr`` — один
+атомарный ``UPDATE``, поэтому подходит для счётчиков, которые должны быть
+общими: ограничение частоты запросов и метрики. Целые числа хранятся как есть,
+остальные значения — pickle. Просроченные записи удаляются раз в ``CULL_EVERY``
+записей, сверх ``MAX_ENTRIES`` — доля ``1 / CULL_FREQUENCY`` самых старых.
+"""
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS cache (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        expires REAL
+    ) WITHOUT ROWID
+"""
+ALIVE = "(expires IS NULL OR expires > ?)"
+
+
+class SQLiteCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = str(location)
+        self._cull_every = int(params.get("OPTIONS", {}).get("CULL_EVERY", 1000))
+        self._local = threading.local()
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # своё соединение в каждом потоке; autocommit — каждая операция отдельная транзакция
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self._path, timeout=5, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(SCHEMA)
+            self._local.db = db
+            self._local.writes = 0
+        return db
+
+    @staticmethod
+    def _encode(value):
+        if type(value) is int:
+            return value
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _decode(value):
+        return value if isinstance(value, int) else pickle.loads(value)
+
+    def _written(self):
+        self._local.writes += 1
+        if self._local.writes % self._cull_every == 0:
+            self._cull()
+
+    def _cull(self):
+        db = self._db
+        db.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+        (count,) = db.execute("SELECT COUNT(*) FROM cache").fetchone()
+        if count > self._max_entries:
+            db.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires LIMIT ?)",
+                (count // self._cull_frequency,),
+            )
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._db.execute(
+            "INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) "
+            f"ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires WHERE NOT {ALIVE}",
+            (key, self._encode(value), self.get_backend_timeout(timeout), time.time()),
+        )
+        self._written()
+        return cursor.rowcount == 1
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._db.execute(f"SELECT value FROM cache WHERE key = ? AND {ALIVE}", (key, time.time())).fetchone()
+        return default if row is None else self._decode(row[0])
+
+    def get_many(self, keys, version=None):
+        keys = {self.make_and_validate_key(key, version=version): key for key in keys}
+        if not keys:
+            return {}
+        rows = self._db.execute(
+            f"SELECT key, value FROM cache WHERE key IN ({', '.join('?' * len(keys))}) AND {ALIVE}",
+            [*keys, time.time()],
+        )
+        return {keys[key]: self._decode(value) for key, value in rows}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._db.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, self._encode(value), self.get_backend_timeout(timeout)),
+        )
+        self._written()
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._db.execute(
+            f"UPDATE cache SET expires = ? WHERE key = ? AND {ALIVE}",
+            (self.get_backend_timeout(timeout), key, time.time()),
+        )
+        return cursor.rowcount == 1
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._db.execute(
+            f"UPDATE cache SET value = value + ? WHERE key = ? AND typeof(value) = 'integer' AND {ALIVE} "
+            "RETURNING value",
+            (delta, key, time.time()),
+        ).fetchone()
+        if row is None:
+            raise ValueError("Key '%s' not found" % key)
+        return row[0]
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._db.execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount == 1
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._db.execute(f"SELECT 1 FROM cache WHERE key = ? AND {ALIVE}", (key, time.time())).fetchone() is not None
+
+    def clear(self):
+        self._db.execute("DELETE FROM cache")
+
+    def close(self, **kwargs):
+        # соединение живёт весь поток: открывать файл на каждый запрос дорого
+        pass
@@ -0,0 +1,89 @@
+"""
+Логирование без ввода-вывода в потоке запроса.
+
+``QueueListenerHandler`` только кладёт запись в очередь, а форматирование
+и запись в консоль и в файл (JSON по строке на запись) делает фоновый поток
+``QueueListener``. Фильтр ``RequestIdFilter`` добавляет к записи ``request_id`` —
+id запроса, который выставляет ``RequestIdMiddleware``; вне запроса это ``"-"``.
+
+Модуль подключается из ``LOGGING`` в настройках, поэтому не импортирует
+ничего, что требует загруженных настроек Django.
+"""
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+
+request_id = contextvars.ContextVar("request_id", default="-")
+
+# logging.getHandlerByName появился в Python 3.12
+get_handler = getattr(logging, "getHandlerByName", None) or logging._handlers.get
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            data["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class QueueListenerHandler(logging.handlers.QueueHandler):
+    """
+    Обработчик-очередь со своим ``QueueListener``, который передаёт записи
+    в обработчики с именами ``handlers`` (они должны быть настроены раньше). Фильтры этого обработчика (``request_id``) выполняются
+    в потоке запроса, фильтры и форматирование ``handlers`` — в потоке слушателя.
+    """
+    def __init__(self, handlers, respect_handler_level=True):
+        super().__init__(None)
+        self.handlers = [get_handler(name) for name in handlers]
+        self.respect_handler_level = respect_handler_level
+        self.listener = None
+        self.start()
+
+    def start(self):
+        # новая очередь: блокировка старой могла быть захвачена в момент fork
+        self.queue = queue.SimpleQueue()
+        self.pid = os.getpid()
+        self.listener = logging.handlers.QueueListener(
+            self.queue, *self.handlers, respect_handler_level=self.respect_handler_level,
+        )
+        self.listener.start()
+
+    def prepare(self, record):
+        # аргументы подставляются сразу: к моменту записи объекты могут измениться.
+        # exc_info остаётся — трассировку отформатирует слушатель
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        # после fork (gunicorn --preload) потока слушателя в дочернем процессе нет
+        if self.pid != os.getpid():
+            self.start()
+        super().enqueue(record)
+
+    def close(self):
+        # дожидаемся записи всего, что уже в очереди (в т.ч. при выходе из процесса)
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+        super().close()
@@ -0,0 +1,123 @@
+import contextlib
+import io
+import logging
+import logging.handlers
+import os
+import random
+import tempfile
+import time
+from timeit import default_timer
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from requestdataapp.logs import JsonFormatter, QueueListenerHandler, RequestIdFilter, request_id
+
+OLD_FORMAT = "%(asctime)s - [%(levelname)s] %(name)s: %(message)s"
+NEW_FORMAT = "%(asctime)s - [%(levelname)s] %(name)s [%(request_id)s]: %(message)s"
+
+
+class SlowFile(io.TextIOWrapper):
+    def __init__(self, path, delay, mode="w"):
+        super().__init__(open(path, mode + "b"), encoding="utf-8")
+        self.delay = delay
+
+    def flush(self):
+        super().flush()
+        if self.delay:
+            time.sleep(self.delay)
+
+
+class Command(BaseCommand):
+    """
+    Стоимость логирования на один запрос к главной странице магазина в потоке запроса.
+
+    ``print`` — как было: ``print`` в middleware и представлении и синхронный
+    ``StreamHandler``; ``sync`` — новые вызовы с консолью и JSON-файлом прямо в потоке
+    запроса; ``queue`` — то же через ``QueueListenerHandler``. Вывод идёт во временные
+    файлы; ``drain, ms`` — сколько после последнего запроса слушатель дописывал очередь.
+    ``--write-delay`` добавляет задержку к каждой записи на диск, как у медленного диска
+    или переполненного канала stdout.
+    """
+    help = "Benchmark per-request logging overhead: print vs synchronous vs queued handlers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=20_000)
+        parser.add_argument("--level", default="INFO", help="level of the benchmark logger")
+        parser.add_argument("--write-delay", type=float, default=0, help="extra milliseconds per flush")
+
+    def handle(self, *args, **options):
+        self.logger = logging.getLogger("bench.logging")
+        self.logger.propagate = False
+        self.logger.setLevel(options["level"].upper())
+        self.context = {
+            "time_running": default_timer(),
+            "products": [('Laptop', 1999), ('Desktop', 2999), ('Smartphone', 999)],
+            "items": 1,
+        }
+        total = options["requests"]
+
+        self.write_delay = options["write_delay"] / 1000
+        self.stdout.write(f"{total} requests, level {options['level'].upper()}, write delay {options['write_delay']} ms")
+        self.stdout.write(f"{'logging':<8}{'us/request':>12}{'drain, ms':>12}")
+        with tempfile.TemporaryDirectory() as directory:
+            with SlowFile(os.path.join(directory, "stdout.txt"), self.write_delay) as stream:
+                for name in ("print", "sync", "queue"):
+                    self.measure(name, total, directory, stream)
+
+    def make_handlers(self, name, directory, stream):
+        console = logging.StreamHandler(stream)
+        if name == "print":
+            console.setFormatter(logging.Formatter(OLD_FORMAT))
+            return [console]
+        console.setFormatter(logging.Formatter(NEW_FORMAT))
+        logfile = logging.handlers.RotatingFileHandler(
+            os.path.join(directory, f"{name}.jsonl"), maxBytes=settings.LOGFILE_SIZE,
+            backupCount=settings.LOGFILE_COUNT, delay=True,
+        )
+        logfile.stream = SlowFile(logfile.baseFilename, self.write_delay, mode="a")
+        logfile.setFormatter(JsonFormatter())
+        if name == "sync":
+            for handler in (console, logfile):
+                handler.addFilter(RequestIdFilter())
+            return [console, logfile]
+        console.set_name("bench-console")
+        logfile.set_name("bench-logfile")
+        handler = QueueListenerHandler(["bench-console", "bench-logfile"])
+        handler.addFilter(RequestIdFilter())
+        return [handler]
+
+    def old_request(self, stream):
+        with contextlib.redirect_stdout(stream):
+            print("Processing request...")
+            print("shop index context: ", self.context)
+            self.logger.info("Rendering shop index")
+            print("Processing response...")
+
+    def new_request(self, stream):
+        request_id.set(f"{random.getrandbits(128):032x}")
+        self.logger.debug("Processing request %s", "/shop/")
+        self.logger.debug("Shop index context: %s", self.context)
+        self.logger.info("Rendering shop index")
+        self.logger.debug("Processing response %s", 200)
+        request_id.set("-")
+
+    def measure(self, name, total, directory, stream):
+        handlers = self.make_handlers(name, directory, stream)
+        for handler in handlers:
+            self.logger.addHandler(handler)
+        request = self.old_request if name == "print" else self.new_request
+
+        started = default_timer()
+        for _ in range(total):
+            request(stream)
+        elapsed = default_timer() - started
+
+        finished = default_timer()
+        for handler in handlers:
+            self.logger.removeHandler(handler)
+            # для очереди close ждёт, пока слушатель допишет всё накопленное
+            handler.close()
+        stream.flush()
+        drain = default_timer() - finished
+        self.stdout.write(f"{name:<8}{elapsed / total * 10 ** 6:>12.1f}{drain * 1000:>12.1f}")
@@ -0,0 +1,116 @@
+import time
+import tracemalloc
+from timeit import default_timer
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.core.management import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.urls import resolve, reverse
+
+from requestdataapp.middlewares import ThrottlingMiddleware
+
+
+class DictThrottlingMiddleware:
+    """Прежняя реализация: список отметок времени на IP в словаре процесса."""
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.throttle_time = 60
+        self.throttle_limit = 30
+        self.cache = {}
+
+    def __call__(self, request):
+        ip_address = request.META["REMOTE_ADDR"]
+        if ip_address in self.cache:
+            timestamps = self.cache[ip_address]
+            now = time.time()
+            timestamps = [timestamp for timestamp in timestamps if timestamp > now - self.throttle_time]
+            if len(timestamps) >= self.throttle_limit:
+                return HttpResponse(status=429)
+            timestamps.append(now)
+            self.cache[ip_address] = timestamps
+        else:
+            self.cache[ip_address] = [time.time()]
+        return self.get_response(request)
+
+
+class Command(BaseCommand):
+    """
+    Накладные расходы ограничения частоты на запрос при ``--ips`` разных адресах:
+    прежний словарь в процессе против счётчиков в кеше ``THROTTLE_CACHE`` (или ``--cache``).
+
+    Запросы идут по кругу, на каждый адрес — ``--requests`` запросов.
+    """
+    help = "Benchmark ThrottlingMiddleware overhead with many distinct IPs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ips", type=int, default=10_000)
+        parser.add_argument("--requests", type=int, default=10, help="requests per IP")
+        parser.add_argument("--cache", default=getattr(settings, "THROTTLE_CACHE", "default"), help="cache alias")
+
+    def handle(self, *args, **options):
+        factory = RequestFactory(HTTP_HOST="localhost")
+        url = reverse("requestdataapp:get-view")
+        match = resolve(url)
+        requests = []
+        for i in range(options["ips"]):
+            request = factory.get(url, REMOTE_ADDR=f"10.{i // 65536}.{i // 256 % 256}.{i % 256}")
+            request.resolver_match = match
+            request.user = AnonymousUser()
+            requests.append(request)
+        total = options["ips"] * options["requests"]
+        ok = HttpResponse()
+
+        def get_response(request):
+            return ok
+
+        self.stdout.write(f"{total} requests from {options['ips']} IPs")
+        self.stdout.write(f"{'middleware':<12}{'us/request':>12}{'429':>8}{'memory, KB':>12}")
+
+        def dict_middleware():
+            return DictThrottlingMiddleware(get_response)
+
+        cache = caches[options["cache"]]
+
+        def cache_middleware():
+            cache.clear()
+            middleware = ThrottlingMiddleware(get_response)
+
+            def view(request):
+                return middleware.process_view(request, None, (), {}) or ok
+            return view
+
+        with override_settings(
+            THROTTLE_ENABLED=True, THROTTLE_CACHE=options["cache"],
+            THROTTLE_RATES={"anon": "30/min"}, THROTTLE_ROUTE_RATES={},
+        ):
+            for name, make in [("dict", dict_middleware), ("cache", cache_middleware)]:
+                self.measure(name, total, requests, options["requests"], make)
+            cache.clear()
+        self.stdout.write(f"cache backend: {type(cache).__name__}")
+
+    def replay(self, requests, rounds, call):
+        rejected = 0
+        for _ in range(rounds):
+            for request in requests:
+                if call(request).status_code == 429:
+                    rejected += 1
+        return rejected
+
+    def measure(self, name, total, requests, rounds, make):
+        call = make()
+        started = default_timer()
+        rejected = self.replay(requests, rounds, call)
+        elapsed = default_timer() - started
+
+        # память — отдельным прогоном: tracemalloc сильно замедляет выделения.
+        # Словарь прежней реализации живёт в процессе; счётчики в кеше — в памяти
+        # кеша (для LocMemCache — тоже в процессе, для файлового или общего — вне его)
+        tracemalloc.start()
+        call = make()
+        self.replay(requests, rounds, call)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        self.stdout.write(f"{name:<12}{elapsed / total * 10 ** 6:>12.1f}{rejected:>8}{memory / 1024:>12.0f}")
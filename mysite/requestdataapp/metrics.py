@@ -0,0 +1,231 @@
+"""
+Метрики запросов в формате Prometheus.
+
+Каждый процесс копит счётчики в памяти (словарь под блокировкой, без ввода-вывода
+на запрос) и не чаще раза в ``METRICS_FLUSH_INTERVAL`` секунд записывает их
+в свой файл в ``METRICS_DIR``. ``/metrics`` складывает файлы всех процессов,
+поэтому воркеры gunicorn видны вместе, а счётчики завершившихся процессов
+остаются в сумме и после перезапуска: при сборе их файлы сливаются в один
+``archive.json`` и удаляются, так что файлов не больше, чем живых процессов.
+Без ``METRICS_DIR`` видны только метрики текущего процесса.
+
+Гистограмма хранится как счётчики ``<name>_bucket`` по верхней границе корзины
+(не накопительно), ``<name>_sum`` и ``<name>_count``; накопительные ``le``
+по всем границам гистограммы (``BUCKETS``, по умолчанию ``LATENCY_BUCKETS``)
+считаются при выводе.
+"""
+import atexit
+import contextlib
+import fcntl
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, float("inf"))
+
+METRICS = {
+    "http_requests_total": ("counter", "Requests by route, method and status code."),
+    "http_request_duration_seconds": ("histogram", "Request latency by route."),
+    "http_exceptions_total": ("counter", "Unhandled view exceptions by route and exception class."),
+    "db_queries_per_request": ("histogram", "SQL queries per request by route."),
+    "db_duration_seconds": ("histogram", "Time spent in the database per request by route."),
+    "db_query_budget_exceeded_total": ("counter", "Requests over the query count or DB time budget by route."),
+}
+BUCKETS = {
+    "db_queries_per_request": QUERY_COUNT_BUCKETS,
+}
+ARCHIVE = "archive.json"
+
+
+def pid_alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_json(path):
+    """Содержимое файла; ``None``, если файла нет или он повреждён."""
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def parse_samples(samples) -> dict:
+    """``[[name, labels, value], ...]`` из файла в ``{(name, labels): value}``."""
+    return {(name, tuple(tuple(pair) for pair in labels)): value for name, labels, value in samples}
+
+
+def write_json(path, data):
+    # запись во временный файл и переименование: читатель не увидит половину файла
+    with open(path + ".tmp", "w") as file:
+        json.dump(data, file)
+    os.replace(path + ".tmp", path)
+
+
+class Registry:
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.values = defaultdict(float)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.values.clear()
+        self.flushed_at = time.monotonic()
+        # pid может достаться новому процессу: время старта делает имя файла уникальным
+        self.filename = f"{os.getpid()}-{time.time_ns()}.json"
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            self.values[name, labels] += value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        bound = buckets[bisect_left(buckets, value)]
+        with self.lock:
+            self.values[f"{name}_bucket", labels + (("le", bound),)] += 1
+            self.values[f"{name}_sum", labels] += value
+            self.values[f"{name}_count", labels] += 1
+
+    def maybe_flush(self):
+        if self.directory and time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        # процессы без запросов (manage.py, мастер gunicorn) файлов не оставляют
+        if not self.directory or not self.values:
+            return
+        self.flushed_at = time.monotonic()
+        with self.lock:
+            samples = [[name, list(labels), value] for (name, labels), value in self.values.items()]
+        os.makedirs(self.directory, exist_ok=True)
+        write_json(os.path.join(self.directory, self.filename), samples)
+
+    @contextlib.contextmanager
+    def archive_lock(self, operation):
+        # слияние (LOCK_EX) не идёт одновременно с другим слиянием или чтением (LOCK_SH):
+        # иначе файл, уже слитый в архив, попал бы в сумму дважды
+        with open(os.path.join(self.directory, "archive.lock"), "w") as lock:
+            fcntl.flock(lock, operation)
+            yield
+
+    def archive_dead(self):
+        """
+        Сливает файлы завершившихся процессов в ``ARCHIVE`` и удаляет их.
+
+        Архив хранит имена слитых файлов: если процесс упадёт между записью
+        архива и удалением файлов, следующий сбор не прибавит их второй раз.
+        """
+        filenames = os.listdir(self.directory)
+        dead = [
+            filename for filename in filenames
+            if filename.split("-", 1)[0].isdigit() and not pid_alive(int(filename.split("-", 1)[0]))
+        ]
+        if not dead:
+            return
+        with self.archive_lock(fcntl.LOCK_EX):
+            path = os.path.join(self.directory, ARCHIVE)
+            archive = read_json(path) or {"merged": [], "samples": []}
+            merged = set(archive["merged"])
+            total = defaultdict(float, parse_samples(archive["samples"]))
+            for filename in dead:
+                samples = None if filename in merged else read_json(os.path.join(self.directory, filename))
+                if samples is None:
+                    continue
+                for key, value in parse_samples(samples).items():
+                    total[key] += value
+                merged.add(filename)
+            write_json(path, {
+                "merged": sorted(merged & set(filenames)),
+                "samples": [[name, list(labels), value] for (name, labels), value in total.items()],
+            })
+            for filename in dead:
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except FileNotFoundError:
+                    pass
+
+    def collect(self) -> dict:
+        """Сумма метрик всех процессов: ``{(name, labels): value}``."""
+        if not self.directory:
+            with self.lock:
+                return dict(self.values)
+        self.flush()
+        if not os.path.isdir(self.directory):
+            return {}
+        self.archive_dead()
+        total = defaultdict(float)
+        with self.archive_lock(fcntl.LOCK_SH):
+            for filename in os.listdir(self.directory):
+                data = read_json(os.path.join(self.directory, filename)) if filename.endswith(".json") else None
+                if data is None:
+                    continue
+                for key, value in parse_samples(data["samples"] if filename == ARCHIVE else data).items():
+                    total[key] += value
+        return total
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+
+def format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def render(samples: dict) -> str:
+    """Текстовый формат Prometheus 0.0.4."""
+    by_metric = defaultdict(list)
+    for (name, labels), value in samples.items():
+        metric = next((metric for metric in METRICS if name == metric or name.startswith(metric + "_")), name)
+        by_metric[metric].append((name, labels, value))
+
+    lines = []
+    for metric in sorted(by_metric):
+        kind, help_text = METRICS.get(metric, ("untyped", ""))
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        buckets = defaultdict(list)
+        for name, labels, value in sorted(by_metric[metric], key=lambda sample: (sample[0], str(sample[1]))):
+            if kind == "histogram" and name == f"{metric}_bucket":
+                *rest, (_, bound) = labels
+                buckets[tuple(rest)].append((bound, value))
+            else:
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        for labels, counts in sorted(buckets.items(), key=lambda item: str(item[0])):
+            counts = dict(counts)
+            cumulative = 0
+            for bound in BUCKETS.get(metric, LATENCY_BUCKETS):
+                cumulative += counts.get(bound, 0)
+                bucket_labels = format_labels(labels + (("le", format_value(bound)),))
+                lines.append(f"{metric}_bucket{bucket_labels} {format_value(cumulative)}")
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry(
+    directory=getattr(settings, "METRICS_DIR", None),
+    flush_interval=getattr(settings, "METRICS_FLUSH_INTERVAL", 1.0),
+)
+atexit.register(registry.flush)
+# gunicorn --preload: воркер не должен писать в файл мастера и наследовать его счётчики
+os.register_at_fork(after_in_child=registry.reset)
@@ -1,60 +1,230 @@
-from django.http import HttpRequest, HttpResponse
+import logging
+import random
+import re
 import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import connections
+from django.dispatch import receiver
+from django.http import HttpRequest, HttpResponse
+
+from . import logs, metrics, profiling
+from .throttling import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THROTTLE_RATES = {"anon": "30/min", "user": "120/min"}
+DEFAULT_QUERY_BUDGET = {"queries": 50, "seconds": 0.5}
+REQUEST_ID_RE = re.compile(r"[\w.-]{1,64}", re.ASCII)
+
+
+class RequestIdMiddleware:
+    """
+    Id запроса для логов (``request_id`` в записях, см. :mod:`requestdataapp.logs`).
+    Берётся из заголовка ``X-Request-ID``, если его выставил прокси, иначе создаётся;
+    возвращается в том же заголовке ответа.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest):
+        request_id = request.META.get("HTTP_X_REQUEST_ID", "")
+        if not REQUEST_ID_RE.fullmatch(request_id):
+            # не uuid4: os.urandom на каждый запрос заметно дороже, а криптостойкость id не нужна
+            request_id = f"{random.getrandbits(128):032x}"
+        request.request_id = request_id
+        # сбрасывается только по request_finished: django.request пишет об ответах 4xx/5xx
+        # уже после выхода из цепочки middleware
+        logs.request_id.set(request_id)
+        response = self.get_response(request)
+        response["X-Request-ID"] = request_id
+        return response
+
+
+@receiver(request_finished)
+def reset_request_id(**kwargs):
+    logs.request_id.set("-")
 
 
 def set_useragent_on_request_middleware(get_response):
-    print("Initializing middleware...")
+    logger.debug("Initializing middleware...")
 
     def middleware(request: HttpRequest):
-        print("Processing request...")
+        logger.debug("Processing request %s", request.path)
         request.user_agent = request.META["HTTP_USER_AGENT"]
         response = get_response(request)
-        print("Processing response...")
+        logger.debug("Processing response %s", response.status_code)
         return response
 
     return middleware
 
 
-class CountRequestsMiddleware:
+class MetricsMiddleware:
+    """
+    Число запросов по маршрутам, методам и статусам, задержки и исключения,
+    см. :mod:`requestdataapp.metrics`.
+    """
     def __init__(self, get_response):
         self.get_response = get_response
-        self.request_count = 0
-        self.responses_count = 0
-        self.exceptions_count = 0
+        self.registry = metrics.registry
 
     def __call__(self, request: HttpRequest):
-        self.request_count += 1
-        print(f"Request counts: {self.request_count}, path: {request.path}")
+        started = time.perf_counter()
         response = self.get_response(request)
-        self.responses_count += 1
-        print(f"Response counts: {self.responses_count}, path: {request.path}")
+        elapsed = time.perf_counter() - started
+        route = self.route(request)
+        self.registry.inc(
+            "http_requests_total",
+            (("route", route), ("method", request.method), ("status", str(response.status_code))),
+        )
+        self.registry.observe("http_request_duration_seconds", (("route", route),), elapsed)
+        self.registry.maybe_flush()
         return response
 
     def process_exception(self, request: HttpRequest, exception: Exception):
-        self.exceptions_count += 1
-        print(f"Exception counts: {self.exceptions_count}, path: {request.path}")
+        self.registry.inc(
+            "http_exceptions_total",
+            (("route", self.route(request)), ("exception", type(exception).__name__)),
+        )
 
+    @staticmethod
+    def route(request: HttpRequest) -> str:
+        # имя маршрута, а не путь: число рядов метрик не зависит от id в URL
+        match = getattr(request, "resolver_match", None)
+        return match.view_name if match is not None else "<unresolved>"
 
-class ThrottlingMiddleware:
+
+class QueryProfilerMiddleware:
+    """
+    Число SQL-запросов и время в БД на каждый запрос, см. :mod:`requestdataapp.profiling`.
+
+    ``QUERY_BUDGET`` — бюджет на запрос (``queries`` и ``seconds``, ``None`` — без
+    ограничения), ``QUERY_ROUTE_BUDGETS`` — бюджеты маршрутов по ``view_name``
+    (недостающие ключи берутся из ``QUERY_BUDGET``). Запросы сверх бюджета пишутся
+    в лог с самыми медленными SQL; для SQL дольше ``SLOW_QUERY_SECONDS`` — с планом.
+    """
     def __init__(self, get_response):
         self.get_response = get_response
-        self.throttle_time = 60
-        self.throttle_limit = 30
-        self.cache = {}
+        self.enabled = getattr(settings, "QUERY_PROFILER_ENABLED", True)
+        self.budget = {**DEFAULT_QUERY_BUDGET, **getattr(settings, "QUERY_BUDGET", {})}
+        self.route_budgets = {
+            route: {**self.budget, **budget}
+            for route, budget in getattr(settings, "QUERY_ROUTE_BUDGETS", {}).items()
+        }
+        self.slow_seconds = getattr(settings, "SLOW_QUERY_SECONDS", 0.1)
+        self.registry = metrics.registry
+        self.slow_queries = profiling.slow_queries
 
     def __call__(self, request: HttpRequest):
-        ip_address = request.META["REMOTE_ADDR"]
-        if ip_address in self.cache:
-            timestamps = self.cache[ip_address]
-            now = time.time()
-            timestamps = [timestamp for timestamp in timestamps if timestamp > now - self.throttle_time]
-            if len(timestamps) >= self.throttle_limit:
-                return HttpResponse('Слишком много запросов. Подождите {} секунд.'.format(self.throttle_time -
-                                                                                          (now - timestamps[-1])),
-                                    status=429)
-            timestamps.append(now)
-            self.cache[ip_address] = timestamps
+        if not self.enabled:
+            return self.get_response(request)
+        profile = profiling.QueryProfile()
+        with self.profiling(profile):
+            response = self.get_response(request)
+        if response.streaming and not response.is_async:
+            # SQL выполняются при отдаче тела, уже после выхода из middleware
+            response.streaming_content = self.stream(response.streaming_content, request, profile)
         else:
-            self.cache[ip_address] = [time.time()]
+            self.finish(request, profile)
+        return response
+
+    @staticmethod
+    @contextmanager
+    def profiling(profile):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile))
+            yield
+
+    def stream(self, content, request: HttpRequest, profile):
+        try:
+            with self.profiling(profile):
+                yield from content
+        finally:
+            self.finish(request, profile)
+
+    def finish(self, request: HttpRequest, profile):
+        route = MetricsMiddleware.route(request)
+        labels = (("route", route),)
+        self.registry.observe("db_queries_per_request", labels, profile.count, metrics.QUERY_COUNT_BUCKETS)
+        self.registry.observe("db_duration_seconds", labels, profile.duration)
+
+        slowest = []
+        for duration, sql, params, many, connection in profile.slowest():
+            plan = None
+            # план одного и того же SQL достаточно получить один раз
+            if duration >= self.slow_seconds and not many and not self.slow_queries.has_plan(route, sql):
+                plan = profiling.explain(connection, sql, params)
+            self.slow_queries.add(route, duration, sql, plan)
+            slowest.append((duration, sql, plan))
+
+        budget = self.route_budgets.get(route, self.budget)
+        if (
+            (budget["queries"] is None or profile.count <= budget["queries"])
+            and (budget["seconds"] is None or profile.duration <= budget["seconds"])
+        ):
+            return
+        self.registry.inc("db_query_budget_exceeded_total", labels)
+        details = ""
+        for duration, sql, plan in slowest:
+            details += f"\n  {duration * 1000:.1f} ms: {sql}"
+            if plan:
+                details += "\n    " + plan.replace("\n", "\n    ")
+        logger.warning(
+            "Query budget exceeded on %s %s (%s): %d queries, %.1f ms in DB; slowest:%s",
+            request.method, request.path, route, profile.count, profile.duration * 1000, details,
+        )
+
+
+class ThrottlingMiddleware:
+    """
+    Ограничение частоты запросов: анонимы считаются по IP, пользователи — по id.
+
+    ``THROTTLE_RATES`` — лимиты на все маршруты вместе, ``THROTTLE_ROUTE_RATES`` —
+    лимиты отдельных маршрутов по ``view_name`` (со своими счётчиками; недостающие
+    ключи берутся из ``THROTTLE_RATES``). Счётчики хранятся в кеше ``THROTTLE_CACHE``,
+    см. :mod:`requestdataapp.throttling`. При превышении — 429 и ``Retry-After``.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, "THROTTLE_ENABLED", True)
+        alias = getattr(settings, "THROTTLE_CACHE", "default")
+        self.default_limiters = self.make_limiters(
+            getattr(settings, "THROTTLE_RATES", DEFAULT_THROTTLE_RATES), alias, "throttle:default",
+        )
+        self.route_limiters = {
+            route: self.make_limiters(rates, alias, f"throttle:{route}")
+            for route, rates in getattr(settings, "THROTTLE_ROUTE_RATES", {}).items()
+        }
+
+    @staticmethod
+    def make_limiters(rates, alias, prefix):
+        return {
+            kind: RateLimiter(rate, alias, f"{prefix}:{kind}")
+            for kind, rate in rates.items() if rate is not None
+        }
 
+    def __call__(self, request: HttpRequest):
         return self.get_response(request)
+
+    def process_view(self, request: HttpRequest, view_func, view_args, view_kwargs):
+        # маршрут известен только после разрешения URL
+        if not self.enabled:
+            return None
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            kind, ident = "user", user.pk
+        else:
+            kind, ident = "anon", request.META.get("REMOTE_ADDR", "")
+        route = request.resolver_match.view_name
+        limiter = self.route_limiters.get(route, {}).get(kind) or self.default_limiters.get(kind)
+        if limiter is None:
+            return None
+        retry_after = limiter.hit(str(ident))
+        if retry_after is None:
+            return None
+        response = HttpResponse('Слишком много запросов. Подождите {} секунд.'.format(retry_after), status=429)
+        response["Retry-After"] = str(retry_after)
+        return response
@@ -0,0 +1,132 @@
+"""
+Профиль SQL-запросов каждого HTTP-запроса через ``connection.execute_wrapper``.
+
+На запрос считаются число SQL-запросов и время в БД. В метрики
+(:mod:`requestdataapp.metrics`) они попадают гистограммами ``db_queries_per_request``
+и ``db_duration_seconds`` по маршрутам, поэтому суммы видны по всем воркерам.
+Запросы сверх бюджета пишутся в лог вместе с самыми медленными SQL, а для
+SELECT дольше порога добавляется план (``EXPLAIN QUERY PLAN`` в SQLite).
+Самые медленные SQL каждого маршрута хранятся в памяти процесса (``slow_queries``).
+
+На SQL-запрос — два вызова ``perf_counter`` и сравнение с кучей из нескольких
+элементов, так что профиль можно не выключать в production.
+"""
+import heapq
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.db import DatabaseError, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class QueryProfile:
+    """Обёртка для ``execute_wrapper``: число SQL, время в БД и ``size`` самых медленных SQL."""
+    def __init__(self, size=3):
+        self.size = size
+        self.count = 0
+        self.duration = 0.0
+        self._slowest = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            # номер запроса — чтобы куча не сравнивала SQL и параметры при равном времени
+            item = (duration, self.count, sql, params, many, context["connection"])
+            if len(self._slowest) < self.size:
+                heapq.heappush(self._slowest, item)
+            elif duration > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, item)
+
+    def slowest(self) -> list:
+        """``(duration, sql, params, many, connection)`` по убыванию времени."""
+        return [(duration, *rest) for duration, _, *rest in sorted(self._slowest, reverse=True)]
+
+
+def explain(connection, sql, params):
+    """План SELECT-запроса строками через ``\\n``; ``None`` для остальных и при ошибке."""
+    if not sql.lstrip()[:6].upper() == "SELECT":
+        return None
+    try:
+        # точка сохранения: ошибка EXPLAIN не должна ломать транзакцию запроса
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+            return "\n".join(str(row[-1]) for row in cursor.fetchall())
+    except DatabaseError:
+        logger.debug("Cannot explain %s", sql, exc_info=True)
+        return None
+
+
+class SlowQueries:
+    """Самые медленные SQL по маршрутам: не больше ``size`` разных SQL на маршрут."""
+    def __init__(self, size=5):
+        self.size = size
+        self.lock = threading.Lock()
+        self.routes = defaultdict(dict)
+
+    def add(self, route, duration, sql, plan=None):
+        with self.lock:
+            statements = self.routes[route]
+            if sql in statements:
+                known_duration, known_plan = statements[sql]
+                statements[sql] = (max(duration, known_duration), plan or known_plan)
+                return
+            if len(statements) >= self.size:
+                fastest = min(statements, key=lambda statement: statements[statement][0])
+                if statements[fastest][0] >= duration:
+                    return
+                del statements[fastest]
+            statements[sql] = (duration, plan)
+
+    def has_plan(self, route, sql) -> bool:
+        with self.lock:
+            return self.routes.get(route, {}).get(sql, (None, None))[1] is not None
+
+    def get(self, route) -> list:
+        with self.lock:
+            statements = list(self.routes.get(route, {}).items())
+        statements.sort(key=lambda item: item[1][0], reverse=True)
+        return [{"sql": sql, "ms": round(duration * 1000, 3), "plan": plan} for sql, (duration, plan) in statements]
+
+    def clear(self):
+        with self.lock:
+            self.routes.clear()
+
+
+def worst_endpoints(samples: dict, sort="db_time", limit=20) -> list:
+    """
+    Маршруты из метрик ``samples`` (см. ``Registry.collect``) по убыванию
+    ``sort``: ``db_time`` — суммарное время в БД, ``queries`` — среднее число SQL
+    на запрос, ``over_budget`` — число запросов сверх бюджета.
+    """
+    routes = defaultdict(lambda: defaultdict(float))
+    for (name, labels), value in samples.items():
+        if name in ("db_queries_per_request_sum", "db_queries_per_request_count",
+                    "db_duration_seconds_sum", "db_query_budget_exceeded_total"):
+            routes[dict(labels)["route"]][name] += value
+
+    endpoints = []
+    for route, values in routes.items():
+        requests = values["db_queries_per_request_count"]
+        if not requests:
+            continue
+        endpoints.append({
+            "route": route,
+            "requests": int(requests),
+            "queries": round(values["db_queries_per_request_sum"] / requests, 2),
+            "db_time": round(values["db_duration_seconds_sum"], 6),
+            "db_ms_per_request": round(values["db_duration_seconds_sum"] / requests * 1000, 3),
+            "over_budget": int(values["db_query_budget_exceeded_total"]),
+        })
+    endpoints.sort(key=lambda endpoint: endpoint[sort], reverse=True)
+    return endpoints[:limit]
+
+
+slow_queries = SlowQueries()
@@ -1,3 +1,313 @@
-from django.test import TestCase
+import json
+import logging
+import logging.handlers
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from .cache_backends import SQLiteCache
+from .logs import JsonFormatter, QueueListenerHandler, RequestIdFilter, request_id
+from .metrics import Registry, render
+from .middlewares import QueryProfilerMiddleware
+from .profiling import QueryProfile, SlowQueries, explain
+from .throttling import RateLimiter, parse_rate
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RateLimiterTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate("30/min"), (30, 60))
+        self.assertEqual(parse_rate("5/10"), (5, 10))
+        self.assertIsNone(parse_rate(None))
+
+    def test_sliding_window(self):
+        limiter = RateLimiter("3/min")
+        start = 60 * 1000
+        for ident in ("a", "b"):
+            self.assertEqual([limiter.hit(ident, start + second) for second in range(3)], [None] * 3)
+        # в том же окне: ждать, пока 4 запроса окна не станут весить меньше 3 - 1
+        self.assertEqual(limiter.hit("a", start + 10), 80)
+        # в следующем окне: 3 * 50/60 + 1 > 3, через 30 секунд будет 3 * 20/60 + 2
+        self.assertEqual(limiter.hit("b", start + 70), 30)
+        self.assertIsNone(limiter.hit("b", start + 100))
+        self.assertIsNone(limiter.hit("c", start + 10))
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    THROTTLE_ENABLED=True,
+    THROTTLE_CACHE="default",
+    THROTTLE_RATES={"anon": "2/min", "user": "4/min"},
+    THROTTLE_ROUTE_RATES={"requestdataapp:user-form": {"anon": "1/min"}},
+)
+class ThrottlingMiddlewareTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def get(self, name, ip="10.0.0.1"):
+        return self.client.get(reverse(f"requestdataapp:{name}"), HTTP_USER_AGENT='Mozilla/5.0', REMOTE_ADDR=ip)
+
+    def test_anonymous_limit_per_ip(self):
+        self.assertEqual([self.get("get-view").status_code for _ in range(2)], [200, 200])
+        response = self.get("get-view")
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response["Retry-After"]), 0)
+        self.assertEqual(self.get("get-view", ip="10.0.0.2").status_code, 200)
+
+    def test_route_limit_has_own_counter(self):
+        self.assertEqual(self.get("user-form").status_code, 200)
+        self.assertEqual(self.get("user-form").status_code, 429)
+        self.assertEqual(self.get("get-view").status_code, 200)
+
+    def test_user_limit(self):
+        self.client.force_login(User.objects.create_user(username='throttled_user'))
+        statuses = [self.get("get-view", ip=f"10.0.1.{i}").status_code for i in range(5)]
+        self.assertEqual(statuses, [200] * 4 + [429])
+
+
+class SQLiteCacheTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = Path(directory.name) / "cache.sqlite3"
+        self.cache = self.make_cache()
+
+    def make_cache(self, **options):
+        return SQLiteCache(self.location, {"OPTIONS": options})
+
+    def test_cache_api(self):
+        self.assertTrue(self.cache.add("counter", 1, timeout=60))
+        self.assertFalse(self.cache.add("counter", 5))
+        self.assertEqual(self.cache.incr("counter", 2), 3)
+        self.assertRaises(ValueError, self.cache.incr, "missing")
+        self.cache.set("data", {"a": [1, 2]})
+        self.assertEqual(self.cache.get_many(["counter", "data", "missing"]), {"counter": 3, "data": {"a": [1, 2]}})
+        self.assertTrue(self.cache.delete("data"))
+        self.assertIsNone(self.cache.get("data"))
+
+    def test_expired_keys(self):
+        self.cache.set("old", 1, timeout=-1)
+        self.assertIsNone(self.cache.get("old"))
+        self.assertRaises(ValueError, self.cache.incr, "old")
+        self.assertTrue(self.cache.add("old", 2))
+        self.assertEqual(self.cache.get("old"), 2)
+
+    def test_shared_between_instances_and_culled(self):
+        # как два воркера с одним файлом
+        other = self.make_cache(MAX_ENTRIES=10, CULL_EVERY=5)
+        self.cache.add("hits", 0)
+        self.cache.incr("hits")
+        self.assertEqual(other.incr("hits"), 2)
+        for i in range(20):
+            other.set(f"key{i}", i)
+        self.assertLessEqual(len(other.get_many([f"key{i}" for i in range(20)])), 15)
+
+
+class MetricsRegistryTestCase(TestCase):
+    def test_workers_are_summed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            workers = [Registry(directory), Registry(directory)]
+            for worker in workers:
+                worker.inc("http_requests_total", (("route", "shop"), ("status", "200")))
+                worker.observe("http_request_duration_seconds", (("route", "shop"),), 0.02)
+            workers[0].flush()
+            workers[1].observe("http_request_duration_seconds", (("route", "shop"),), 7)
+            text = render(workers[1].collect())
+        self.assertIn('http_requests_total{route="shop",status="200"} 2', text)
+        self.assertIn('http_request_duration_seconds_bucket{route="shop",le="0.01"} 0', text)
+        self.assertIn('http_request_duration_seconds_bucket{route="shop",le="0.025"} 2', text)
+        self.assertIn('http_request_duration_seconds_bucket{route="shop",le="+Inf"} 3', text)
+        self.assertIn('http_request_duration_seconds_count{route="shop"} 3', text)
+        self.assertIn("# TYPE http_request_duration_seconds histogram", text)
+
+    def test_files_of_dead_processes_are_archived(self):
+        labels = (("route", "shop"), ("status", "200"))
+        process = subprocess.Popen(["true"])
+        process.wait()
+        with tempfile.TemporaryDirectory() as directory:
+            def write(filename):
+                registry = Registry(directory)
+                registry.filename = filename
+                registry.inc("http_requests_total", labels)
+                registry.flush()
+
+            for started in range(3):
+                write(f"{process.pid}-{started}.json")
+            live = Registry(directory)
+            live.inc("http_requests_total", labels)
+            self.assertEqual(live.collect()[("http_requests_total", labels)], 4)
+            self.assertEqual(sorted(os.listdir(directory)), sorted([live.filename, "archive.json", "archive.lock"]))
+            self.assertEqual(live.collect()[("http_requests_total", labels)], 4)
+
+            # файл, не удалённый после слияния, не считается второй раз
+            write(f"{process.pid}-2.json")
+            write(f"{process.pid}-3.json")
+            self.assertEqual(live.collect()[("http_requests_total", labels)], 5)
+            self.assertEqual(len(os.listdir(directory)), 3)
+
+    def test_label_escaping(self):
+        registry = Registry()
+        registry.inc("http_exceptions_total", (("exception", 'Bad "quote"\\'),))
+        self.assertIn(r'http_exceptions_total{exception="Bad \"quote\"\\"} 1', render(registry.collect()))
+
+
+@override_settings(METRICS_ALLOWED_IPS=["127.0.0.1"])
+class MetricsViewTestCase(TestCase):
+    def setUp(self):
+        self.registry = Registry()
+        for target in ("requestdataapp.metrics.registry", "requestdataapp.views.registry"):
+            patcher = mock.patch(target, self.registry)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_requests_are_counted(self):
+        self.client.get(reverse("requestdataapp:get-view"), HTTP_USER_AGENT='Mozilla/5.0')
+        self.client.get("/req/missing/", HTTP_USER_AGENT='Mozilla/5.0')
+        response = self.client.get(reverse("metrics"), HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('http_requests_total{route="requestdataapp:get-view",method="GET",status="200"} 1', text)
+        self.assertIn('http_requests_total{route="<unresolved>",method="GET",status="404"} 1', text)
+        self.assertIn('http_request_duration_seconds_count{route="requestdataapp:get-view"} 1', text)
+
+    def test_forbidden_for_other_addresses(self):
+        response = self.client.get(reverse("metrics"), HTTP_USER_AGENT='Mozilla/5.0', REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(response.status_code, 403)
+
+
+class QueueListenerHandlerTestCase(TestCase):
+    def test_records_are_written_by_listener(self):
+        target = logging.handlers.BufferingHandler(10)
+        target.set_name("queue-test-target")
+        target.setFormatter(JsonFormatter())
+        handler = QueueListenerHandler(["queue-test-target"])
+        handler.addFilter(RequestIdFilter())
+        logger = logging.getLogger("requestdataapp.tests.queue")
+        logger.propagate = False
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+
+        items = [1]
+        token = request_id.set("abc")
+        logger.warning("Items: %s", items)
+        request_id.reset(token)
+        items.append(2)
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception("Failed")
+        # close дожидается, пока слушатель запишет очередь
+        handler.close()
+
+        first, second = [json.loads(target.format(record)) for record in target.buffer]
+        self.assertEqual(first["message"], "Items: [1]")
+        self.assertEqual(first["request_id"], "abc")
+        self.assertEqual(first["level"], "WARNING")
+        self.assertEqual(second["request_id"], "-")
+        self.assertIn("ZeroDivisionError", second["exc_info"])
+
+
+class RequestIdMiddlewareTestCase(TestCase):
+    def get(self, **headers):
+        return self.client.get(reverse("requestdataapp:get-view"), HTTP_USER_AGENT='Mozilla/5.0', **headers)
+
+    def test_request_id_header(self):
+        first, second = self.get()["X-Request-ID"], self.get()["X-Request-ID"]
+        self.assertRegex(first, r"^[0-9a-f]{32}$")
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.get(HTTP_X_REQUEST_ID="lb-1234.5")["X-Request-ID"], "lb-1234.5")
+        self.assertNotIn("\n", self.get(HTTP_X_REQUEST_ID="bad\nid")["X-Request-ID"])
+        self.assertEqual(request_id.get(), "-")
+
+
+class QueryProfileTestCase(TestCase):
+    def test_counts_and_slowest(self):
+        profile = QueryProfile(size=2)
+        with connection.execute_wrapper(profile):
+            User.objects.count()
+            list(User.objects.filter(username="profiled"))
+            User.objects.exists()
+        self.assertEqual(profile.count, 3)
+        self.assertGreater(profile.duration, 0)
+        slowest = profile.slowest()
+        self.assertEqual(len(slowest), 2)
+        self.assertGreaterEqual(slowest[0][0], slowest[1][0])
+
+    def test_explain(self):
+        profile = QueryProfile(size=1)
+        with connection.execute_wrapper(profile):
+            list(User.objects.filter(username="profiled"))
+        _, sql, params, _, _ = profile.slowest()[0]
+        self.assertIn("auth_user", explain(connection, sql, params))
+        self.assertIsNone(explain(connection, "UPDATE auth_user SET is_active = %s", [True]))
+
+    def test_slow_queries_keep_slowest(self):
+        slow = SlowQueries(size=2)
+        slow.add("route", 0.1, "SELECT 1")
+        slow.add("route", 0.3, "SELECT 2", "SCAN t")
+        slow.add("route", 0.2, "SELECT 3")
+        slow.add("route", 0.05, "SELECT 2")
+        self.assertEqual([item["sql"] for item in slow.get("route")], ["SELECT 2", "SELECT 3"])
+        self.assertTrue(slow.has_plan("route", "SELECT 2"))
+
+
+@override_settings(
+    QUERY_BUDGET={"queries": 1, "seconds": None},
+    SLOW_QUERY_SECONDS=0,
+    METRICS_ALLOWED_IPS=["127.0.0.1"],
+)
+class QueryProfilerMiddlewareTestCase(TestCase):
+    def setUp(self):
+        self.registry = Registry()
+        self.slow_queries = SlowQueries()
+        for target, value in [
+            ("requestdataapp.metrics.registry", self.registry),
+            ("requestdataapp.views.registry", self.registry),
+            ("requestdataapp.profiling.slow_queries", self.slow_queries),
+            ("requestdataapp.views.slow_queries", self.slow_queries),
+        ]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_budget_and_worst_endpoints(self):
+        self.client.force_login(User.objects.create_user(username='profiled_user', is_staff=True))
+        # не из METRICS_ALLOWED_IPS: сессия и пользователь — два SQL при бюджете в один
+        with self.assertLogs("requestdataapp.middlewares", "WARNING") as logs:
+            self.client.get(reverse("metrics"), HTTP_USER_AGENT='Mozilla/5.0', REMOTE_ADDR="10.0.0.1")
+        self.assertIn("(metrics): 2 queries", logs.output[0])
+        self.assertIn("auth_user", logs.output[0])
+
+        response = self.client.get(reverse("query-profile"), {"sort": "queries"}, HTTP_USER_AGENT='Mozilla/5.0')
+        endpoint = next(item for item in response.json()["endpoints"] if item["route"] == "metrics")
+        self.assertEqual((endpoint["requests"], endpoint["queries"], endpoint["over_budget"]), (1, 2, 1))
+        self.assertEqual(len(endpoint["slowest"]), 2)
+        self.assertTrue(all(statement["plan"] for statement in endpoint["slowest"]))
+
+        response = self.client.get(reverse("query-profile"), {"sort": "name"}, HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(response.status_code, 400)
+
+    def test_streaming_response(self):
+        def get_response(request):
+            return StreamingHttpResponse(str(User.objects.count()) for _ in range(3))
+
+        response = QueryProfilerMiddleware(get_response)(RequestFactory().get("/"))
+        self.assertEqual(self.registry.collect(), {})
+        with self.assertLogs("requestdataapp.middlewares", "WARNING"):
+            self.assertEqual(b"".join(response.streaming_content), b"000")
+        samples = self.registry.collect()
+        self.assertEqual(samples["db_queries_per_request_sum", (("route", "<unresolved>"),)], 3)
@@ -0,0 +1,62 @@
+"""
+Ограничение частоты запросов через общий кеш Django.
+
+Счётчик — скользящее окно из двух фиксированных: на запрос один ``incr``
+текущего окна (``add`` для первого запроса) и одно чтение предыдущего,
+независимо от числа запросов клиента. Ключи живут два окна, так что память ограничена числом
+активных клиентов, а счётчики общие для всех процессов, работающих с этим кешем.
+"""
+import math
+import time
+
+from django.core.cache import caches
+
+PERIODS = {"s": 1, "sec": 1, "m": 60, "min": 60, "h": 60 * 60, "hour": 60 * 60, "d": 24 * 60 * 60, "day": 24 * 60 * 60}
+
+
+def parse_rate(rate):
+    """``"30/min"`` -> ``(30, 60)``; ``None`` — без ограничения."""
+    if rate is None:
+        return None
+    limit, _, period = rate.partition("/")
+    if period.isdigit():
+        return int(limit), int(period)
+    return int(limit), PERIODS[period]
+
+
+class RateLimiter:
+    def __init__(self, rate, cache_alias="default", prefix="throttle"):
+        self.limit, self.period = parse_rate(rate)
+        self.cache_alias = cache_alias
+        self.prefix = prefix
+
+    def hit(self, ident: str, now=None):
+        """
+        Учитывает запрос клиента ``ident``.
+        Возвращает ``None``, если запрос разрешён, иначе — через сколько секунд повторить.
+        """
+        cache = caches[self.cache_alias]
+        now = time.time() if now is None else now
+        window, elapsed = divmod(now, self.period)
+        key = f"{self.prefix}:{ident}:{int(window)}"
+        try:
+            current = cache.incr(key)
+        except ValueError:
+            # первый запрос в окне; если ключ успел создать другой процесс — увеличиваем его
+            current = 1 if cache.add(key, 1, timeout=self.period * 2) else cache.incr(key)
+        previous = cache.get(f"{self.prefix}:{ident}:{int(window) - 1}", 0)
+        weight = (self.period - elapsed) / self.period
+        if previous * weight + current <= self.limit:
+            return None
+        return self.retry_after(previous, current, elapsed)
+
+    def retry_after(self, previous, current, elapsed) -> int:
+        # следующий запрос тоже увеличит счётчик текущего окна
+        left = self.period - elapsed
+        if current < self.limit:
+            # хватит того, что «вес» предыдущего окна уменьшится
+            wait = left - (self.limit - current - 1) * self.period / previous
+        else:
+            # ждём следующего окна, где текущее станет предыдущим
+            wait = left + self.period * (1 - (self.limit - 1) / current)
+        return max(1, math.ceil(wait))
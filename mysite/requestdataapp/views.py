@@ -1,8 +1,15 @@
+import logging
+import os
+
 from django.core.files.storage import FileSystemStorage
-from django.http import HttpRequest, HttpResponse, FileResponse
+from django.http import HttpRequest, HttpResponse, FileResponse, JsonResponse
 from django.shortcuts import render
 from django.conf import settings
 from .forms import UserBioForm, UploadFileForm
+from .metrics import registry, render as render_metrics
+from .profiling import slow_queries, worst_endpoints
+
+logger = logging.getLogger(__name__)
 
 
 def procces_get_view(request: HttpRequest) -> HttpResponse:
@@ -36,7 +43,7 @@ def handle_file_upload(request: HttpRequest) -> HttpResponse:
                     status=400)
             fs = FileSystemStorage()
             file_name = fs.save(myfile.name, myfile)
-            print("Saved file", file_name)
+            logger.info("Saved file %s", file_name)
     else:
         form = UploadFileForm()
 
@@ -46,8 +53,39 @@ def handle_file_upload(request: HttpRequest) -> HttpResponse:
     return render(request, "requestdataapp/file-upload.html", context=context)
 
 
+def metrics_allowed(request: HttpRequest) -> bool:
+    allowed_ips = getattr(settings, "METRICS_ALLOWED_IPS", ())
+    return request.META.get("REMOTE_ADDR") in allowed_ips or request.user.is_staff
 
 
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """Метрики всех воркеров в текстовом формате Prometheus."""
+    if not metrics_allowed(request):
+        return HttpResponse(status=403)
+    return HttpResponse(
+        render_metrics(registry.collect()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
 
 
-
+def query_profile_view(request: HttpRequest) -> HttpResponse:
+    """
+    Маршруты с наибольшим временем в БД (``?sort=db_time``), числом SQL на запрос
+    (``queries``) или превышений бюджета (``over_budget``), ``?limit=`` — сколько вывести.
+    Числа — по всем воркерам, ``slowest`` — самые медленные SQL этого процесса.
+    """
+    if not metrics_allowed(request):
+        return HttpResponse(status=403)
+    sort = request.GET.get("sort", "db_time")
+    if sort not in ("db_time", "queries", "over_budget"):
+        return JsonResponse({"sort": "Expected db_time, queries or over_budget."}, status=400)
+    try:
+        limit = int(request.GET.get("limit", 20))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= 100:
+        return JsonResponse({"limit": "Expected an integer between 1 and 100."}, status=400)
+    endpoints = worst_endpoints(registry.collect(), sort, limit)
+    for endpoint in endpoints:
+        endpoint["slowest"] = slow_queries.get(endpoint["route"])
+    return JsonResponse({"pid": os.getpid(), "endpoints": endpoints})
@@ -4,10 +4,13 @@ from django.http import HttpRequest, HttpResponse
 from django.shortcuts import render, redirect
 from django.urls import path
 
-from .common import save_csv_products, save_csv_orders
 from .forms import CSVImportForm
-from .models import Product, Order, ProductImage
+from .models import Product, Order, ProductImage, ImportJob
 from .admin_mixins import ExportAsCSVMixin
+from .caching import bump_version, user_orders_version, PRODUCTS_VERSION, ORDERS_VERSION, ANALYTICS_VERSION
+from .recommendations import rebuild_related
+from .totals import rebuild_order_totals
+from .search import search_products
 
 
 class OrderInline(admin.TabularInline):
@@ -22,11 +25,13 @@ class ProductInline(admin.StackedInline):
 @admin.action(description="Архивировать продукты")
 def mark_archived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
     queryset.update(archived=True)
+    bump_version(PRODUCTS_VERSION)
 
 
 @admin.action(description="Разархивировать продукты")
 def mark_unarchived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
     queryset.update(archived=False)
+    bump_version(PRODUCTS_VERSION)
 
 
 @admin.register(Product)
@@ -36,6 +41,7 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
         mark_archived,
         mark_unarchived,
         "export_csv",
+        "export_csv_gzip",
     ]
     inlines = [
         OrderInline,
@@ -65,6 +71,24 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
 
     ]
 
+    def save_related(self, request, form, formsets, change):
+        before = set(form.instance.orders.values_list("pk", flat=True)) if change else set()
+        super().save_related(request, form, formsets, change)
+        # строки заказов из инлайна сохраняются без m2m_changed и без post_save
+        after = set(form.instance.orders.values_list("pk", flat=True))
+        if before != after:
+            rebuild_related([form.instance.pk])
+            orders = Order.objects.filter(pk__in=before ^ after)
+            rebuild_order_totals(orders)
+            user_ids = set(orders.values_list("user_id", flat=True))
+            bump_version(ORDERS_VERSION, ANALYTICS_VERSION, *map(user_orders_version, user_ids))
+
+    def get_search_results(self, request, queryset, search_term):
+        result = search_products(queryset, search_term.split())
+        if result is None:
+            return super().get_search_results(request, queryset, search_term)
+        return result, False
+
     @admin.display(description="My Custom Field")
     def description_short(self, obj: Product) -> str:
         if len(obj.description) < 48:
@@ -86,11 +110,14 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
             }
             return render(request, "admin/csv_form.html", context, status=400)
 
-        save_csv_products(
-            file=form.files["csv_file"].file,
-            encoding=request.encoding,
+        job = ImportJob.objects.create(
+            target=ImportJob.TARGET_PRODUCTS,
+            file=form.cleaned_data["csv_file"],
+            encoding=request.encoding or "utf-8",
+            upsert=form.cleaned_data["upsert"],
+            created_by=request.user,
         )
-        self.message_user(request, "Продукты успешно импортированы")
+        self.message_user(request, f"Импорт продуктов поставлен в очередь (задача #{job.pk})")
         return redirect("..")
 
     def get_urls(self):
@@ -111,12 +138,16 @@ class ProductInline(admin.TabularInline):
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(admin.ModelAdmin, ExportAsCSVMixin):
+    actions = [
+        "export_csv",
+        "export_csv_gzip",
+    ]
     inlines = [
         ProductInline,
 
     ]
-    list_display = 'pk', 'delivery_address', 'promocode', 'created_at', 'user_verbose'
+    list_display = 'pk', 'delivery_address', 'promocode', 'created_at', 'user_verbose', 'products_count', 'total'
     list_display_links = 'pk', 'delivery_address'
     ordering = 'pk',
     search_fields = "delivery_address", "promocode"
@@ -124,6 +155,16 @@ class OrderAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return Order.objects.select_related("user").prefetch_related("products")
 
+    def save_related(self, request, form, formsets, change):
+        before = set(form.instance.products.values_list("pk", flat=True)) if change else set()
+        super().save_related(request, form, formsets, change)
+        # строки товаров из инлайна сохраняются без m2m_changed и без post_save
+        after = set(form.instance.products.values_list("pk", flat=True))
+        if before != after:
+            rebuild_related(before ^ after)
+            rebuild_order_totals(Order.objects.filter(pk=form.instance.pk))
+            bump_version(ORDERS_VERSION, ANALYTICS_VERSION, user_orders_version(form.instance.user_id))
+
     def user_verbose(self, obj: Order) -> str:
         return obj.user.first_name or obj.user.username
 
@@ -144,11 +185,14 @@ class OrderAdmin(admin.ModelAdmin):
             }
             return render(request, "admin/csv_form.html", context, status=400)
 
-        save_csv_orders(
-            file=form.files["csv_file"].file,
-            encoding=request.encoding,
+        job = ImportJob.objects.create(
+            target=ImportJob.TARGET_ORDERS,
+            file=form.cleaned_data["csv_file"],
+            encoding=request.encoding or "utf-8",
+            upsert=form.cleaned_data["upsert"],
+            created_by=request.user,
         )
-        self.message_user(request, "Заказы успешно импортированы")
+        self.message_user(request, f"Импорт заказов поставлен в очередь (задача #{job.pk})")
         return redirect("..")
 
     def get_urls(self):
@@ -161,3 +205,11 @@ class OrderAdmin(admin.ModelAdmin):
             )
         ]
         return new_urls + urls
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = 'pk', 'target', 'status', 'rows_processed', 'rows_ok', 'rows_rejected', 'throughput', 'created_at'
+    list_filter = 'target', 'status'
+    ordering = '-pk',
+    readonly_fields = [field.name for field in ImportJob._meta.fields] + ['throughput']
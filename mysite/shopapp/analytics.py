@@ -0,0 +1,166 @@
+"""
+Аналитика продаж: выручка по дням, топ товаров, влияние скидок и средняя корзина.
+
+Агрегация выполняется в базе (``GROUP BY`` по связующей таблице заказов
+и товаров), в Python сливаются только готовые суммы. Выручка считается
+по текущим ценам товаров — истории цен в модели нет.
+
+Кеш: суммы за закрытые дни диапазона (до вчерашнего включительно) хранятся
+под ключом диапазона, а текущий день при каждом запросе считается заново
+и добавляется к ним. Ключ зависит от версии ``ANALYTICS_VERSION``: её увеличивают
+сигналы при изменении заказов прошлых дней и при изменении или удалении товаров.
+Новые заказы и списание остатков её не меняют.
+"""
+import heapq
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .caching import versioned_key, ANALYTICS_VERSION, EXPORT_CACHE_TIMEOUT
+from .models import Order, Product
+
+CENTS = Decimal("0.01")
+
+# цена × процент скидки; делится на 100 уже в Python: в SQLite цена может
+# храниться целым числом, и деление в запросе было бы целочисленным
+DISCOUNT_PERCENTS = F("product__price") * F("product__discount")
+
+
+def day_bounds(start: date, end: date):
+    tz = timezone.get_current_timezone()
+    return (
+        datetime.combine(start, time.min, tzinfo=tz),
+        datetime.combine(end + timedelta(days=1), time.min, tzinfo=tz),
+    )
+
+
+def empty_partial():
+    return {"days": {}, "products": {}}
+
+
+def compute_partial(start: date, end: date) -> dict:
+    """
+    Суммы за дни ``[start, end]`` тремя запросами с ``GROUP BY``:
+    заказы по дням, позиции по дням и позиции по товарам.
+    """
+    since, until = day_bounds(start, end)
+    items = Order.products.through.objects.filter(
+        order__created_at__gte=since, order__created_at__lt=until,
+    ).order_by()
+    partial = empty_partial()
+    days = partial["days"]
+
+    orders_per_day = (
+        Order.objects.filter(created_at__gte=since, created_at__lt=until).order_by()
+        .annotate(day=TruncDate("created_at")).values("day")
+        .annotate(orders=Count("pk"))
+    )
+    for row in orders_per_day:
+        days[row["day"]] = {
+            "orders": row["orders"], "items": 0, "revenue": Decimal(0),
+            "net_revenue": Decimal(0), "discounted_items": 0,
+        }
+
+    items_per_day = (
+        items.annotate(day=TruncDate("order__created_at")).values("day")
+        .annotate(
+            items=Count("pk"),
+            revenue=Sum("product__price"),
+            discount_percents=Sum(DISCOUNT_PERCENTS),
+            discounted_items=Count("pk", filter=Q(product__discount__gt=0)),
+        )
+    )
+    for row in items_per_day:
+        day = days[row["day"]]
+        for key in ("items", "revenue", "discounted_items"):
+            day[key] = row[key]
+        day["net_revenue"] = row["revenue"] - row["discount_percents"] / 100
+
+    per_product = items.values("product_id").annotate(units=Count("pk"), revenue=Sum("product__price"))
+    partial["products"] = {
+        row["product_id"]: (row["units"], row["revenue"]) for row in per_product
+    }
+    return partial
+
+
+def merge_partials(base: dict, extra: dict) -> dict:
+    merged = {"days": {**base["days"], **extra["days"]}, "products": dict(base["products"])}
+    for product_id, (units, revenue) in extra["products"].items():
+        old_units, old_revenue = merged["products"].get(product_id, (0, Decimal(0)))
+        merged["products"][product_id] = (old_units + units, old_revenue + revenue)
+    return merged
+
+
+def closed_partial(start: date, end: date) -> dict:
+    """Суммы за закрытые дни из кеша диапазона или одним пересчётом."""
+    if end < start:
+        return empty_partial()
+    key = versioned_key(
+        f"shopapp:analytics:sales:{start.isoformat()}:{end.isoformat()}",
+        ANALYTICS_VERSION,
+    )
+    partial = cache.get(key)
+    if partial is None:
+        partial = compute_partial(start, end)
+        cache.set(key, partial, EXPORT_CACHE_TIMEOUT)
+    return partial
+
+
+def money(value) -> str:
+    return str(Decimal(value).quantize(CENTS))
+
+
+def sales_report(start: date, end: date, top: int = 10) -> dict:
+    today = timezone.localdate()
+    partial = closed_partial(start, min(end, today - timedelta(days=1)))
+    if end >= today >= start:
+        partial = merge_partials(partial, compute_partial(today, today))
+
+    days = [
+        {
+            "day": day.isoformat(),
+            "orders": values["orders"],
+            "items": values["items"],
+            "revenue": money(values["revenue"]),
+            "net_revenue": money(values["net_revenue"]),
+        }
+        for day, values in sorted(partial["days"].items())
+    ]
+    orders = sum(values["orders"] for values in partial["days"].values())
+    items = sum(values["items"] for values in partial["days"].values())
+    revenue = sum((values["revenue"] for values in partial["days"].values()), Decimal(0))
+    net_revenue = sum((values["net_revenue"] for values in partial["days"].values()), Decimal(0))
+    discounted_items = sum(values["discounted_items"] for values in partial["days"].values())
+
+    best = heapq.nlargest(top, partial["products"].items(), key=lambda item: (item[1][1], item[1][0]))
+    names = dict(Product.objects.filter(pk__in=[pk for pk, _ in best]).values_list("pk", "name"))
+
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "revenue_per_day": days,
+        "totals": {
+            "orders": orders,
+            "items": items,
+            "revenue": money(revenue),
+            "net_revenue": money(net_revenue),
+        },
+        "average_basket": {
+            "items": round(items / orders, 2) if orders else 0,
+            "revenue": money(revenue / orders) if orders else money(0),
+            "net_revenue": money(net_revenue / orders) if orders else money(0),
+        },
+        "discount_impact": {
+            "discounted_items": discounted_items,
+            "discount_amount": money(revenue - net_revenue),
+            "share_of_revenue": round(float((revenue - net_revenue) / revenue), 4) if revenue else 0.0,
+        },
+        "top_products": [
+            {"product": pk, "name": names.get(pk), "units": units, "revenue": money(product_revenue)}
+            for pk, (units, product_revenue) in best
+        ],
+    }
@@ -0,0 +1,119 @@
+"""
+Версионированные ключи кеша.
+
+Вместо удаления закешированных данных при изменениях увеличивается
+номер версии, который входит в ключ — старые записи просто перестают читаться
+и истекают сами. Версии увеличивают обработчики сигналов из :mod:`shopapp.signals`.
+"""
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+EXPORT_CACHE_TIMEOUT = getattr(settings, "SHOPAPP_EXPORT_CACHE_TIMEOUT", 60 * 60 * 24)
+
+PRODUCTS_VERSION = "products"
+ANALYTICS_VERSION = "analytics"
+ORDERS_VERSION = "orders"
+
+
+def user_orders_version(user_id) -> str:
+    return f"orders:user:{user_id}"
+
+
+def version_key(name: str) -> str:
+    return f"shopapp:version:{name}"
+
+
+def initial_version() -> int:
+    # Версия могла быть вытеснена из кеша: начинаем с нового значения,
+    # чтобы не прочитать записи, сохранённые под старой версией.
+    return time.time_ns() // 1000
+
+
+def get_version(name: str) -> int:
+    key = version_key(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, initial_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(*names: str) -> None:
+    for name in names:
+        key = version_key(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, initial_version(), timeout=None)
+
+
+def versioned_key(prefix: str, *names: str) -> str:
+    """Ключ кеша, который меняется при увеличении любой из версий ``names``."""
+    versions = ".".join(str(get_version(name)) for name in names)
+    return f"{prefix}:v{versions}"
+
+
+def incr_counter(key: str) -> None:
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+class CachedListMixin:
+    """
+    Кеш ответов ``list`` для ``ModelViewSet``.
+
+    Ключ строится из нормализованных параметров запроса и версии данных
+    ``list_cache_version``, которую увеличивают сигналы при записи.
+    ETag зависит только от ключа, поэтому на ``If-None-Match`` с актуальным ETag
+    отвечаем 304 без чтения кеша и сериализации.
+    """
+    list_cache_version = PRODUCTS_VERSION
+    list_cache_timeout = EXPORT_CACHE_TIMEOUT
+
+    def list_cache_prefix(self) -> str:
+        return f"shopapp:list:{self.basename}"
+
+    def list(self, request: Request, *args, **kwargs):
+        params = urlencode(sorted(request.query_params.lists()), doseq=True)
+        query = f"{request.get_host()}{request.path}?{params}"
+        cache_key = versioned_key(
+            f"{self.list_cache_prefix()}:{hashlib.md5(query.encode()).hexdigest()}",
+            self.list_cache_version,
+        )
+        etag = '"{}"'.format(hashlib.md5(cache_key.encode()).hexdigest())
+
+        if_none_match = request.headers.get("If-None-Match", "")
+        if etag in if_none_match or if_none_match.strip() == "*":
+            incr_counter(f"{self.list_cache_prefix()}:not_modified")
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        data = cache.get(cache_key)
+        if data is None:
+            incr_counter(f"{self.list_cache_prefix()}:misses")
+            data = super().list(request, *args, **kwargs).data
+            cache.set(cache_key, data, self.list_cache_timeout)
+        else:
+            incr_counter(f"{self.list_cache_prefix()}:hits")
+        return Response(data, headers={"ETag": etag})
+
+    @action(methods=['get'], detail=False)
+    def cache_stats(self, request: Request):
+        prefix = self.list_cache_prefix()
+        stats = {
+            name: cache.get(f"{prefix}:{name}", 0)
+            for name in ("hits", "misses", "not_modified")
+        }
+        served = sum(stats.values())
+        stats["hit_ratio"] = round((stats["hits"] + stats["not_modified"]) / served, 3) if served else 0.0
+        return Response(stats)
@@ -0,0 +1,161 @@
+"""
+Колоночный экспорт товаров и заказов в формате NumPy ``.npz``.
+
+Файл пишется без зависимости от NumPy: ``.npz`` — это zip-архив с файлами ``.npy``,
+у каждого простой текстовый заголовок и сырые данные колонки.
+Загрузка на стороне аналитики: ``numpy.load("shop-export.npz")``.
+
+Раскладка колонок:
+
+* целые числа и id — ``<i8``, ``DecimalField`` — ``<f8``, ``BooleanField`` — ``|b1``;
+* ``DateTimeField`` — ``<M8[us]`` (микросекунды от эпохи, UTC);
+* строки хранятся как в Arrow: ``<name>.data`` (байты UTF-8, ``|u1``)
+  и ``<name>.offsets`` (``<i8``, длина n + 1);
+* для полей с ``null=True`` добавляется маска ``<name>.valid`` (``|b1``).
+"""
+import ast
+import sys
+import zipfile
+from array import array
+from datetime import datetime, timezone
+
+from django.db import models
+
+from .models import Product, Order
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+TYPECODES = {
+    "<i8": "q",
+    "<f8": "d",
+    "<M8[us]": "q",
+    "|b1": "B",
+    "|u1": "B",
+}
+
+
+def column_kind(field):
+    if isinstance(field, models.BooleanField):
+        return "|b1"
+    if isinstance(field, models.DecimalField) or isinstance(field, models.FloatField):
+        return "<f8"
+    if isinstance(field, models.DateTimeField):
+        return "<M8[us]"
+    if isinstance(field, (models.IntegerField, models.AutoField, models.ForeignKey)):
+        return "<i8"
+    return "str"
+
+
+class Column:
+    def __init__(self, name, kind, nullable):
+        self.name = name
+        self.kind = kind
+        self.nullable = nullable
+        if kind == "str":
+            self.data = bytearray()
+            self.offsets = array("q", [0])
+        else:
+            self.values = array(TYPECODES[kind])
+        self.valid = array("B") if nullable else None
+
+    def append(self, value):
+        if self.valid is not None:
+            self.valid.append(value is not None)
+        if self.kind == "str":
+            if value:
+                self.data += str(value).encode("utf-8")
+            self.offsets.append(len(self.data))
+        elif value is None:
+            self.values.append(0)
+        elif self.kind == "<M8[us]":
+            delta = value - EPOCH
+            self.values.append((delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds)
+        elif self.kind == "<f8":
+            self.values.append(float(value))
+        else:
+            self.values.append(int(value))
+
+    def arrays(self):
+        if self.kind == "str":
+            yield f"{self.name}.data", "|u1", self.data
+            yield f"{self.name}.offsets", "<i8", self.offsets
+        else:
+            yield self.name, self.kind, self.values
+        if self.valid is not None:
+            yield f"{self.name}.valid", "|b1", self.valid
+
+
+def npy_bytes(descr, values):
+    """Сериализует одномерный массив в формат ``.npy`` версии 1.0."""
+    if isinstance(values, array) and values.itemsize > 1 and sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    length = len(values)
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': ({},), }}".format(descr, length)
+    padding = 64 - (len(NPY_MAGIC) + 2 + len(header) + 1) % 64
+    header = (header + " " * padding + "\n").encode("latin1")
+    return NPY_MAGIC + len(header).to_bytes(2, "little") + header + bytes(values)
+
+
+def table_columns(queryset, fields):
+    columns = [
+        Column(field.attname, column_kind(field), field.null)
+        for field in fields
+    ]
+    for row in queryset.values_list(*[column.name for column in columns]).iterator(chunk_size=2000):
+        for column, value in zip(columns, row):
+            column.append(value)
+    return columns
+
+
+def export_tables():
+    through = Order.products.through
+    return {
+        "products": table_columns(
+            Product.objects.order_by("pk"),
+            [field for field in Product._meta.concrete_fields if field.name != "preview"],
+        ),
+        "orders": table_columns(
+            Order.objects.order_by("pk"),
+            [field for field in Order._meta.concrete_fields if field.name != "receipt"],
+        ),
+        "order_products": table_columns(
+            through.objects.order_by("pk"),
+            [through._meta.get_field("order"), through._meta.get_field("product")],
+        ),
+    }
+
+
+def write_npz(file, tables=None):
+    """
+    Пишет таблицы в ``file`` одним проходом по каждой таблице базы.
+
+    Ключи в архиве имеют вид ``<table>/<column>``, например ``products/price``.
+    """
+    if tables is None:
+        tables = export_tables()
+    with zipfile.ZipFile(file, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for table, columns in tables.items():
+            for column in columns:
+                for name, descr, values in column.arrays():
+                    archive.writestr(f"{table}/{name}.npy", npy_bytes(descr, values))
+    return file
+
+
+def read_npz(file):
+    """
+    Читает архив из :func:`write_npz` без NumPy: ``{key: array}``.
+    """
+    result = {}
+    with zipfile.ZipFile(file) as archive:
+        for name in archive.namelist():
+            raw = archive.read(name)
+            header_length = int.from_bytes(raw[8:10], "little")
+            header = ast.literal_eval(raw[10:10 + header_length].decode("latin1"))
+            values = array(TYPECODES[header["descr"]])
+            values.frombytes(raw[10 + header_length:])
+            if values.itemsize > 1 and sys.byteorder == "big":
+                values.byteswap()
+            result[name.removesuffix(".npy")] = values
+    return result
@@ -1,31 +1,442 @@
-from csv import DictReader
-from io import TextIOWrapper
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from csv import DictReader, reader as csv_reader, writer as csv_writer
+from io import StringIO, TextIOWrapper
+from itertools import islice
+from timeit import default_timer
 
-from shopapp.models import Product, Order
+import django
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
 
+from shopapp.caching import bump_version, PRODUCTS_VERSION, ORDERS_VERSION, ANALYTICS_VERSION
+from shopapp.models import Product, Order, ImportJob
+from shopapp.totals import rebuild_order_totals, orders_with_products
 
-def save_csv_products(file, encoding):
-    csv_file = TextIOWrapper(
-        file,
-        encoding=encoding,
+CSV_IMPORT_BATCH_SIZE = 1000
+CSV_IMPORT_MAX_ERRORS = 100
+CSV_IMPORT_MIN_CHUNK_BYTES = 1024 * 1024
+CSV_EXPORT_CHUNK_SIZE = 2000
+# задачу без сигнала обработчика дольше этого времени забирает другой обработчик
+IMPORT_JOB_LEASE_SECONDS = getattr(settings, "SHOPAPP_IMPORT_JOB_LEASE_SECONDS", 300)
+
+PRODUCT_NATURAL_KEY = getattr(settings, "SHOPAPP_PRODUCT_NATURAL_KEY", ("name",))
+ORDER_NATURAL_KEY = getattr(settings, "SHOPAPP_ORDER_NATURAL_KEY", ("user", "promocode", "delivery_address"))
+
+
+def iter_batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def clean_csv_row(model, row, defaults=None):
+    """
+    Приводит строку CSV к типам полей модели.
+
+    Возвращает словарь для конструктора модели,
+    внешние ключи передаются как ``<field>_id``.
+    """
+    data = dict(defaults or {})
+    errors = {}
+    for name, value in row.items():
+        if name is None:
+            errors["__all__"] = ["Лишние значения в строке"]
+            continue
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            errors[name] = ["Неизвестное поле"]
+            continue
+        if value is None or value == "":
+            if field.has_default() or field.auto_created:
+                continue
+            if field.is_relation:
+                if field.attname not in data and not field.null:
+                    errors[name] = [field.error_messages["null"]]
+                continue
+        try:
+            if field.is_relation:
+                data[field.attname] = field.target_field.to_python(value)
+            else:
+                data[field.name] = field.clean(value, None)
+        except ValidationError as exc:
+            errors[name] = exc.messages
+    if errors:
+        raise ValidationError(errors)
+    return data
+
+
+def natural_key_names(model, unique_fields) -> list:
+    """``attname`` полей натурального ключа: так они называются в строках ``clean_csv_row``."""
+    return [model._meta.get_field(name).attname for name in unique_fields]
+
+
+def upsert_batch(model, rows, unique_fields, update_fields, batch_size=CSV_IMPORT_BATCH_SIZE):
+    """
+    Сохраняет пачку строк по натуральному ключу ``unique_fields``.
+
+    Ключи строк в пачке должны быть разными (см. ``save_csv``).
+    Существующие записи ищутся по всему ключу (запросом на каждые
+    ``max_query_params`` значений), неизменённые строки пропускаются,
+    изменённые обновляются через ``bulk_update``, новые создаются через ``bulk_create``.
+    """
+    key_names = natural_key_names(model, unique_fields)
+    update_fields = [name for name in update_fields if name not in key_names]
+    by_key = {
+        tuple(data.get(name) for name in key_names): data
+        for data in rows
+    }
+    existing = {}
+    # OR по кортежам ключей: ``__in`` по каждому столбцу отдельно выбрал бы лишние записи
+    # (например, все заказы пользователя) и не нашёл бы ключи с NULL
+    max_params = connection.features.max_query_params
+    keys_per_query = max(max_params // len(key_names), 1) if max_params else len(by_key)
+    for keys in iter_batches(by_key, keys_per_query):
+        condition = Q()
+        for key in keys:
+            condition |= Q(**dict(zip(key_names, key)))
+        for values in model._base_manager.filter(condition).values("pk", *key_names, *update_fields):
+            existing[tuple(values[name] for name in key_names)] = values
+
+    to_create = []
+    to_update = []
+    repriced = []
+    for key, data in by_key.items():
+        current = existing.get(key)
+        if current is None:
+            to_create.append(model(**data))
+        elif any(current[name] != data[name] for name in update_fields if name in data):
+            to_update.append(model(**{
+                **current,
+                **{name: data[name] for name in update_fields if name in data},
+            }))
+            if "price" in data and current.get("price") != data["price"]:
+                repriced.append(current["pk"])
+
+    model.objects.bulk_create(to_create, batch_size=batch_size)
+    if to_update and update_fields:
+        model.objects.bulk_update(to_update, update_fields, batch_size=batch_size)
+    if model is Product and repriced and rebuild_order_totals(orders_with_products(repriced)):
+        bump_version(ORDERS_VERSION)
+    return len(to_create), len(to_update), len(by_key) - len(to_create) - len(to_update)
+
+
+def clean_csv_rows(model, rows, defaults=None):
+    """
+    Проверяет строки CSV, для каждой возвращает пару ``(data, errors)``.
+    """
+    for row in rows:
+        try:
+            yield clean_csv_row(model, row, defaults), None
+        except ValidationError as exc:
+            yield None, exc.message_dict
+
+
+def clean_csv_chunk(model_label, path, encoding, fieldnames, start, end, defaults=None):
+    """
+    Проверяет строки из байтового диапазона ``[start, end)`` файла.
+
+    Выполняется в процессе-воркере и не обращается к базе данных.
+    """
+    if not apps.ready:
+        django.setup()
+    model = apps.get_model(model_label)
+    with open(path, "rb") as file:
+        file.seek(start)
+        text = file.read(end - start).decode(encoding)
+    reader = DictReader(StringIO(text, newline=""), fieldnames=fieldnames)
+    return list(clean_csv_rows(model, reader, defaults))
+
+
+def count_quotes(file, start, end, block_size=CSV_IMPORT_MIN_CHUNK_BYTES) -> int:
+    """Число байтов ``"`` в диапазоне ``[start, end)`` файла."""
+    file.seek(start)
+    count = 0
+    while start < end:
+        block = file.read(min(block_size, end - start))
+        if not block:
+            break
+        count += block.count(b'"')
+        start += len(block)
+    return count
+
+
+def split_csv_file(path, chunks):
+    """
+    Делит файл на байтовые диапазоны, выровненные по концам записей.
+
+    Возвращает строку заголовка и список диапазонов ``(start, end)``.
+    Граница — перевод строки вне кавычек: экранированная кавычка ``""``
+    не меняет чётность, поэтому достаточно считать кавычки от начала данных.
+    Так многострочные значения в кавычках не разрываются, и число записей
+    совпадает с последовательным чтением (от него зависит ``skip_rows``).
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        header = file.readline()
+        position = file.tell()
+        chunk_size = max(CSV_IMPORT_MIN_CHUNK_BYTES, (size - position) // chunks + 1)
+        ranges = []
+        quotes = 0
+        while position < size:
+            target = min(position + chunk_size, size)
+            quotes += count_quotes(file, position, target)
+            file.seek(target)
+            # дочитываем строку, а внутри кавычек — следующие строки до конца записи
+            line = file.readline()
+            quotes += line.count(b'"')
+            while quotes % 2 and line:
+                line = file.readline()
+                quotes += line.count(b'"')
+            end = min(file.tell(), size)
+            ranges.append((position, end))
+            position = end
+    return header, ranges
+
+
+def clean_csv_parallel(model, path, encoding, workers, defaults=None):
+    """
+    Параллельная проверка строк CSV в ``ProcessPoolExecutor``.
+
+    Результаты отдаются в исходном порядке строк, в работе одновременно
+    не более ``2 * workers`` диапазонов, чтобы не держать файл в памяти.
+    """
+    header, ranges = split_csv_file(path, workers * 4)
+    fieldnames = next(csv_reader([header.decode(encoding)]))
+    model_label = model._meta.label
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        ranges = iter(ranges)
+        for start, end in islice(ranges, workers * 2):
+            pending.append(executor.submit(
+                clean_csv_chunk, model_label, path, encoding, fieldnames, start, end, defaults,
+            ))
+        while pending:
+            results = pending.popleft().result()
+            for start, end in islice(ranges, 1):
+                pending.append(executor.submit(
+                    clean_csv_chunk, model_label, path, encoding, fieldnames, start, end, defaults,
+                ))
+            yield from results
+
+
+def csv_file_path(file):
+    path = getattr(file, "name", None)
+    if isinstance(path, str) and os.path.isfile(path):
+        return path
+    return None
+
+
+def save_csv(model, file, encoding, batch_size=CSV_IMPORT_BATCH_SIZE, defaults=None, unique_fields=None,
+             skip_rows=0, on_batch=None, workers=None):
+    """
+    Потоковый импорт CSV: строки читаются пачками по ``batch_size``,
+    каждая пачка проверяется и сохраняется отдельной транзакцией.
+
+    Если задан ``unique_fields``, строки сопоставляются с существующими
+    записями по этому натуральному ключу (см. ``upsert_batch``); строка
+    с тем же ключом, что и строка выше в той же пачке, отклоняется.
+
+    ``skip_rows`` пропускает уже импортированные строки, а ``on_batch``
+    вызывается со статистикой пачки внутри её транзакции —
+    так фоновая задача может продолжить импорт с последней сохранённой пачки.
+
+    При ``workers > 1`` и файле на диске строки проверяются параллельно
+    (см. ``clean_csv_parallel``), в базу по-прежнему пишет только текущий процесс.
+    Внешние ключи проверяются по множеству id, загруженному один раз на весь импорт.
+
+    Возвращает сводку импорта, а не созданные объекты.
+    """
+    started = default_timer()
+    path = csv_file_path(file)
+    if workers and workers > 1 and path:
+        with open(path, "rb") as header_file:
+            fieldnames = next(csv_reader([header_file.readline().decode(encoding)]))
+        cleaned_rows = islice(clean_csv_parallel(model, path, encoding, workers, defaults), skip_rows, None)
+    else:
+        reader = DictReader(TextIOWrapper(file, encoding=encoding))
+        fieldnames = reader.fieldnames or []
+        cleaned_rows = clean_csv_rows(model, islice(reader, skip_rows, None), defaults)
+
+    summary = {
+        "rows_ok": 0,
+        "rows_rejected": 0,
+        "rows_created": 0,
+        "rows_updated": 0,
+        "rows_unchanged": 0,
+        "errors": [],
+    }
+    concrete_fields = {field.name: field for field in model._meta.concrete_fields}
+    update_fields = [concrete_fields[name].attname for name in fieldnames if name in concrete_fields]
+    foreign_keys = {
+        field.attname: (field.name, set(field.related_model._base_manager.values_list("pk", flat=True)))
+        for field in concrete_fields.values()
+        if field.many_to_one
+    }
+    key_names = natural_key_names(model, unique_fields) if unique_fields else None
+    for batch_number, batch in enumerate(iter_batches(cleaned_rows, batch_size)):
+        stats = {
+            "rows_processed": len(batch),
+            "rows_rejected": 0,
+            "errors": [],
+        }
+        rows = []
+        keys = {}
+        for row_number, (data, errors) in enumerate(batch, start=skip_rows + batch_number * batch_size + 1):
+            if errors is None:
+                errors = {
+                    name: ["Объект не найден"]
+                    for attname, (name, existing) in foreign_keys.items()
+                    if data.get(attname) is not None and data[attname] not in existing
+                }
+            if not errors and key_names:
+                key = tuple(data.get(name) for name in key_names)
+                if key in keys:
+                    errors = {"__all__": [f"Повторяет ключ строки {keys[key]}"]}
+                else:
+                    keys[key] = row_number
+            if errors:
+                stats["rows_rejected"] += 1
+                stats["errors"].append({"row": row_number, "errors": errors})
+                continue
+            rows.append(data)
+
+        with transaction.atomic():
+            if unique_fields:
+                created, updated, unchanged = upsert_batch(
+                    model, rows, unique_fields, update_fields, batch_size=batch_size,
+                )
+            else:
+                model.objects.bulk_create([model(**data) for data in rows], batch_size=batch_size)
+                created, updated, unchanged = len(rows), 0, 0
+            stats.update(
+                rows_ok=len(rows),
+                rows_created=created,
+                rows_updated=updated,
+                rows_unchanged=unchanged,
+            )
+            if on_batch is not None:
+                on_batch(stats)
+        # bulk_create и bulk_update не отправляют сигналы
+        if model is Product:
+            bump_version(PRODUCTS_VERSION, ANALYTICS_VERSION)
+        else:
+            bump_version(ORDERS_VERSION)
+
+        for key in ("rows_ok", "rows_rejected", "rows_created", "rows_updated", "rows_unchanged"):
+            summary[key] += stats[key]
+        summary["errors"].extend(stats["errors"][:CSV_IMPORT_MAX_ERRORS - len(summary["errors"])])
+
+    summary["elapsed"] = round(default_timer() - started, 3)
+    return summary
+
+
+def save_csv_products(file, encoding, created_by=None, batch_size=CSV_IMPORT_BATCH_SIZE, upsert=False, **kwargs):
+    defaults = {}
+    if created_by is not None:
+        defaults["created_by_id"] = created_by.pk
+    return save_csv(
+        Product, file, encoding,
+        batch_size=batch_size,
+        defaults=defaults,
+        unique_fields=PRODUCT_NATURAL_KEY if upsert else None,
+        **kwargs
+    )
+
+
+def save_csv_orders(file, encoding, user=None, batch_size=CSV_IMPORT_BATCH_SIZE, upsert=False, **kwargs):
+    defaults = {}
+    if user is not None:
+        defaults["user_id"] = user.pk
+    return save_csv(
+        Order, file, encoding,
+        batch_size=batch_size,
+        defaults=defaults,
+        unique_fields=ORDER_NATURAL_KEY if upsert else None,
+        **kwargs
     )
-    reader = DictReader(csv_file)
-    products = [
-        Product(**row)
-        for row in reader
-    ]
-    Product.objects.bulk_create(products)
-    return products
-
-
-def save_csv_orders(file, encoding):
-    csv_file = TextIOWrapper(
-        file,
-        encoding=encoding,
+
+
+class LeaseLost(Exception):
+    """Задачу импорта забрал другой обработчик: её аренда истекла."""
+
+
+def run_import_job(job, batch_size=CSV_IMPORT_BATCH_SIZE, workers=None):
+    """
+    Выполняет фоновую задачу импорта :model:`shopapp.ImportJob`.
+
+    Прогресс сохраняется после каждой пачки в той же транзакции,
+    поэтому прерванная задача продолжается с последней сохранённой пачки.
+    Вместе с прогрессом обновляется ``heartbeat_at``; если задачу тем временем
+    забрал другой обработчик (``claimed_by`` сменился), пачка откатывается
+    и выбрасывается ``LeaseLost``.
+    """
+    importers = {
+        ImportJob.TARGET_PRODUCTS: lambda **kwargs: save_csv_products(created_by=job.created_by, **kwargs),
+        ImportJob.TARGET_ORDERS: lambda **kwargs: save_csv_orders(user=job.created_by, **kwargs),
+    }
+    job_qs = ImportJob.objects.filter(pk=job.pk, claimed_by=job.claimed_by)
+
+    def on_batch(stats):
+        errors = job.errors
+        errors.extend(stats["errors"][:CSV_IMPORT_MAX_ERRORS - len(errors)])
+        updated = job_qs.update(
+            heartbeat_at=timezone.now(),
+            rows_processed=F("rows_processed") + stats["rows_processed"],
+            rows_ok=F("rows_ok") + stats["rows_ok"],
+            rows_rejected=F("rows_rejected") + stats["rows_rejected"],
+            rows_created=F("rows_created") + stats["rows_created"],
+            rows_updated=F("rows_updated") + stats["rows_updated"],
+            rows_unchanged=F("rows_unchanged") + stats["rows_unchanged"],
+            errors=errors,
+        )
+        if not updated:
+            raise LeaseLost(f"{job} was claimed by another worker")
+
+    job_qs.update(
+        status=ImportJob.STATUS_RUNNING,
+        started_at=job.started_at or timezone.now(),
+        heartbeat_at=timezone.now(),
     )
-    reader = DictReader(csv_file)
-    orders = [
-        Order(**row)
-        for row in reader
-    ]
-    Order.objects.bulk_create(orders)
+    try:
+        with job.file.open("rb"):
+            importers[job.target](
+                file=job.file.file,
+                encoding=job.encoding,
+                upsert=job.upsert,
+                batch_size=batch_size,
+                skip_rows=job.rows_processed,
+                on_batch=on_batch,
+                workers=workers,
+            )
+    except Exception as exc:
+        job_qs.update(status=ImportJob.STATUS_FAILED, finished_at=timezone.now(), failure=repr(exc))
+        raise
+    job_qs.update(status=ImportJob.STATUS_DONE, finished_at=timezone.now())
+    job.refresh_from_db()
+    return job
+
+
+class Echo:
+    """Псевдо-буфер для ``csv.writer``: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(header, rows, chunk_size=CSV_EXPORT_CHUNK_SIZE):
+    """
+    Генератор CSV для ``StreamingHttpResponse``.
+
+    Строки отдаются кусками по ``chunk_size``, поэтому память не зависит от размера выборки.
+    """
+    writer = csv_writer(Echo())
+    yield writer.writerow(header)
+    for batch in iter_batches(rows, chunk_size):
+        yield "".join(writer.writerow(row) for row in batch)
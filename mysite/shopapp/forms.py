@@ -36,4 +36,5 @@ class ProductForm(forms.ModelForm):
 
 
 class CSVImportForm(forms.Form):
-    csv_file = forms.FileField()
\ No newline at end of file
+    csv_file = forms.FileField()
+    upsert = forms.BooleanField(required=False, label="Обновить существующие записи")
@@ -1,7 +1,7 @@
 from django.contrib.auth.models import User
 
 from django.core.management import BaseCommand
-from django.db.models import Avg, Max, Min, Count, Sum
+from django.db.models import Avg, Max, Min
 
 from shopapp.models import Product, Order
 
@@ -20,10 +20,8 @@ class Command(BaseCommand):
         # ))
         # print(result)
 
-        orders = Order.objects.annotate(
-            total=Sum('products__price', default=0),
-            products_count=Count('products'),
-        )
+        # total и products_count хранятся в заказе, см. shopapp.totals
+        orders = Order.objects.only('id', 'total', 'products_count')
 
         for order in orders:
             print(
@@ -0,0 +1,64 @@
+from timeit import default_timer
+
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIRequestFactory
+
+from shopapp.models import Product
+from shopapp.views import ProductViewSet
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Сравнивает обновление цен и остатков: N запросов PATCH на товар
+    против одного ``PATCH /products/bulk/``.
+
+    Товары создаются во временной транзакции, которая откатывается,
+    поэтому стоимость COMMIT для отдельных PATCH в замер не входит.
+    """
+    help = "Benchmark per-item PATCH vs bulk PATCH on ProductViewSet"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'items':>8}{'per-item, s':>13}{'items/s':>10}{'bulk, s':>10}{'items/s':>10}")
+        for size in options["sizes"]:
+            try:
+                with transaction.atomic():
+                    self.measure(size)
+                    raise Rollback
+            except Rollback:
+                pass
+
+    def measure(self, size):
+        user = User.objects.create_user(username="bench_bulk_user")
+        products = Product.objects.bulk_create([
+            Product(name=f"Product {i}", price=i % 9999, count=i, created_by=user)
+            for i in range(size)
+        ])
+        factory = APIRequestFactory(HTTP_HOST="localhost")
+        payload = [{"id": product.pk, "price": "10.00", "count": 7} for product in products]
+
+        partial_update = ProductViewSet.as_view({"patch": "partial_update"})
+        started = default_timer()
+        for item in payload:
+            response = partial_update(factory.patch("/", item, format="json"), pk=item["id"])
+            assert response.status_code == 200, response.data
+        per_item = default_timer() - started
+
+        bulk = ProductViewSet.as_view({"patch": "bulk"})
+        payload = [{**item, "count": 8} for item in payload]
+        started = default_timer()
+        response = bulk(factory.patch("/", payload, format="json"))
+        assert response.status_code == 200, response.data
+        bulk_time = default_timer() - started
+
+        self.stdout.write(
+            f"{size:>8}{per_item:>13.3f}{size / per_item:>10.0f}{bulk_time:>10.3f}{size / bulk_time:>10.0f}"
+        )
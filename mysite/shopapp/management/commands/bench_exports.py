@@ -0,0 +1,113 @@
+import csv
+import io
+import json
+from timeit import default_timer
+
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+
+from shopapp.caching import bump_version, PRODUCTS_VERSION
+from shopapp.columnar import write_npz, read_npz
+from shopapp.models import Product, Order
+from shopapp.views import ProductsDataExportView, OrdersExportView, ProductViewSet, OrderViewSet
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Сравнивает размер и время загрузки экспорта в JSON, CSV и ``.npz``.
+
+    С ``--seed N`` создаёт N товаров и N заказов во временной транзакции,
+    которая откатывается после замеров.
+    """
+    help = "Benchmark JSON, CSV and columnar (.npz) exports"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options["seed"]:
+                    self.seed(options["seed"])
+                self.run(options["repeat"])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, count):
+        user = User.objects.create_user(username="bench_exports_user")
+        products = Product.objects.bulk_create([
+            Product(name=f"Product {i}", description=f"Description of product {i}",
+                    price=i % 9999, count=i, created_by=user)
+            for i in range(count)
+        ], batch_size=1000)
+        orders = Order.objects.bulk_create([
+            Order(user=user, delivery_address=f"ul Popova, d {i}", promocode=f"promo{i % 10}")
+            for i in range(count)
+        ], batch_size=1000)
+        through = Order.products.through
+        through.objects.bulk_create([
+            through(order_id=order.pk, product_id=products[(i * 7 + k) % count].pk)
+            for i, order in enumerate(orders)
+            for k in range(3)
+        ], batch_size=1000)
+
+    def run(self, repeat):
+        factory = RequestFactory()
+        request = factory.get("/")
+        bump_version(PRODUCTS_VERSION)
+
+        def content(response):
+            if response.streaming:
+                return b"".join(response.streaming_content)
+            return response.content
+
+        exports = {
+            "json": [
+                content(ProductsDataExportView.as_view()(request)),
+                content(OrdersExportView.as_view()(request)),
+            ],
+            "csv": [
+                content(ProductViewSet.as_view({"get": "download_csv"})(request)),
+                content(OrderViewSet.as_view({"get": "download_csv"})(request)),
+            ],
+        }
+        started = default_timer()
+        exports["npz"] = [write_npz(io.BytesIO()).getvalue()]
+        npz_write = default_timer() - started
+
+        try:
+            import numpy
+
+            def load_npz(data):
+                with numpy.load(io.BytesIO(data)) as archive:
+                    return {key: archive[key] for key in archive.files}
+        except ImportError:
+            def load_npz(data):
+                return read_npz(io.BytesIO(data))
+
+        loaders = {
+            "json": lambda data: json.loads(data),
+            "csv": lambda data: list(csv.reader(io.StringIO(data.decode()))),
+            "npz": load_npz,
+        }
+
+        self.stdout.write(f"products: {Product.objects.count()}, orders: {Order.objects.count()}")
+        self.stdout.write(f"npz written in {npz_write:.3f}s")
+        self.stdout.write(f"{'format':<8}{'bytes':>14}{'load, s':>12}")
+        for name, payloads in exports.items():
+            timings = []
+            for _ in range(repeat):
+                started = default_timer()
+                for data in payloads:
+                    loaders[name](data)
+                timings.append(default_timer() - started)
+            size = sum(len(data) for data in payloads)
+            self.stdout.write(f"{name:<8}{size:>14}{min(timings):>12.4f}")
@@ -0,0 +1,90 @@
+from timeit import default_timer
+
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework.pagination import Cursor
+from rest_framework.request import Request
+
+from shopapp.models import Product
+from shopapp.pagination import PageNumberPagination, CursorPagination
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Сравнивает задержку страницы N для номеров страниц (с ``COUNT`` и без)
+    и для курсора.
+
+    Товары создаются во временной транзакции, которая откатывается.
+    """
+    help = "Benchmark page N latency: page number (with/without count) vs cursor pagination"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=200_000)
+        parser.add_argument("--pages", type=int, nargs="+", default=[1, 100, 1_000, 10_000])
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.seed(options["size"])
+                self.measure(options["pages"], options["repeat"])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, size):
+        user = User.objects.create_user(username="bench_pagination_user")
+        for start in range(0, size, 10_000):
+            Product.objects.bulk_create([
+                Product(name=f"Product {i}", price=i % 9999, count=1, created_by=user)
+                for i in range(start, min(start + 10_000, size))
+            ])
+        self.stdout.write(f"products: {Product.objects.count()}")
+
+    def measure(self, pages, repeat):
+        factory = RequestFactory(HTTP_HOST="localhost")
+        queryset = Product.objects.all()
+        page_size = PageNumberPagination.page_size
+
+        def page_number(number, count=True):
+            params = {"page": number}
+            if not count:
+                params["count"] = "false"
+            paginator = PageNumberPagination()
+            rows = paginator.paginate_queryset(queryset, Request(factory.get("/", params)))
+            paginator.get_paginated_response(rows)
+
+        def cursor(number):
+            # позиция курсора — pk последнего товара предыдущей страницы,
+            # клиент получает её из ссылки ``next``
+            paginator = CursorPagination()
+            paginator.base_url = "http://localhost/"
+            url = paginator.base_url
+            if number > 1:
+                position = queryset.order_by("pk").values_list("pk", flat=True)[(number - 1) * page_size - 1]
+                url = paginator.encode_cursor(Cursor(0, False, str(position)))
+            request = Request(factory.get(url))
+            started = default_timer()
+            rows = paginator.paginate_queryset(queryset, request)
+            paginator.get_paginated_response(rows)
+            return default_timer() - started
+
+        def timed(func, *args):
+            started = default_timer()
+            func(*args)
+            return default_timer() - started
+
+        self.stdout.write(f"{'page':>8}{'page+count, ms':>16}{'page, ms':>10}{'cursor, ms':>12}")
+        for number in pages:
+            with_count = min(timed(page_number, number) for _ in range(repeat))
+            without_count = min(timed(page_number, number, False) for _ in range(repeat))
+            by_cursor = min(cursor(number) for _ in range(repeat))
+            self.stdout.write(
+                f"{number:>8}{with_count * 1000:>16.2f}{without_count * 1000:>10.2f}{by_cursor * 1000:>12.2f}"
+            )
@@ -0,0 +1,100 @@
+import random
+from timeit import default_timer
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from shopapp.models import Order, Product, RelatedProduct
+from shopapp.recommendations import rebuild_related, related_key, related_product_ids, RELATED_PRODUCTS_LIMIT
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Замеры индекса совместных покупок: полная перестройка, поддержка при
+    добавлении товаров в заказ и выборка топа — из кеша, по индексу и
+    «на лету» ``GROUP BY`` по связующей таблице (как было бы без индекса).
+
+    Данные создаются во временной транзакции, которая откатывается.
+    """
+    help = "Benchmark the 'frequently bought together' index"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=1000)
+        parser.add_argument("--orders", type=int, default=20000)
+        parser.add_argument("--items", type=int, default=4, help="products per order")
+        parser.add_argument("--lookups", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.measure(**options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def measure(self, products, orders, items, lookups, **options):
+        random.seed(0)
+        user = User.objects.create_user(username="bench_related_user")
+        product_ids = [product.pk for product in Product.objects.bulk_create([
+            Product(name=f"Product {i}", price=1, count=10 ** 6, created_by=user) for i in range(products)
+        ])]
+        order_ids = [order.pk for order in Order.objects.bulk_create([Order(user=user) for _ in range(orders)])]
+        # популярные товары встречаются чаще (распределение Парето)
+        weights = [1 / (rank + 1) for rank in range(products)]
+        Item = Order.products.through
+        Item.objects.bulk_create([
+            Item(order_id=order_id, product_id=product_id)
+            for order_id in order_ids
+            for product_id in set(random.choices(product_ids, weights, k=items))
+        ], batch_size=1000)
+
+        started = default_timer()
+        pairs = rebuild_related()
+        self.stdout.write(f"rebuild: {pairs} pairs from {orders} orders in {default_timer() - started:.3f} s")
+
+        started = default_timer()
+        for order in Order.objects.filter(pk__in=order_ids[:100]):
+            order.products.add(*random.sample(product_ids, 2))
+        self.stdout.write(f"incremental add: {(default_timer() - started) * 10:.2f} ms per order")
+
+        sample = random.choices(product_ids, weights, k=lookups)
+
+        def on_the_fly(product_id):
+            return list(
+                Item.objects.filter(order__products=product_id).exclude(product_id=product_id)
+                .values("product_id").annotate(orders=Count("order_id"))
+                .order_by("-orders", "product_id").values_list("product_id", "orders")[:RELATED_PRODUCTS_LIMIT]
+            )
+
+        def top_from_index(product_id):
+            return list(
+                RelatedProduct.objects.filter(product_id=product_id).order_by("-orders", "related_id")
+                .values_list("related_id", "orders")[:RELATED_PRODUCTS_LIMIT]
+            )
+
+        assert on_the_fly(sample[0]) == top_from_index(sample[0])
+        cache.delete_many([related_key(pk) for pk in sample])
+        for pk in sample:
+            related_product_ids(pk)
+        # LocMemCache по умолчанию держит 300 ключей: часть выборок будет промахами
+        keys = {related_key(pk) for pk in sample}
+        self.stdout.write(f"cached: {len(cache.get_many(keys))} of {len(keys)} products")
+
+        self.stdout.write(f"{'lookup':<22}{'avg, ms':>10}")
+        for name, lookup in [
+            ("GROUP BY on the fly", on_the_fly),
+            ("index query", top_from_index),
+            ("cache", related_product_ids),
+        ]:
+            started = default_timer()
+            for pk in sample:
+                lookup(pk)
+            elapsed = default_timer() - started
+            self.stdout.write(f"{name:<22}{elapsed / lookups * 1000:>10.3f}")
@@ -0,0 +1,92 @@
+import random
+from timeit import default_timer
+
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from shopapp.models import Product
+from shopapp.search import search_products, fts_available
+
+WORDS = (
+    "laptop desktop smartphone tablet monitor keyboard mouse headphones speaker camera "
+    "printer router charger cable adapter battery screen case stand lamp watch drone "
+    "ноутбук телефон планшет монитор клавиатура наушники колонка камера зарядка"
+).split()
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Сравнивает задержку поиска товаров: ``icontains`` против FTS5.
+
+    Товары создаются во временной транзакции, которая откатывается.
+    """
+    help = "Benchmark product search latency (icontains vs FTS5)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            self.stderr.write("FTS5 index is not available, run migrate on SQLite first")
+            return
+        for size in options["sizes"]:
+            try:
+                with transaction.atomic():
+                    self.seed(size)
+                    self.measure(size, options["repeat"])
+                    raise Rollback
+            except Rollback:
+                pass
+
+    def seed(self, size):
+        rnd = random.Random(size)
+        user = User.objects.create_user(username="bench_search_user")
+        started = default_timer()
+        for start in range(0, size, 10_000):
+            Product.objects.bulk_create([
+                Product(
+                    name=" ".join(rnd.choices(WORDS, k=2)) + f" {i}",
+                    description=" ".join(rnd.choices(WORDS, k=12)),
+                    price=rnd.randint(1, 9999),
+                    count=1,
+                    created_by=user,
+                )
+                for i in range(start, min(start + 10_000, size))
+            ])
+        self.stdout.write(f"seeded {size} products in {default_timer() - started:.1f}s")
+
+    def measure(self, size, repeat):
+        # частые слова, префикс, два слова и редкий токен (номер товара)
+        queries = ["laptop", "charg", "телефон камера", str(size // 2)]
+        base = Product.objects.all()
+        strategies = {
+            "icontains": lambda terms: base.filter(*[
+                Q(name__icontains=term) | Q(description__icontains=term) for term in terms
+            ]),
+            "fts5": lambda terms: search_products(base, terms),
+        }
+        self.stdout.write(f"{'products':>10} {'query':<16}{'strategy':<11}{'count':>8}{'count, ms':>11}{'page, ms':>10}")
+        for query in queries:
+            terms = query.split()
+            for name, strategy in strategies.items():
+                count_timings = []
+                page_timings = []
+                for _ in range(repeat):
+                    queryset = strategy(terms)
+                    started = default_timer()
+                    count = queryset.count()
+                    count_timings.append(default_timer() - started)
+                    started = default_timer()
+                    list(queryset[:10])
+                    page_timings.append(default_timer() - started)
+                self.stdout.write(
+                    f"{size:>10} {query:<16}{name:<11}{count:>8}"
+                    f"{min(count_timings) * 1000:>11.1f}{min(page_timings) * 1000:>10.1f}"
+                )
@@ -0,0 +1,82 @@
+from timeit import default_timer
+
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand
+from django.db import transaction
+from rest_framework import serializers
+
+from shopapp.models import Product, Order
+from shopapp.serializers import ProductSerializer, OrderSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class PlainProductSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Product
+        fields = '__all__'
+
+
+class PlainOrderSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Order
+        fields = '__all__'
+
+
+class Command(BaseCommand):
+    """
+    Сравнивает скорость сериализации списка: обычный ``ModelSerializer``,
+    быстрый путь чтения и ``?fields=id,name,price`` с ``only()``.
+
+    Данные создаются во временной транзакции, которая откатывается.
+    """
+    help = "Benchmark list serialization throughput (ModelSerializer vs fast read path vs sparse fields)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=20_000)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.seed(options["size"])
+                self.measure(options["repeat"])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, size):
+        user = User.objects.create_user(username="bench_serializers_user")
+        Product.objects.bulk_create([
+            Product(name=f"Product {i}", description=f"Description of product {i} " * 5,
+                    price=i % 9999, count=i, created_by=user)
+            for i in range(size)
+        ], batch_size=1000)
+        Order.objects.bulk_create([
+            Order(user=user, delivery_address=f"ul Popova, d {i}", promocode=f"promo{i % 10}")
+            for i in range(size)
+        ], batch_size=1000)
+
+    def measure(self, repeat):
+        products = Product.objects.all()
+        orders = Order.objects.prefetch_related("products")
+        fields = ["id", "name", "price"]
+        # ``.all()`` — новый запрос на каждый прогон, без кеша queryset
+        cases = {
+            "products, ModelSerializer": lambda: PlainProductSerializer(products.all(), many=True).data,
+            "products, fast path": lambda: ProductSerializer(products.all(), many=True).data,
+            "products, fields+only": lambda: ProductSerializer(products.only(*fields), many=True, fields=fields).data,
+            "orders, ModelSerializer": lambda: PlainOrderSerializer(orders.all(), many=True).data,
+            "orders, fast path": lambda: OrderSerializer(orders.all(), many=True).data,
+        }
+        self.stdout.write(f"{'case':<28}{'rows':>8}{'s':>9}{'rows/s':>10}")
+        for name, serialize in cases.items():
+            timings = []
+            for _ in range(repeat):
+                started = default_timer()
+                rows = len(serialize())
+                timings.append(default_timer() - started)
+            best = min(timings)
+            self.stdout.write(f"{name:<28}{rows:>8}{best:>9.3f}{rows / best:>10.0f}")
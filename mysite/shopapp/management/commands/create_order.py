@@ -1,9 +1,10 @@
 from typing import Sequence
 
 from django.contrib.auth.models import User
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
 from django.db import transaction
 from shopapp.models import Order, Product
+from shopapp.stock import reserve_products, OutOfStock
 
 
 class Command(BaseCommand):
@@ -12,14 +13,16 @@ class Command(BaseCommand):
         self.stdout.write('Creating order with products')
 
         user = User.objects.get(username='admin')
-        products: Sequence[Product] = Product.objects.defer('description', 'price', 'created_at').all()
+        products: Sequence[int] = Product.objects.values_list('pk', flat=True)
         order, created = Order.objects.get_or_create(
             delivery_address='ul Ivanova, d 10, kv 1',
             promocode='promo1',
             user=user,
         )
-        for product in products:
-            order.products.add(product)
+        try:
+            reserve_products(order, products)
+        except OutOfStock as exc:
+            raise CommandError(str(exc))
 
         order.save()
         self.stdout.write(f"Order {order} created!")
@@ -0,0 +1,30 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from shopapp.models import Order
+from shopapp.totals import rebuild_order_totals
+
+
+class Command(BaseCommand):
+    """
+    Пересчитывает ``Order.total`` и ``Order.products_count`` по связям с товарами.
+
+    Нужна после загрузки данных в обход ORM. Заказы обрабатываются
+    диапазонами ``pk``, каждый в своей транзакции.
+    """
+    help = "Rebuild stored order totals and product counts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        pks = Order.objects.order_by("pk").values_list("pk", flat=True)
+        last = pks.last()
+        start = pks.first()
+        updated = 0
+        while start is not None and start <= last:
+            end = start + options["batch_size"]
+            with transaction.atomic():
+                updated += rebuild_order_totals(Order.objects.filter(pk__gte=start, pk__lt=end))
+            start = end
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt totals for {updated} orders"))
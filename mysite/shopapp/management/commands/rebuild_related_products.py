@@ -0,0 +1,22 @@
+from django.core.management import BaseCommand
+
+from shopapp.recommendations import rebuild_related, REBUILD_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Перестраивает индекс совместных покупок (:model:`shopapp.RelatedProduct`)
+    по связующей таблице заказов и товаров.
+
+    Нужна после загрузки заказов в обход ORM. С ``--products`` пересчитываются
+    только пары с этими товарами.
+    """
+    help = "Rebuild the 'frequently bought together' index"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, nargs="+", help="product ids to rebuild")
+        parser.add_argument("--batch-size", type=int, default=REBUILD_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        written = rebuild_related(options["products"], batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} product pairs"))
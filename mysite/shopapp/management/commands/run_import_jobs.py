@@ -0,0 +1,74 @@
+import os
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from shopapp.common import CSV_IMPORT_BATCH_SIZE, IMPORT_JOB_LEASE_SECONDS, LeaseLost, run_import_job
+from shopapp.models import ImportJob
+
+
+class Command(BaseCommand):
+    """
+    Локальный обработчик фоновых задач импорта CSV.
+
+    Обработчиков может быть несколько: задача берётся условным UPDATE
+    и считается занятой, пока её обработчик обновляет ``heartbeat_at``.
+    Задачи без сигнала дольше ``--lease`` секунд (обработчик упал)
+    продолжаются с последней сохранённой пачки.
+    """
+    help = "Run pending CSV import jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Process the queue and exit")
+        parser.add_argument("--poll-interval", type=float, default=2.0)
+        parser.add_argument("--batch-size", type=int, default=CSV_IMPORT_BATCH_SIZE)
+        parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                            help="Processes used to validate rows, only one of them writes to the database")
+        parser.add_argument("--lease", type=float, default=IMPORT_JOB_LEASE_SECONDS,
+                            help="Seconds without a heartbeat after which a running job is taken over; "
+                                 "must exceed the time of one batch")
+
+    def handle(self, *args, **options):
+        lease = timedelta(seconds=options["lease"])
+        while True:
+            job = self.claim_next_job(lease)
+            if job is None:
+                if options["once"]:
+                    break
+                time.sleep(options["poll_interval"])
+                continue
+
+            self.stdout.write(f"{'Resuming' if job.rows_processed else 'Running'} {job}")
+            try:
+                job = run_import_job(job, batch_size=options["batch_size"], workers=options["workers"])
+            except LeaseLost as exc:
+                self.stderr.write(str(exc))
+                continue
+            except Exception as exc:
+                self.stderr.write(f"{job} failed: {exc!r}")
+                continue
+            self.stdout.write(self.style.SUCCESS(
+                f"{job}: {job.rows_ok} rows ok, {job.rows_rejected} rejected, {job.throughput} rows/s"
+            ))
+
+    def claim_next_job(self, lease):
+        expired = Q(status=ImportJob.STATUS_RUNNING) & (
+            Q(heartbeat_at__lt=timezone.now() - lease) | Q(heartbeat_at__isnull=True)
+        )
+        for job in ImportJob.objects.filter(Q(status=ImportJob.STATUS_PENDING) | expired).order_by("pk"):
+            # задачу мог забрать другой обработчик между выборкой и UPDATE
+            claimed_by = uuid.uuid4().hex
+            claimed = ImportJob.objects.filter(
+                pk=job.pk,
+                status=job.status,
+                claimed_by=job.claimed_by,
+                heartbeat_at=job.heartbeat_at,
+            ).update(status=ImportJob.STATUS_RUNNING, claimed_by=claimed_by, heartbeat_at=timezone.now())
+            if claimed:
+                job.refresh_from_db()
+                return job
+        return None
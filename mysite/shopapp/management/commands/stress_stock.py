@@ -0,0 +1,100 @@
+import threading
+import time
+from timeit import default_timer
+
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction, OperationalError
+
+from shopapp.models import Order, Product
+from shopapp.stock import reserve_products, OutOfStock
+
+
+def place_order(user, product_ids, retries):
+    # SQLite отвечает "database is locked", если не дождался блокировки записи
+    # (в памяти с общим кешем — сразу): такую транзакцию можно просто повторить
+    for attempt in range(retries + 1):
+        try:
+            with transaction.atomic():
+                order = Order.objects.create(user=user, delivery_address="stress test")
+                reserve_products(order, product_ids, current=set())
+            return "placed"
+        except OutOfStock:
+            return "rejected"
+        except OperationalError:
+            time.sleep(0.001 * attempt)
+    return "errors"
+
+
+def place_orders(user, product_ids, attempts, retries, results, lock):
+    """Создаёт заказы в своём потоке (и своём соединении с базой), пока не кончатся попытки."""
+    try:
+        for _ in range(attempts):
+            outcome = place_order(user, product_ids, retries)
+            with lock:
+                results[outcome] += 1
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочная проверка резервирования: потоки одновременно заказывают
+    одни и те же товары, которых на складе меньше, чем заказов.
+
+    Проверяет, что не продано больше остатка и остатки не ушли в минус.
+    Созданные данные удаляются после прогона.
+    """
+    help = "Stress test stock reservation with concurrent orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--orders", type=int, default=100, help="orders per thread")
+        parser.add_argument("--stock", type=int, default=300)
+        parser.add_argument("--products", type=int, default=3, help="products per order")
+        parser.add_argument("--retries", type=int, default=0, help="retries on 'database is locked'")
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(username="stress_stock_user")
+        products = Product.objects.bulk_create([
+            Product(name=f"Stress {i}", price=1, count=options["stock"], created_by=user)
+            for i in range(options["products"])
+        ])
+        product_ids = [product.pk for product in products]
+        results = {"placed": 0, "rejected": 0, "errors": 0}
+        lock = threading.Lock()
+        threads = [
+            threading.Thread(
+                target=place_orders,
+                args=(user, product_ids, options["orders"], options["retries"], results, lock),
+            )
+            for _ in range(options["threads"])
+        ]
+        started = default_timer()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = default_timer() - started
+
+        counts = list(Product.objects.filter(pk__in=product_ids).values_list("count", flat=True))
+        sold = Order.products.through.objects.filter(product_id__in=product_ids).count()
+        orders = Order.objects.filter(user=user).count()
+        self.stdout.write(
+            f"orders placed: {results['placed']}, rejected: {results['rejected']}, "
+            f"errors: {results['errors']}, {results['placed'] / elapsed:.0f} orders/s"
+        )
+        self.stdout.write(f"stock left: {counts}, units sold: {sold}")
+
+        Order.objects.filter(user=user).delete()
+        Product.objects.filter(pk__in=product_ids).delete()
+        user.delete()
+
+        expected = min(options["stock"], options["threads"] * options["orders"])
+        if results["errors"]:
+            raise CommandError("database errors under concurrent orders")
+        if orders != results["placed"] or results["placed"] != expected or any(count < 0 for count in counts):
+            raise CommandError("stock reservation is inconsistent")
+        if sold != results["placed"] * options["products"]:
+            raise CommandError("order items do not match reserved stock")
+        self.stdout.write(self.style.SUCCESS("OK"))
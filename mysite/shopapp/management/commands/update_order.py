@@ -1,5 +1,6 @@
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
 from shopapp.models import Order, Product
+from shopapp.stock import reserve_products, OutOfStock
 
 
 class Command(BaseCommand):
@@ -10,9 +11,11 @@ class Command(BaseCommand):
             self.stdout.write("No order found!")
             return
 
-        products = Product.objects.all()
-        for product in products:
-            order.products.add(product)
+        products = Product.objects.values_list('pk', flat=True)
+        try:
+            reserve_products(order, products)
+        except OutOfStock as exc:
+            raise CommandError(str(exc))
 
         order.save()
 
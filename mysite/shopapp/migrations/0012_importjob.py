@@ -0,0 +1,44 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:24
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0011_alter_order_options_alter_product_options_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target', models.CharField(choices=[('products', 'Products'), ('orders', 'Orders')], max_length=20, verbose_name='что импортируем')),
+                ('file', models.FileField(upload_to='imports/', verbose_name='файл')),
+                ('encoding', models.CharField(default='utf-8', max_length=40, verbose_name='кодировка')),
+                ('upsert', models.BooleanField(default=False, verbose_name='обновлять существующие')),
+                ('status', models.CharField(choices=[('pending', 'в очереди'), ('running', 'выполняется'), ('done', 'завершён'), ('failed', 'ошибка')], db_index=True, default='pending', max_length=20, verbose_name='статус')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='дата создания')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='начало')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='окончание')),
+                ('rows_processed', models.PositiveIntegerField(default=0, verbose_name='обработано строк')),
+                ('rows_ok', models.PositiveIntegerField(default=0)),
+                ('rows_rejected', models.PositiveIntegerField(default=0)),
+                ('rows_created', models.PositiveIntegerField(default=0)),
+                ('rows_updated', models.PositiveIntegerField(default=0)),
+                ('rows_unchanged', models.PositiveIntegerField(default=0)),
+                ('errors', models.JSONField(blank=True, default=list)),
+                ('failure', models.TextField(blank=True)),
+                ('created_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='import_jobs', to=settings.AUTH_USER_MODEL, verbose_name='создал')),
+            ],
+            options={
+                'verbose_name': 'Import job',
+                'verbose_name_plural': 'Import jobs',
+                'ordering': ['-pk'],
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:32
+
+from django.db import migrations, models
+
+# SQL на момент миграции: shopapp.search может измениться, а миграция — нет
+FTS_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS shopapp_product_fts USING fts5(
+        name, description, content='shopapp_product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2')
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS shopapp_product_fts_ai AFTER INSERT ON shopapp_product BEGIN
+        INSERT INTO shopapp_product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS shopapp_product_fts_ad AFTER DELETE ON shopapp_product BEGIN
+        INSERT INTO shopapp_product_fts(shopapp_product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS shopapp_product_fts_au AFTER UPDATE OF name, description ON shopapp_product BEGIN
+        INSERT INTO shopapp_product_fts(shopapp_product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO shopapp_product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    "INSERT INTO shopapp_product_fts(shopapp_product_fts) VALUES ('rebuild')",
+]
+DROP_FTS_SQL = [
+    "DROP TRIGGER IF EXISTS shopapp_product_fts_ai",
+    "DROP TRIGGER IF EXISTS shopapp_product_fts_ad",
+    "DROP TRIGGER IF EXISTS shopapp_product_fts_au",
+    "DROP TABLE IF EXISTS shopapp_product_fts",
+]
+
+
+def execute_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        for sql in statements:
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0012_importjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='description',
+            field=models.TextField(blank=True, verbose_name='описание'),
+        ),
+        migrations.RunPython(execute_sqlite(FTS_SQL), execute_sqlite(DROP_FTS_SQL)),
+    ]
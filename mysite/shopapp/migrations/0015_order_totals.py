@@ -0,0 +1,43 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:47
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Count, Value, DecimalField, IntegerField
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    Order = apps.get_model("shopapp", "Order")
+    items = Order.products.through.objects.filter(order_id=OuterRef("pk")).order_by().values("order_id")
+    Order.objects.using(schema_editor.connection.alias).update(
+        total=Coalesce(
+            Subquery(items.annotate(total=Sum("product__price")).values("total")),
+            Value(Decimal(0)), output_field=DecimalField(),
+        ),
+        products_count=Coalesce(
+            Subquery(items.annotate(count=Count("pk")).values("count")),
+            Value(0), output_field=IntegerField(),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0014_created_at_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='products_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='количество товаров'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='сумма'),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
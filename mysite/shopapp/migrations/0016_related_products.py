@@ -0,0 +1,47 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, Count
+
+
+def backfill_related(apps, schema_editor):
+    Order = apps.get_model("shopapp", "Order")
+    RelatedProduct = apps.get_model("shopapp", "RelatedProduct")
+    db = schema_editor.connection.alias
+    pairs = (
+        Order.products.through.objects.using(db)
+        .annotate(related_id=F("order__products")).exclude(related_id=F("product_id"))
+        .values_list("product_id", "related_id").annotate(orders=Count("order_id")).order_by()
+    )
+    RelatedProduct.objects.using(db).bulk_create(
+        (RelatedProduct(product_id=product_id, related_id=related_id, orders=orders)
+         for product_id, related_id, orders in pairs.iterator()),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0015_order_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orders', models.PositiveIntegerField(default=0, verbose_name='заказов вместе')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shopapp.product')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shopapp.product')),
+            ],
+            options={
+                'verbose_name': 'Related product',
+                'verbose_name_plural': 'Related products',
+                'indexes': [models.Index(fields=['product', '-orders'], name='shopapp_related_top_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'related'), name='shopapp_related_product_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_related, migrations.RunPython.noop),
+    ]
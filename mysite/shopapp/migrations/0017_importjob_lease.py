@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0016_related_products'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='claimed_by',
+            field=models.CharField(blank=True, max_length=32, verbose_name='обработчик'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='последний сигнал обработчика'),
+        ),
+    ]
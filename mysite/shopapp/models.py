@@ -2,6 +2,7 @@ from django.contrib.auth.models import User
 from django.db import models
 from django.db.models import CharField
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
@@ -32,9 +33,13 @@ class Product(models.Model):
         # verbose_name = 'products
         verbose_name = _('Product')
         verbose_name_plural = _('Products')
+        indexes = [
+            # курсорная пагинация по дате создания (shopapp.pagination)
+            models.Index(fields=['created_at', 'id'], name='shopapp_product_created_idx'),
+        ]
 
     name = models.CharField(max_length=100, verbose_name=_('название'), db_index=True)
-    description = models.TextField(null=False, blank=True, verbose_name=_('описание'), db_index=True)
+    description = models.TextField(null=False, blank=True, verbose_name=_('описание'))
     price = models.DecimalField(max_digits=6, decimal_places=2, verbose_name=_('цена'))
     count = models.IntegerField(verbose_name=_('количество'))
     discount = models.SmallIntegerField(default=0, verbose_name=_('скидка'))
@@ -46,6 +51,14 @@ class Product(models.Model):
     def __str__(self) -> CharField:
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # цена из базы: при сохранении суммы заказов меняются только на разницу
+        if "price" in field_names:
+            instance._loaded_price = instance.price
+        return instance
+
     def get_absolute_url(self):
         return reverse("shopapp:product_details", kwargs={"pk": self.pk})
 
@@ -63,10 +76,125 @@ class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.PROTECT, related_name="orders", verbose_name=_('пользователь'))
     products = models.ManyToManyField(Product, related_name="orders", verbose_name=_('товары'))
     receipt = models.FileField(null=True, upload_to="orders/receipts/", verbose_name=_('рецепт'))
+    # поддерживаются сигналами, см. shopapp.totals
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False, verbose_name=_('сумма'))
+    products_count = models.PositiveIntegerField(default=0, editable=False, verbose_name=_('количество товаров'))
 
     class Meta:
         verbose_name = _('Order')
         verbose_name_plural = _('Orders')
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='shopapp_order_created_idx'),
+        ]
 
     def __str__(self) -> str:
         return f"Order(pk={self.pk}, delivery_address={self.delivery_address!r})"
+
+
+class RelatedProduct(models.Model):
+    """
+    Сколько заказов содержат оба товара: ``product`` и ``related``.
+
+    Пары хранятся в обе стороны, строк с нулём нет. Поддерживается сигналами,
+    см. :mod:`shopapp.recommendations`.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    orders = models.PositiveIntegerField(default=0, verbose_name=_('заказов вместе'))
+
+    class Meta:
+        verbose_name = _('Related product')
+        verbose_name_plural = _('Related products')
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'related'], name='shopapp_related_product_unique'),
+        ]
+        indexes = [
+            # топ связанных товаров: WHERE product_id = ? ORDER BY orders DESC
+            models.Index(fields=['product', '-orders'], name='shopapp_related_top_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"RelatedProduct(product={self.product_id}, related={self.related_id}, orders={self.orders})"
+
+
+class ProductSearchIndex(models.Model):
+    """
+    Строка FTS5-индекса товаров ``shopapp_product_fts``, см. :mod:`shopapp.search`.
+
+    Таблицу и триггеры создаёт миграция, Django её не изменяет. Модель нужна,
+    чтобы поиск соединял индекс с товарами JOIN-ом и сортировал по ``rank``.
+    """
+    product = models.OneToOneField(Product, primary_key=True, db_column="rowid", db_constraint=False,
+                                   on_delete=models.DO_NOTHING, related_name="search_index")
+    # скрытый столбец FTS5 с именем таблицы: к нему применяется MATCH (лукап ``match``)
+    document = models.TextField(db_column="shopapp_product_fts")
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = "shopapp_product_fts"
+
+
+class ImportJob(models.Model):
+    """
+    Фоновая задача импорта CSV.
+
+    Выполняется командой ``run_import_jobs``, см. :func:`shopapp.common.run_import_job`.
+    Обработчик, взявший задачу (``claimed_by``), обновляет ``heartbeat_at`` после каждой пачки;
+    задачу без сигнала дольше аренды забирает другой обработчик.
+    """
+    TARGET_PRODUCTS = "products"
+    TARGET_ORDERS = "orders"
+    TARGET_CHOICES = [
+        (TARGET_PRODUCTS, _('Products')),
+        (TARGET_ORDERS, _('Orders')),
+    ]
+
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, _('в очереди')),
+        (STATUS_RUNNING, _('выполняется')),
+        (STATUS_DONE, _('завершён')),
+        (STATUS_FAILED, _('ошибка')),
+    ]
+
+    class Meta:
+        ordering = ['-pk']
+        verbose_name = _('Import job')
+        verbose_name_plural = _('Import jobs')
+
+    target = models.CharField(max_length=20, choices=TARGET_CHOICES, verbose_name=_('что импортируем'))
+    file = models.FileField(upload_to="imports/", verbose_name=_('файл'))
+    encoding = models.CharField(max_length=40, default="utf-8", verbose_name=_('кодировка'))
+    upsert = models.BooleanField(default=False, verbose_name=_('обновлять существующие'))
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True,
+                              verbose_name=_('статус'))
+    created_by = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, related_name="import_jobs",
+                                   verbose_name=_('создал'))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('дата создания'))
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name=_('начало'))
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name=_('окончание'))
+    claimed_by = models.CharField(max_length=32, blank=True, verbose_name=_('обработчик'))
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name=_('последний сигнал обработчика'))
+    rows_processed = models.PositiveIntegerField(default=0, verbose_name=_('обработано строк'))
+    rows_ok = models.PositiveIntegerField(default=0)
+    rows_rejected = models.PositiveIntegerField(default=0)
+    rows_created = models.PositiveIntegerField(default=0)
+    rows_updated = models.PositiveIntegerField(default=0)
+    rows_unchanged = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    failure = models.TextField(blank=True)
+
+    def __str__(self) -> str:
+        return f"ImportJob(pk={self.pk}, target={self.target!r}, status={self.status!r})"
+
+    @property
+    def throughput(self) -> float:
+        """Строк в секунду с момента запуска задачи."""
+        if self.started_at is None:
+            return 0.0
+        elapsed = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+        return round(self.rows_processed / elapsed, 1) if elapsed > 0 else 0.0
@@ -0,0 +1,172 @@
+"""
+Пагинация API товаров и заказов.
+
+По умолчанию — номера страниц, как и раньше. Для глубокого постраничного
+чтения (синхронизация клиентов) можно перейти на курсор: первая страница
+``?pagination=cursor``, дальше — по ссылке ``next`` с параметром ``cursor``.
+Курсор работает только на стабильных сортировках ``pk`` и ``created_at``
+(для ``created_at`` есть индекс ``(created_at, id)``), и вместо ``OFFSET``
+фильтрует по последнему значению — время ответа не зависит от номера страницы.
+
+``?count=false`` в режиме номеров страниц пропускает запрос ``COUNT(*)``:
+в ответе нет ``count``, а наличие следующей страницы определяется
+по одной лишней строке.
+"""
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+CURSOR_ORDERINGS = {
+    "pk": ("pk",),
+    "-pk": ("-pk",),
+    "created_at": ("created_at", "pk"),
+    "-created_at": ("-created_at", "-pk"),
+}
+
+
+class PageNumberPagination(pagination.PageNumberPagination):
+    count_query_param = "count"
+
+    def skip_count(self, request) -> bool:
+        return request.query_params.get(self.count_query_param, "").lower() == "false"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.without_count = self.skip_count(request)
+        if not self.without_count:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        page_number = request.query_params.get(self.page_query_param) or 1
+        try:
+            page_number = int(page_number)
+            if page_number < 1:
+                raise ValueError
+        except ValueError:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message="That page number is not an integer"
+            ))
+        offset = (page_number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        if not rows and page_number > 1:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message="That page contains no results"
+            ))
+        self.number = page_number
+        self.has_next = len(rows) > page_size
+        return rows[:page_size]
+
+    def get_paginated_response(self, data):
+        if not self.without_count:
+            return super().get_paginated_response(data)
+        return Response({
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        })
+
+    def get_next_link(self):
+        if not self.without_count:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.page_query_param, self.number + 1)
+
+    def get_previous_link(self):
+        if not self.without_count:
+            return super().get_previous_link()
+        if self.number == 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.number - 1)
+
+
+class CursorPagination(pagination.CursorPagination):
+    ordering = "pk"
+    ordering_param = "ordering"
+
+    def get_ordering(self, request, queryset, view):
+        value = request.query_params.get(self.ordering_param) or self.ordering
+        if value not in CURSOR_ORDERINGS:
+            raise ValidationError({
+                self.ordering_param: [f"Cursor pagination supports only: {', '.join(CURSOR_ORDERINGS)}"]
+            })
+        return CURSOR_ORDERINGS[value]
+
+
+class PaginationAwareFilterBackend(DjangoFilterBackend):
+    """
+    ``DjangoFilterBackend``, который не принимает флаг ``count=true/false``
+    за фильтр по полю ``Product.count``.
+    """
+
+    def get_filterset_kwargs(self, request, queryset, view):
+        kwargs = super().get_filterset_kwargs(request, queryset, view)
+        count = PageNumberPagination.count_query_param
+        if kwargs["data"].get(count, "").lower() in ("true", "false"):
+            kwargs["data"] = kwargs["data"].copy()
+            kwargs["data"].pop(count)
+        return kwargs
+
+
+class ShopPagination(pagination.BasePagination):
+    """
+    Номера страниц по умолчанию, курсор — по ``?pagination=cursor``
+    или при наличии параметра ``cursor``.
+    """
+    mode_query_param = "pagination"
+
+    def __init__(self):
+        self.pages = PageNumberPagination()
+        self.cursor = CursorPagination()
+        self.active = self.pages
+
+    def use_cursor(self, request) -> bool:
+        return (
+            self.cursor.cursor_query_param in request.query_params
+            or request.query_params.get(self.mode_query_param) == "cursor"
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.active = self.cursor if self.use_cursor(request) else self.pages
+        return self.active.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.active.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.pages.get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        parameters = self.pages.get_schema_operation_parameters(view)
+        parameters += [
+            {
+                "name": self.pages.count_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Pass false to skip the total count.",
+                "schema": {"type": "boolean"},
+            },
+            {
+                "name": self.mode_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Pass cursor to switch to cursor pagination.",
+                "schema": {"type": "string", "enum": ["cursor"]},
+            },
+            {
+                "name": self.cursor.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": self.cursor.cursor_query_description,
+                "schema": {"type": "string"},
+            },
+        ]
+        return parameters
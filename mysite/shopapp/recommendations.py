@@ -0,0 +1,142 @@
+"""
+«С этим товаром покупают»: индекс совместных покупок.
+
+Для каждой пары товаров из одного заказа в :model:`shopapp.RelatedProduct`
+хранится число таких заказов (в обе стороны, без нулей). Индекс строится
+одним агрегирующим запросом по связующей таблице (:func:`rebuild_related`,
+команда ``rebuild_related_products``), а дальше поддерживается сигналами:
+добавление товаров в заказ увеличивает счётчики пар, удаление — уменьшает.
+
+Топ связанных товаров берётся из кеша, при промахе — одним запросом по индексу
+``(product, -orders)``. При изменении пар ключи затронутых товаров удаляются.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q, Count
+
+from .caching import EXPORT_CACHE_TIMEOUT
+from .common import iter_batches
+from .models import Order, Product, RelatedProduct
+
+RELATED_PRODUCTS_LIMIT = getattr(settings, "SHOPAPP_RELATED_PRODUCTS_LIMIT", 10)
+REBUILD_BATCH_SIZE = 1000
+
+
+def related_key(product_id) -> str:
+    return f"shopapp:related:{product_id}"
+
+
+def forget(product_ids) -> None:
+    cache.delete_many([related_key(pk) for pk in product_ids])
+
+
+def add_order_products(added, existing) -> None:
+    """Учитывает товары ``added``, добавленные в заказ к уже лежащим там ``existing``."""
+    added = set(added)
+    existing = set(existing) - added
+    everyone = added | existing
+    if not added or len(everyone) < 2:
+        return
+    pairs = [(a, b) for a in added for b in everyone if a != b] + [(a, b) for a in existing for b in added]
+    # новые пары создаются с нулём, затем все счётчики растут одним UPDATE
+    RelatedProduct.objects.bulk_create(
+        [RelatedProduct(product_id=a, related_id=b) for a, b in pairs],
+        ignore_conflicts=True,
+        batch_size=500,
+    )
+    RelatedProduct.objects.filter(
+        Q(product_id__in=added, related_id__in=everyone) | Q(product_id__in=existing, related_id__in=added)
+    ).update(orders=F("orders") + 1)
+    forget(everyone)
+
+
+def remove_order_products(removed, existing) -> None:
+    """Учитывает удаление товаров ``removed`` из заказа, где лежат ``existing``."""
+    existing = set(existing)
+    removed = set(removed) & existing
+    rest = existing - removed
+    if not removed or len(existing) < 2:
+        return
+    pairs = RelatedProduct.objects.filter(
+        Q(product_id__in=removed, related_id__in=existing) | Q(product_id__in=rest, related_id__in=removed)
+    )
+    pairs.filter(orders__gt=0).update(orders=F("orders") - 1)
+    pairs.filter(orders=0).delete()
+    forget(existing)
+
+
+def co_occurrences():
+    """Пары ``(product_id, related_id, orders)`` по связующей таблице одним запросом с ``GROUP BY``."""
+    return (
+        Order.products.through.objects
+        .annotate(related_id=F("order__products")).exclude(related_id=F("product_id"))
+        .values_list("product_id", "related_id").annotate(orders=Count("order_id")).order_by()
+    )
+
+
+def rebuild_related(product_ids=None, batch_size=REBUILD_BATCH_SIZE) -> int:
+    """
+    Пересчитывает пары с товарами ``product_ids`` (по умолчанию — весь индекс).
+    Возвращает число записанных пар.
+    """
+    pairs = co_occurrences()
+    stale = RelatedProduct.objects.all()
+    if product_ids is not None:
+        product_ids = set(product_ids)
+        pairs = pairs.filter(product_id__in=product_ids)
+        stale = stale.filter(Q(product_id__in=product_ids) | Q(related_id__in=product_ids))
+
+    touched = set()
+
+    def rows():
+        for product_id, related_id, orders in pairs.iterator(chunk_size=batch_size):
+            yield RelatedProduct(product_id=product_id, related_id=related_id, orders=orders)
+            if product_ids is not None and related_id not in product_ids:
+                # обратная пара: у related она не пересчитывается отдельно
+                touched.add(related_id)
+                yield RelatedProduct(product_id=related_id, related_id=product_id, orders=orders)
+
+    written = 0
+    with transaction.atomic():
+        if product_ids is not None:
+            touched.update(product_ids, stale.values_list("product_id", flat=True))
+        stale.delete()
+        for batch in iter_batches(rows(), batch_size):
+            RelatedProduct.objects.bulk_create(batch)
+            written += len(batch)
+    if product_ids is None:
+        touched = Product.objects.values_list("pk", flat=True)
+    forget(touched)
+    return written
+
+
+def related_product_ids(product_id) -> list:
+    """Топ ``RELATED_PRODUCTS_LIMIT`` пар ``(related_id, orders)`` для товара."""
+    key = related_key(product_id)
+    top = cache.get(key)
+    if top is None:
+        top = list(
+            RelatedProduct.objects.filter(product_id=product_id)
+            .order_by("-orders", "related_id")
+            .values_list("related_id", "orders")[:RELATED_PRODUCTS_LIMIT]
+        )
+        cache.set(key, top, EXPORT_CACHE_TIMEOUT)
+    return top
+
+
+def related_products(product_id, limit=RELATED_PRODUCTS_LIMIT, queryset=None) -> list:
+    """
+    Связанные товары (без архивных) в порядке убывания числа общих заказов.
+    У каждого товара — атрибут ``orders_together``.
+    """
+    top = related_product_ids(product_id)[:limit]
+    if queryset is None:
+        queryset = Product.objects.all()
+    products = queryset.filter(archived=False).in_bulk([pk for pk, _ in top])
+    result = []
+    for pk, orders in top:
+        if pk in products:
+            products[pk].orders_together = orders
+            result.append(products[pk])
+    return result
@@ -0,0 +1,139 @@
+"""
+Полнотекстовый поиск товаров через SQLite FTS5.
+
+Индекс ``shopapp_product_fts`` хранит только токены (external content)
+и обновляется триггерами на ``shopapp_product``, поэтому в нём учитываются
+и ``bulk_create``/``update()``. На других СУБД используется обычный ``icontains``.
+"""
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import F, Lookup
+from rest_framework.filters import SearchFilter
+
+from .models import ProductSearchIndex
+
+FTS_TABLE = "shopapp_product_fts"
+FTS_TRIGGERS = {
+    f"{FTS_TABLE}_ai": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON shopapp_product BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+    """,
+    f"{FTS_TABLE}_ad": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON shopapp_product BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+        END
+    """,
+    f"{FTS_TABLE}_au": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, description ON shopapp_product BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+    """,
+}
+
+_available = {}
+
+
+class Match(Lookup):
+    """``<столбец> MATCH <запрос FTS5>``."""
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", [*lhs_params, *rhs_params]
+
+
+ProductSearchIndex._meta.get_field("document").register_lookup(Match)
+
+
+def ensure_fts(using=DEFAULT_DB_ALIAS):
+    """
+    Создаёт индекс и триггеры, если их нет, и перестраивает индекс.
+
+    Пересоздание таблицы товаров в миграциях SQLite удаляет триггеры —
+    поэтому функция вызывается и после каждого ``migrate``.
+    """
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger') AND name LIKE %s",
+            [f"{FTS_TABLE}%"],
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+        if FTS_TABLE in existing and existing.issuperset(FTS_TRIGGERS):
+            return True
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "name, description, content='shopapp_product', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2')"
+        )
+        for sql in FTS_TRIGGERS.values():
+            cursor.execute(sql)
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    _available[using] = True
+    return True
+
+
+def drop_fts(using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name in FTS_TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    _available.pop(using, None)
+
+
+def fts_available(using=DEFAULT_DB_ALIAS) -> bool:
+    if using not in _available:
+        connection = connections[using]
+        _available[using] = (
+            connection.vendor == "sqlite"
+            and FTS_TABLE in connection.introspection.table_names()
+        )
+    return _available[using]
+
+
+def fts_match_query(terms) -> str:
+    """Каждое слово ищется как префикс: ``"lap"*`` находит ``Laptop``."""
+    return " ".join('"{}"*'.format(term.replace('"', '""')) for term in terms if term)
+
+
+def search_products(queryset, terms):
+    """
+    Фильтрует товары по FTS-индексу и сортирует по релевантности (bm25).
+
+    Возвращает ``None``, если индекс недоступен.
+    """
+    if not fts_available(queryset.db):
+        return None
+    match = fts_match_query(terms)
+    if not match:
+        return queryset
+    # JOIN с индексом, а не подзапрос: rank в подзапросе SQLite считает заново для каждой строки
+    return queryset.filter(search_index__document__match=match).annotate(
+        search_rank=F("search_index__rank"),
+    ).order_by("search_rank")
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    ``SearchFilter`` для товаров на FTS5 с сортировкой по релевантности.
+
+    Явный ``?ordering=`` из ``OrderingFilter`` по-прежнему имеет приоритет.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        result = search_products(queryset, terms)
+        if result is None:
+            return super().filter_queryset(request, queryset, view)
+        return result
@@ -1,15 +1,158 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from django.utils.functional import cached_property
 from rest_framework import serializers
-from .models import Product, Order
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+from .models import Product, Order, ImportJob
 
+PLAIN_FIELDS = (
+    serializers.ReadOnlyField,
+    serializers.CharField,
+    serializers.IntegerField,
+    serializers.BooleanField,
+    serializers.PrimaryKeyRelatedField,
+)
 
-class ProductSerializer(serializers.ModelSerializer):
+
+class SparseFieldsMixin:
+    """
+    Принимает ``fields=[...]`` и оставляет только перечисленные поля.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class FastReadMixin:
+    """
+    Быстрое чтение для ``ModelSerializer``.
+
+    Простые колонки (строки, числа, bool, id связей) берутся прямо из атрибута
+    модели, без ``get_attribute``/``to_representation`` для каждого поля.
+    Остальные (деньги, даты, файлы, m2m) сериализуются как обычно.
+    """
+
+    def plain_attname(self, field):
+        if type(field) not in PLAIN_FIELDS or "." in field.source or field.source == "*":
+            return None
+        if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is not None:
+            return None
+        try:
+            model_field = self.Meta.model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            return None
+        if not model_field.concrete:
+            return None
+        return model_field.attname
+
+    @cached_property
+    def readers(self):
+        return [
+            (field.field_name, self.plain_attname(field), field)
+            for field in self._readable_fields
+        ]
+
+    def to_representation(self, instance):
+        ret = {}
+        for name, attname, field in self.readers:
+            if attname is not None:
+                ret[name] = getattr(instance, attname)
+                continue
+            try:
+                attribute = field.get_attribute(instance)
+            except SkipField:
+                continue
+            check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+            ret[name] = None if check_for_none is None else field.to_representation(attribute)
+        return ret
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    Пакетное создание и обновление: один ``bulk_create``/``bulk_update``
+    вместо ``save()`` для каждого элемента.
+
+    Для обновления ``instance`` — словарь ``{pk: объект}``, а каждый элемент
+    данных должен содержать ``id``. Ошибки возвращаются списком по индексам элементов.
+    """
+    batch_size = 500
+
+    @staticmethod
+    def item_id(data):
+        """``id`` элемента данных как ``int``; ``None``, если его нет или он не число."""
+        try:
+            return int(data["id"])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def to_internal_value(self, data):
+        self.matched = []
+        self.seen = set()
+        return super().to_internal_value(data)
+
+    def run_child_validation(self, data):
+        if self.instance is not None:
+            pk = self.item_id(data)
+            instance = self.instance.get(pk)
+            if instance is None:
+                raise serializers.ValidationError({"id": ["Object with this id does not exist."]})
+            if pk in self.seen:
+                raise serializers.ValidationError({"id": ["Duplicate id."]})
+            self.seen.add(pk)
+            self.child.instance = instance
+            self.child.initial_data = data
+            self.matched.append(instance)
+        return super().run_child_validation(data)
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        return model.objects.bulk_create(
+            [model(**attrs) for attrs in validated_data],
+            batch_size=self.batch_size,
+        )
+
+    def update(self, instance, validated_data):
+        fields = set()
+        for obj, attrs in zip(self.matched, validated_data):
+            for attr, value in attrs.items():
+                setattr(obj, attr, value)
+            fields.update(attrs)
+        if fields:
+            self.child.Meta.model.objects.bulk_update(self.matched, fields, batch_size=self.batch_size)
+        return self.matched
+
+
+class ProductSerializer(SparseFieldsMixin, FastReadMixin, serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = '__all__'
+        list_serializer_class = BulkListSerializer
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, FastReadMixin, serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = '__all__'
 
+
+def prefetch_order_products(queryset):
+    """
+    Id товаров для ``OrderSerializer`` одним запросом на всю выборку заказов.
+
+    Пользователь выводится как id из ``user_id``, поэтому ``select_related`` не нужен.
+    """
+    return queryset.prefetch_related(
+        Prefetch("products", queryset=Product.objects.only("pk"))
+    )
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    throughput = serializers.ReadOnlyField()
+
+    class Meta:
+        model = ImportJob
+        exclude = ['file']
@@ -0,0 +1,166 @@
+"""
+Инвалидация кеша выгрузок при изменении товаров и заказов,
+поддержка сумм заказов, индекса совместных покупок
+и индекса полнотекстового поиска после миграций.
+
+``QuerySet.update()`` и ``bulk_create()`` сигналы не отправляют —
+в таких местах версия увеличивается явно через :func:`shopapp.caching.bump_version`.
+"""
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import Subquery, Sum
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.db import connections
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .caching import bump_version, PRODUCTS_VERSION, ORDERS_VERSION, ANALYTICS_VERSION, user_orders_version
+from .models import Product, Order
+from .recommendations import add_order_products, remove_order_products, rebuild_related
+from .search import ensure_fts
+from .totals import rebuild_order_totals, add_to_totals, orders_with_products
+
+
+def is_past_order(order: Order) -> bool:
+    """Заказ за прошлые дни: его изменение меняет закешированную аналитику."""
+    return order.created_at is not None and timezone.localdate(order.created_at) < timezone.localdate()
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance: Product, created: bool, **kwargs):
+    if created:
+        bump_version(PRODUCTS_VERSION)
+    else:
+        # цена или скидка могли измениться
+        bump_version(PRODUCTS_VERSION, ANALYTICS_VERSION)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance: Product, **kwargs):
+    # вместе с товаром удаляются его связи с заказами
+    bump_version(PRODUCTS_VERSION, ORDERS_VERSION, ANALYTICS_VERSION)
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance: Order, created: bool, **kwargs):
+    if created:
+        bump_version(user_orders_version(instance.user_id))
+    else:
+        # пользователь заказа мог смениться
+        bump_version(ORDERS_VERSION)
+    if is_past_order(instance):
+        bump_version(ANALYTICS_VERSION)
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance: Order, **kwargs):
+    bump_version(user_orders_version(instance.user_id))
+    if is_past_order(instance):
+        bump_version(ANALYTICS_VERSION)
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def order_products_changed(sender, instance, action: str, reverse: bool, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if reverse:
+        bump_version(ORDERS_VERSION, ANALYTICS_VERSION)
+    else:
+        bump_version(user_orders_version(instance.user_id))
+        if is_past_order(instance):
+            bump_version(ANALYTICS_VERSION)
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def order_products_totals(sender, instance, action: str, reverse: bool, pk_set, **kwargs):
+    if reverse:
+        # instance — товар, pk_set — заказы
+        if action == "post_add":
+            price = Subquery(Product.objects.filter(pk=instance.pk).values("price"))
+            add_to_totals(Order.objects.filter(pk__in=pk_set), price, 1)
+        elif action == "pre_clear":
+            instance._cleared_order_ids = list(instance.orders.values_list("pk", flat=True))
+        elif action == "post_remove":
+            rebuild_order_totals(Order.objects.filter(pk__in=pk_set))
+        elif action == "post_clear":
+            rebuild_order_totals(Order.objects.filter(pk__in=instance.__dict__.pop("_cleared_order_ids", [])))
+        return
+
+    orders = Order.objects.filter(pk=instance.pk)
+    if action == "post_add":
+        amount = Product.objects.filter(pk__in=pk_set).aggregate(amount=Sum("price", default=0))["amount"]
+        add_to_totals(orders, amount, len(pk_set))
+    elif action in ("post_remove", "post_clear"):
+        # в pk_set при remove() есть и товары, которых в заказе не было
+        rebuild_order_totals(orders)
+    else:
+        return
+    instance.refresh_from_db(fields=["total", "products_count"])
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def order_products_related(sender, instance, action: str, reverse: bool, pk_set, **kwargs):
+    if reverse:
+        # у товара меняется набор заказов: его пары проще пересчитать
+        if action in ("post_add", "post_remove", "post_clear"):
+            rebuild_related([instance.pk])
+        return
+    # в pk_set при add() только новые товары, при remove() — все переданные
+    if action == "post_add":
+        current = set(instance.products.values_list("pk", flat=True))
+        add_order_products(pk_set, current - pk_set)
+    elif action == "pre_remove":
+        remove_order_products(pk_set, instance.products.values_list("pk", flat=True))
+    elif action == "pre_clear":
+        current = set(instance.products.values_list("pk", flat=True))
+        remove_order_products(current, current)
+
+
+@receiver(pre_delete, sender=Order)
+def order_deleting(sender, instance: Order, **kwargs):
+    # связи с товарами удаляются каскадом, без m2m_changed
+    current = set(instance.products.values_list("pk", flat=True))
+    remove_order_products(current, current)
+
+
+@receiver(post_save, sender=Product)
+def product_price_saved(sender, instance: Product, created: bool, update_fields=None, **kwargs):
+    loaded_price = instance.__dict__.get("_loaded_price")
+    price = Decimal(str(instance.price))
+    instance._loaded_price = price
+    if created or (update_fields is not None and "price" not in update_fields):
+        return
+    if loaded_price is None:
+        updated = rebuild_order_totals(orders_with_products([instance.pk]))
+    elif price != loaded_price:
+        updated = add_to_totals(orders_with_products([instance.pk]), price - loaded_price)
+    else:
+        return
+    if updated:
+        bump_version(ORDERS_VERSION)
+
+
+@receiver(pre_delete, sender=Product)
+def product_deleting(sender, instance: Product, **kwargs):
+    # связи с заказами удаляются каскадом, без m2m_changed
+    instance._deleted_order_ids = list(instance.orders.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted_totals(sender, instance: Product, **kwargs):
+    rebuild_order_totals(Order.objects.filter(pk__in=instance.__dict__.pop("_deleted_order_ids", [])))
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance: User, created: bool, **kwargs):
+    if not created:
+        bump_version(user_orders_version(instance.pk))
+
+
+def product_search_index(sender, using, **kwargs):
+    """Восстанавливает триггеры FTS, если миграция пересоздала таблицу товаров."""
+    applied = MigrationRecorder(connections[using]).applied_migrations()
+    if ("shopapp", "0013_product_fts") in applied:
+        ensure_fts(using)
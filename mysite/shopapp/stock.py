@@ -0,0 +1,80 @@
+"""
+Резервирование товаров на складе при оформлении заказа.
+
+Каждый товар в заказе — одна единица (связь M2M без количества).
+Остатки уменьшаются одним условным ``UPDATE`` на заказ::
+
+    UPDATE shopapp_product SET count = count - 1 WHERE id IN (...) AND count > 0
+
+Если обновлено меньше строк, чем товаров, какого-то товара не хватило:
+транзакция откатывается, заказ не создаётся. Остатки не читаются перед
+записью и строки не блокируются, поэтому параллельные заказы не продадут
+больше, чем лежит на складе.
+"""
+from django.db import transaction
+from django.db.models import F
+
+from .caching import bump_version, PRODUCTS_VERSION
+from .models import Product, Order
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(
+            "Not enough stock for products: {}".format(", ".join(map(str, self.product_ids)))
+        )
+
+
+def to_ids(products) -> set:
+    """Товары, их id или id строками (из формы)."""
+    return {int(getattr(product, "pk", product)) for product in products}
+
+
+def current_ids(order: Order) -> set:
+    return set(order.products.values_list("pk", flat=True))
+
+
+def reserve_products(order: Order, products, current=None) -> None:
+    """
+    Списывает по единице каждого товара и добавляет их в заказ
+    одной вставкой в связующую таблицу. Товары, уже лежащие в заказе, пропускаются.
+    """
+    if current is None:
+        current = current_ids(order)
+    ids = to_ids(products) - current
+    if not ids:
+        return
+    try:
+        with transaction.atomic():
+            reserved = Product.objects.filter(pk__in=ids, count__gt=0).update(count=F("count") - 1)
+            if reserved != len(ids):
+                raise OutOfStock(ids)
+            order.products.add(*ids)
+    except OutOfStock:
+        # после отката: каких товаров нет (или уже нет) на складе
+        available = set(Product.objects.filter(pk__in=ids, count__gt=0).values_list("pk", flat=True))
+        raise OutOfStock(ids - available or ids)
+    bump_version(PRODUCTS_VERSION)
+
+
+def release_products(order: Order, products, current=None) -> None:
+    """Убирает товары из заказа и возвращает их на склад."""
+    if current is None:
+        current = current_ids(order)
+    ids = to_ids(products) & current
+    if not ids:
+        return
+    with transaction.atomic():
+        order.products.remove(*ids)
+        Product.objects.filter(pk__in=ids).update(count=F("count") + 1)
+    bump_version(PRODUCTS_VERSION)
+
+
+def set_order_products(order: Order, products) -> None:
+    """Приводит состав заказа к ``products``: новые товары резервируются, убранные возвращаются."""
+    wanted = to_ids(products)
+    current = current_ids(order)
+    with transaction.atomic():
+        release_products(order, current - wanted, current)
+        reserve_products(order, wanted, current)
@@ -1,10 +1,33 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
 from random import choices
 from string import ascii_letters
 from django.conf import settings
 from django.contrib.auth.models import User, Group, Permission
-from django.test import TestCase, Client
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.forms import FileField
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from unittest import mock
+from rest_framework import serializers
 
-from shopapp.models import Product, Order
+from shopapp.analytics import sales_report
+from shopapp.columnar import read_npz
+from shopapp.common import save_csv_products, save_csv_orders, run_import_job, split_csv_file, LeaseLost
+from shopapp.models import Product, Order, ImportJob, RelatedProduct
+from shopapp.recommendations import co_occurrences, related_product_ids
+from shopapp.serializers import ProductSerializer, OrderSerializer
+from shopapp.stock import reserve_products, OutOfStock
 from shopapp.utils import add_two_numbers
 from django.urls import reverse
 
@@ -213,7 +236,7 @@ class OrdersExportTestCase(TestCase):
     def test_orders_export(self):
         response = self.client.get(reverse('shopapp:orders-export'), HTTP_USER_AGENT='Mozilla/5.0')
         self.assertEqual(response.status_code, 200)
-        data = response.json()
+        data = json.loads(b"".join(response.streaming_content))
         self.assertIn('orders', data)
         orders = Order.objects.all()
         self.assertEqual(len(data['orders']), len(orders))
@@ -223,3 +246,1080 @@ class OrdersExportTestCase(TestCase):
             self.assertEqual(data['orders'][i]['promocode'], order.promocode)
             self.assertEqual(data['orders'][i]['user_id'], order.user_id)
             self.assertEqual(data['orders'][i]['product_ids'], [product.id for product in order.products.all()])
+
+
+class CSVImportTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='csv_importer', password='password')
+
+    def test_streaming_import_in_batches(self):
+        rows = "".join(
+            f"Product {i},Description {i},{i}.50,{i},0\n"
+            for i in range(25)
+        )
+        file = BytesIO(("name,description,price,count,discount\n" + rows).encode())
+        summary = save_csv_products(file, encoding="utf-8", created_by=self.user, batch_size=10)
+        self.assertEqual(summary["rows_ok"], 25)
+        self.assertEqual(summary["rows_rejected"], 0)
+        self.assertEqual(Product.objects.filter(created_by=self.user).count(), 25)
+
+    def test_invalid_rows_are_rejected(self):
+        file = BytesIO(
+            "name,description,price,count,created_by\n"
+            "Laptop,ok,1999.00,10,\n"
+            "Desktop,bad price,abc,5,\n"
+            "Phone,unknown user,999.00,1,99999\n".encode()
+        )
+        summary = save_csv_products(file, encoding="utf-8", created_by=self.user)
+        self.assertEqual(summary["rows_ok"], 1)
+        self.assertEqual(summary["rows_rejected"], 2)
+        self.assertEqual([error["row"] for error in summary["errors"]], [2, 3])
+        self.assertTrue(Product.objects.filter(name="Laptop").exists())
+
+    def test_upsert_by_natural_key(self):
+        feed = (
+            "name,description,price,count\n"
+            "Laptop,A new one,1999.00,10\n"
+            "Desktop,A new one,2999.00,5\n"
+        )
+        save_csv_products(BytesIO(feed.encode()), encoding="utf-8", created_by=self.user, upsert=True)
+        summary = save_csv_products(
+            BytesIO(feed.replace("2999.00,5", "2499.00,3").encode()),
+            encoding="utf-8",
+            created_by=self.user,
+            upsert=True,
+        )
+        self.assertEqual(summary["rows_created"], 0)
+        self.assertEqual(summary["rows_updated"], 1)
+        self.assertEqual(summary["rows_unchanged"], 1)
+        self.assertEqual(Product.objects.count(), 2)
+        desktop = Product.objects.get(name="Desktop")
+        self.assertEqual((str(desktop.price), desktop.count), ("2499.00", 3))
+
+    def test_orders_upsert_by_natural_key(self):
+        feed = "delivery_address,promocode\nul Popova,SALE\n".encode()
+        save_csv_orders(BytesIO(feed), encoding="utf-8", user=self.user, upsert=True)
+        summary = save_csv_orders(BytesIO(feed), encoding="utf-8", user=self.user, upsert=True)
+        self.assertEqual(summary["rows_unchanged"], 1)
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+
+    def test_upsert_looks_up_whole_key(self):
+        Order.objects.bulk_create([Order(user=self.user, delivery_address=f"Address {i}") for i in range(20)])
+        feed = "delivery_address,promocode\nAddress 3,\n,SALE\n".encode()
+        save_csv_orders(BytesIO(feed), encoding="utf-8", user=self.user, upsert=True)
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch.object(connection.features, "max_query_params", 3):
+            summary = save_csv_orders(BytesIO(feed), encoding="utf-8", user=self.user, upsert=True)
+        self.assertEqual((summary["rows_created"], summary["rows_unchanged"]), (0, 2))
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 21)
+        lookups = [query["sql"] for query in queries if query["sql"].startswith('SELECT "shopapp_order"."id"')]
+        self.assertEqual(len(lookups), 2)
+        self.assertTrue(all('"shopapp_order"."delivery_address"' in sql.split("WHERE")[1] for sql in lookups))
+
+    def test_upsert_rejects_duplicate_keys_in_batch(self):
+        feed = (
+            "name,description,price,count\n"
+            "Laptop,First,1999.00,10\n"
+            "Desktop,A new one,2999.00,5\n"
+            "Laptop,Second,1899.00,7\n"
+        )
+        summary = save_csv_products(BytesIO(feed.encode()), encoding="utf-8", created_by=self.user, upsert=True)
+        self.assertEqual((summary["rows_ok"], summary["rows_rejected"]), (2, 1))
+        self.assertEqual(summary["rows_ok"], summary["rows_created"] + summary["rows_updated"] + summary["rows_unchanged"])
+        self.assertEqual(summary["errors"], [{"row": 3, "errors": {"__all__": ["Повторяет ключ строки 1"]}}])
+        self.assertEqual(Product.objects.get(name="Laptop").description, "First")
+
+
+    def test_parallel_validation(self):
+        rows = [f"Product {i},Description {i},{i}.50,{i}\n" for i in range(300)]
+        rows[150] = "Broken,row,not-a-price,1\n"
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as file:
+            file.write("name,description,price,count\n" + "".join(rows))
+        self.addCleanup(os.remove, file.name)
+
+        with mock.patch("shopapp.common.CSV_IMPORT_MIN_CHUNK_BYTES", 512):
+            header, ranges = split_csv_file(file.name, 8)
+            self.assertGreater(len(ranges), 1)
+            with open(file.name, "rb") as csv_file:
+                summary = save_csv_products(csv_file, encoding="utf-8", created_by=self.user,
+                                            batch_size=50, workers=2)
+
+        self.assertEqual(header, b"name,description,price,count\n")
+        self.assertEqual(summary["rows_ok"], 299)
+        self.assertEqual([error["row"] for error in summary["errors"]], [151])
+        self.assertEqual(Product.objects.count(), 299)
+
+    def test_parallel_validation_with_multiline_values(self):
+        rows = [f'Product {i},"Line one, ""quoted""\nline two\nline {i}",{i}.50,{i}\n' for i in range(200)]
+        rows[120] = 'Broken,"multi\nline",not-a-price,1\n'
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, newline="") as file:
+            file.write("name,description,price,count\n" + "".join(rows))
+        self.addCleanup(os.remove, file.name)
+
+        with mock.patch("shopapp.common.CSV_IMPORT_MIN_CHUNK_BYTES", 256):
+            self.assertGreater(len(split_csv_file(file.name, 8)[1]), 1)
+            summaries = []
+            for workers in (1, 2):
+                with open(file.name, "rb") as csv_file:
+                    summaries.append(save_csv_products(csv_file, encoding="utf-8", created_by=self.user,
+                                                       batch_size=50, workers=workers))
+
+        for summary in summaries:
+            self.assertEqual((summary["rows_ok"], summary["rows_rejected"]), (199, 1))
+            self.assertEqual([error["row"] for error in summary["errors"]], [121])
+        self.assertEqual(set(Product.objects.filter(name="Product 7").values_list("description", flat=True)),
+                         {'Line one, "quoted"\nline two\nline 7'})
+
+
+class ImportJobTestCase(TestCase):
+    feed = (
+        "name,description,price,count\n"
+        "Laptop,A new one,1999.00,10\n"
+        "Desktop,A new one,2999.00,5\n"
+        "Smartphone,A new one,999.00,20\n"
+    )
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.settings_override = override_settings(MEDIA_ROOT=cls.media_root, LANGUAGE_CODE="en")
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='job_owner', password='password')
+
+    def test_upload_returns_job_and_worker_runs_it(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse("shopapp:product-upload-csv"),
+            {"file": SimpleUploadedFile("products.csv", self.feed.encode())},
+            HTTP_USER_AGENT='Mozilla/5.0',
+        )
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()["job"]
+        self.assertFalse(Product.objects.exists())
+
+        call_command("run_import_jobs", "--once", stdout=StringIO())
+        response = self.client.get(response.json()["status_url"], HTTP_USER_AGENT='Mozilla/5.0')
+        data = response.json()
+        self.assertEqual(data["id"], job_id)
+        self.assertEqual(data["status"], ImportJob.STATUS_DONE)
+        self.assertEqual(data["rows_processed"], 3)
+        self.assertEqual(Product.objects.filter(created_by=self.user).count(), 3)
+
+    def test_interrupted_job_resumes_from_last_batch(self):
+        job = ImportJob.objects.create(
+            target=ImportJob.TARGET_PRODUCTS,
+            file=SimpleUploadedFile("products.csv", self.feed.encode()),
+            created_by=self.user,
+            status=ImportJob.STATUS_RUNNING,
+            rows_processed=2,
+            rows_ok=2,
+        )
+        job = run_import_job(job, batch_size=2)
+        self.assertEqual(job.status, ImportJob.STATUS_DONE)
+        self.assertEqual((job.rows_processed, job.rows_ok), (3, 3))
+        self.assertEqual(list(Product.objects.values_list("name", flat=True)), ["Smartphone"])
+
+    def test_worker_takes_over_only_expired_leases(self):
+        live, stale = [
+            ImportJob.objects.create(
+                target=ImportJob.TARGET_PRODUCTS,
+                file=SimpleUploadedFile("products.csv", self.feed.encode()),
+                created_by=self.user,
+                status=ImportJob.STATUS_RUNNING,
+                claimed_by=claimed_by,
+                heartbeat_at=timezone.now() - timedelta(seconds=age),
+            )
+            for claimed_by, age in (("live", 10), ("stale", 600))
+        ]
+        call_command("run_import_jobs", "--once", "--lease", "300", stdout=StringIO())
+
+        live.refresh_from_db()
+        stale.refresh_from_db()
+        self.assertEqual((live.status, live.claimed_by, live.rows_processed), (ImportJob.STATUS_RUNNING, "live", 0))
+        self.assertEqual((stale.status, stale.rows_processed), (ImportJob.STATUS_DONE, 3))
+        self.assertNotEqual(stale.claimed_by, "stale")
+        self.assertEqual(Product.objects.count(), 3)
+
+    def test_worker_that_lost_lease_rolls_back_its_batch(self):
+        job = ImportJob.objects.create(
+            target=ImportJob.TARGET_PRODUCTS,
+            file=SimpleUploadedFile("products.csv", self.feed.encode()),
+            created_by=self.user,
+            status=ImportJob.STATUS_RUNNING,
+            claimed_by="taken-over",
+            heartbeat_at=timezone.now(),
+        )
+        job.claimed_by = "expired"
+        with self.assertRaises(LeaseLost):
+            run_import_job(job, batch_size=2)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.claimed_by, job.rows_processed), (ImportJob.STATUS_RUNNING, "taken-over", 0))
+        self.assertFalse(Product.objects.exists())
+
+
+@override_settings(LANGUAGE_CODE="en")
+class DownloadCSVTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='csv_exporter', password='password')
+        Product.objects.bulk_create([
+            Product(name=f"Phone {i}", description="Smartphone", price=i, count=i, created_by=cls.user)
+            for i in range(1, 4)
+        ] + [
+            Product(name="Laptop", description="Notebook", price=1999, count=1, created_by=cls.user),
+        ])
+
+    def test_products_download_csv_is_streamed_and_filtered(self):
+        response = self.client.get(
+            reverse("shopapp:product-download-csv"),
+            {"search": "Phone", "ordering": "-price"},
+            HTTP_USER_AGENT='Mozilla/5.0',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "name,description,price,count,discount,archived")
+        self.assertEqual([line.split(",")[0] for line in lines[1:]], ["Phone 3", "Phone 2", "Phone 1"])
+
+    def test_orders_download_csv(self):
+        Order.objects.create(user=self.user, delivery_address="ul Popova", promocode="SALE")
+        response = self.client.get(reverse("shopapp:order-download-csv"), HTTP_USER_AGENT='Mozilla/5.0')
+        content = b"".join(response.streaming_content).decode()
+        self.assertEqual(content.splitlines(), ["delivery_address,promocode", "ul Popova,SALE"])
+
+
+@override_settings(LANGUAGE_CODE="en")
+class AdminExportCSVTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username='admin_exporter', password='password')
+        cls.orders = [
+            Order.objects.create(user=cls.user, delivery_address=f"ul Popova, d {i}", promocode="SALE")
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def export(self, action):
+        return self.client.post(
+            reverse("admin:shopapp_order_changelist"),
+            {"action": action, "_selected_action": [order.pk for order in self.orders]},
+            HTTP_USER_AGENT='Mozilla/5.0',
+        )
+
+    def test_export_csv_resolves_foreign_keys_to_ids(self):
+        response = self.export("export_csv")
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "id,delivery_address,promocode,created_at,user,receipt,total,products_count")
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(all(line.split(",")[-4] == str(self.user.pk) for line in lines[1:]))
+
+    def test_export_csv_gzip(self):
+        response = self.export("export_csv_gzip")
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        content = gzip.decompress(b"".join(response.streaming_content)).decode()
+        self.assertEqual(len(content.splitlines()), 4)
+
+
+@override_settings(LANGUAGE_CODE="en")
+class ColumnarExportViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='analyst', password='password', is_staff=True)
+        cls.products = [
+            Product.objects.create(name=name, description="", price=price, count=1, created_by=cls.user)
+            for name, price in [("Laptop", "1999.50"), ("Телефон", "999.00")]
+        ]
+        cls.order = Order.objects.create(user=cls.user, promocode="SALE")
+        cls.order.products.set(cls.products)
+
+    def test_columnar_export(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("shopapp:columnar-export"), HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(response.status_code, 200)
+        columns = read_npz(BytesIO(b"".join(response.streaming_content)))
+
+        self.assertEqual(list(columns["products/id"]), [product.pk for product in self.products])
+        self.assertEqual(list(columns["products/price"]), [1999.5, 999.0])
+        self.assertEqual(list(columns["products/created_by_id"]), [self.user.pk] * 2)
+        offsets, data = columns["products/name.offsets"], columns["products/name.data"].tobytes()
+        names = [data[start:end].decode() for start, end in zip(offsets, offsets[1:])]
+        self.assertEqual(names, ["Laptop", "Телефон"])
+        self.assertEqual(list(columns["orders/delivery_address.valid"]), [0])
+        self.assertEqual(
+            sorted(zip(columns["order_products/order_id"], columns["order_products/product_id"])),
+            [(self.order.pk, product.pk) for product in self.products],
+        )
+
+    def test_columnar_export_requires_staff(self):
+        self.client.force_login(User.objects.create_user(username='customer'))
+        response = self.client.get(reverse("shopapp:columnar-export"), HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(LANGUAGE_CODE="en")
+class OrdersExportQueryCountTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='orders_exporter', password='password')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f"Product {i}", price=i, count=1, created_by=cls.user)
+            for i in range(5)
+        ])
+
+    def create_orders(self, count):
+        for i in range(count):
+            order = Order.objects.create(user=self.user, delivery_address=f"Address {i}", promocode="SALE")
+            order.products.set(self.products[:i % 4])
+
+    def export(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('shopapp:orders-export'), HTTP_USER_AGENT='Mozilla/5.0')
+            data = json.loads(b"".join(response.streaming_content))
+        return data, len(context.captured_queries)
+
+    def test_query_count_does_not_depend_on_orders(self):
+        self.create_orders(2)
+        _, small_count = self.export()
+        self.create_orders(20)
+        data, large_count = self.export()
+        self.assertEqual(small_count, large_count)
+        self.assertEqual(len(data["orders"]), 22)
+        for item in data["orders"]:
+            order = Order.objects.get(pk=item["id"])
+            self.assertEqual(item["product_ids"], [product.id for product in order.products.all()])
+
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(LANGUAGE_CODE="en", CACHES=LOCMEM_CACHES)
+class ExportCacheInvalidationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='cached_customer', password='password')
+        cls.product = Product.objects.create(name="Laptop", price=1999, count=10, created_by=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def products_export(self):
+        response = self.client.get(reverse("shopapp:products-export"), HTTP_USER_AGENT='Mozilla/5.0')
+        return response.json()["products"]
+
+    def user_orders_export(self):
+        response = self.client.get(
+            reverse("shopapp:export_user_orders", kwargs={"user_id": self.user.pk}),
+            HTTP_USER_AGENT='Mozilla/5.0',
+        )
+        return response.json()["orders"]
+
+    def test_products_export_is_invalidated_on_save_and_delete(self):
+        self.assertEqual(self.products_export()[0]["count"], 10)
+        with self.assertNumQueries(0):
+            self.products_export()
+        self.product.count = 3
+        self.product.save()
+        self.assertEqual(self.products_export()[0]["count"], 3)
+        self.product.delete()
+        self.assertEqual(self.products_export(), [])
+
+    def test_user_orders_export_is_invalidated_on_orders_and_products_change(self):
+        self.assertEqual(self.user_orders_export(), [])
+        order = Order.objects.create(user=self.user, promocode="SALE")
+        self.assertEqual(len(self.user_orders_export()), 1)
+        order.products.add(self.product)
+        self.assertEqual(self.user_orders_export()[0]["products"], [self.product.pk])
+        self.product.orders.clear()
+        self.assertEqual(self.user_orders_export()[0]["products"], [])
+
+
+@override_settings(LANGUAGE_CODE="en", CACHES=LOCMEM_CACHES)
+class ProductsDataExportKeysetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='catalogue_owner', password='password')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f"Product {i}", price=i, count=i, created_by=cls.user)
+            for i in range(5)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def export(self, **params):
+        return self.client.get(reverse("shopapp:products-export"), params, HTTP_USER_AGENT='Mozilla/5.0')
+
+    def test_keyset_pages(self):
+        with self.assertNumQueries(1):
+            first = self.export(limit=2).json()
+        self.assertEqual([p["pk"] for p in first["products"]], [p.pk for p in self.products[:2]])
+        self.assertEqual(first["products"][0]["created_by"], self.user.pk)
+        pks = [p["pk"] for p in first["products"]]
+        after = first["next_after"]
+        while after is not None:
+            page = self.export(after=after, limit=2).json()
+            pks += [p["pk"] for p in page["products"]]
+            after = page["next_after"]
+        self.assertEqual(pks, [p.pk for p in self.products])
+
+    def test_cache_hit_serves_stored_bytes(self):
+        content = self.export().content
+        with self.assertNumQueries(0), mock.patch("shopapp.views.json.dumps") as dumps:
+            self.assertEqual(self.export().content, content)
+        dumps.assert_not_called()
+
+    def test_invalid_params(self):
+        self.assertEqual(self.export(after="x").status_code, 400)
+
+
+@override_settings(LANGUAGE_CODE="en", CACHES=LOCMEM_CACHES)
+class ProductListCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='api_owner', password='password')
+        cls.product = Product.objects.create(name="Laptop", price=1999, count=10, created_by=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_list(self, **headers):
+        return self.client.get(
+            reverse("shopapp:product-list"),
+            {"ordering": "price", "search": "Lap"},
+            HTTP_USER_AGENT='Mozilla/5.0',
+            headers=headers,
+        )
+
+    def test_cache_hits_etag_and_invalidation(self):
+        first = self.get_list()
+        self.assertEqual(first.json()["results"][0]["count"], 10)
+        with self.assertNumQueries(0):
+            second = self.get_list()
+        self.assertEqual(second.json(), first.json())
+
+        self.assertEqual(self.get_list(**{"If-None-Match": first["ETag"]}).status_code, 304)
+
+        self.product.count = 5
+        self.product.save()
+        changed = self.get_list(**{"If-None-Match": first["ETag"]})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], first["ETag"])
+        self.assertEqual(changed.json()["results"][0]["count"], 5)
+
+        stats = self.client.get(reverse("shopapp:product-cache-stats"), HTTP_USER_AGENT='Mozilla/5.0').json()
+        self.assertEqual((stats["hits"], stats["misses"], stats["not_modified"]), (1, 2, 1))
+
+    def test_query_params_are_normalized(self):
+        self.get_list()
+        with self.assertNumQueries(0):
+            self.client.get(
+                reverse("shopapp:product-list") + "?search=Lap&ordering=price",
+                HTTP_USER_AGENT='Mozilla/5.0',
+            )
+
+
+@override_settings(LANGUAGE_CODE="en", CACHES=LOCMEM_CACHES)
+class ProductFullTextSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username='search_owner', password='password')
+        Product.objects.bulk_create([
+            Product(name="Laptop Pro", description="Fast laptop for work", price=1999, count=1, created_by=cls.user),
+            Product(name="Desktop", description="Tower, not a laptop", price=2999, count=1, created_by=cls.user),
+            Product(name="Смартфон", description="Новый телефон", price=999, count=1, created_by=cls.user),
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, term, **params):
+        response = self.client.get(
+            reverse("shopapp:product-list"),
+            {"search": term, **params},
+            HTTP_USER_AGENT='Mozilla/5.0',
+        )
+        return [product["name"] for product in response.json()["results"]]
+
+    def test_ranked_prefix_search(self):
+        self.assertEqual(self.search("lapt"), ["Laptop Pro", "Desktop"])
+        self.assertEqual(self.search("смарт"), ["Смартфон"])
+        self.assertEqual(self.search("laptop work"), ["Laptop Pro"])
+        self.assertEqual(self.search("lapt", ordering="-price"), ["Desktop", "Laptop Pro"])
+
+    def test_index_follows_updates_and_deletes(self):
+        Product.objects.filter(name="Desktop").update(description="Tower")
+        self.assertEqual(self.search("laptop"), ["Laptop Pro"])
+        Product.objects.filter(name="Laptop Pro").delete()
+        self.assertEqual(self.search("laptop"), [])
+
+    def test_admin_search(self):
+        self.client.force_login(self.user)
+        response = self.client.get(
+            reverse("admin:shopapp_product_changelist"), {"q": "телеф"}, HTTP_USER_AGENT='Mozilla/5.0',
+        )
+        self.assertEqual([p.name for p in response.context["cl"].result_list], ["Смартфон"])
+
+
+@override_settings(LANGUAGE_CODE="en", CACHES=LOCMEM_CACHES)
+class CursorPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='cursor_owner', password='password')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f"Product {i:02}", price=i, count=1, created_by=cls.user)
+            for i in range(25)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, url, params=None):
+        return self.client.get(url, params, HTTP_USER_AGENT='Mozilla/5.0').json()
+
+    def test_cursor_walks_all_products(self):
+        pks = []
+        page = self.get(reverse("shopapp:product-list"), {"pagination": "cursor"})
+        while True:
+            self.assertNotIn("count", page)
+            pks += [product["id"] for product in page["results"]]
+            if not page["next"]:
+                break
+            with CaptureQueriesContext(connection) as queries:
+                page = self.get(page["next"])
+            self.assertEqual(len(queries), 1)
+            self.assertIn(" > ", queries[0]["sql"])
+            self.assertNotIn("OFFSET", queries[0]["sql"])
+        self.assertEqual(pks, sorted(product.pk for product in self.products))
+
+    def test_cursor_by_created_at(self):
+        page = self.get(reverse("shopapp:product-list"), {"pagination": "cursor", "ordering": "-created_at"})
+        expected = Product.objects.order_by("-created_at", "-pk").values_list("pk", flat=True)[:10]
+        self.assertEqual([product["id"] for product in page["results"]], list(expected))
+
+    def test_cursor_rejects_unstable_ordering(self):
+        response = self.client.get(
+            reverse("shopapp:product-list"), {"pagination": "cursor", "ordering": "name"},
+            HTTP_USER_AGENT='Mozilla/5.0',
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_page_number_without_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            page = self.get(reverse("shopapp:product-list"), {"page": 3, "count": "false"})
+        self.assertFalse(any("COUNT(" in query["sql"] for query in queries))
+        self.assertNotIn("count", page)
+        self.assertEqual(len(page["results"]), 5)
+        self.assertIsNone(page["next"])
+        self.assertIn("page=2", page["previous"])
+
+        page = self.get(reverse("shopapp:product-list"), {"count": "false"})
+        self.assertIn("page=2", page["next"])
+        self.assertIsNone(page["previous"])
+        self.assertEqual(self.get(reverse("shopapp:product-list"))["count"], 25)
+
+    def test_orders_cursor(self):
+        Order.objects.bulk_create([Order(user=self.user, delivery_address=f"addr {i}") for i in range(12)])
+        page = self.get(reverse("shopapp:order-list"), {"pagination": "cursor"})
+        self.assertEqual(len(page["results"]), 10)
+        page = self.get(page["next"])
+        self.assertEqual(len(page["results"]), 2)
+        self.assertIsNotNone(page["previous"])
+
+
+@override_settings(LANGUAGE_CODE="en", CACHES=LOCMEM_CACHES)
+class SparseFieldsetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='fields_owner', password='password')
+        cls.product = Product.objects.create(
+            name="Laptop", description="Fast", price=1999, count=3, created_by=cls.user,
+        )
+        cls.order = Order.objects.create(user=cls.user, delivery_address="ul Popova", promocode="SALE")
+        cls.order.products.add(cls.product)
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, url, **params):
+        return self.client.get(url, params, HTTP_USER_AGENT='Mozilla/5.0')
+
+    def test_fields_narrow_response_and_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(reverse("shopapp:product-list"), fields="id,name,price")
+        self.assertEqual(response.json()["results"], [{"id": self.product.pk, "name": "Laptop", "price": "1999.00"}])
+        select = next(query["sql"] for query in queries if "shopapp_product" in query["sql"] and "COUNT" not in query["sql"])
+        self.assertNotIn("description", select)
+
+        detail = self.get(reverse("shopapp:order-detail", kwargs={"pk": self.order.pk}), fields="promocode,products")
+        self.assertEqual(detail.json(), {"promocode": "SALE", "products": [self.product.pk]})
+
+    def test_unknown_field(self):
+        self.assertEqual(self.get(reverse("shopapp:product-list"), fields="id,secret").status_code, 400)
+
+    def test_fast_path_matches_model_serializer(self):
+        class PlainProductSerializer(serializers.ModelSerializer):
+            class Meta:
+                model = Product
+                fields = '__all__'
+
+        class PlainOrderSerializer(serializers.ModelSerializer):
+            class Meta:
+                model = Order
+                fields = '__all__'
+
+        product = Product.objects.get(pk=self.product.pk)
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual(ProductSerializer(product).data, PlainProductSerializer(product).data)
+        self.assertEqual(OrderSerializer(order).data, PlainOrderSerializer(order).data)
+
+
+@override_settings(LANGUAGE_CODE="en", CACHES=LOCMEM_CACHES)
+class OrderQueryCountTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='prefetch_owner', password='password')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f"Product {i}", price=i, count=1, created_by=cls.user) for i in range(3)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def add_orders(self, count):
+        for i in range(count):
+            order = Order.objects.create(user=self.user, delivery_address=f"addr {i}")
+            order.products.set(self.products[:i % 3 + 1])
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_order_list_queries_do_not_grow(self):
+        url = reverse("shopapp:order-list")
+        self.add_orders(2)
+        few = self.count_queries(url)
+        self.add_orders(8)
+        self.assertEqual(self.count_queries(url), few)
+        self.assertEqual(self.count_queries(url + "?pagination=cursor"), few - 1)
+
+        response = self.client.get(url, {"ordering": "delivery_address"}, HTTP_USER_AGENT='Mozilla/5.0')
+        first = Order.objects.order_by("delivery_address").first()
+        self.assertEqual(
+            response.json()["results"][0]["products"],
+            [product.pk for product in first.products.all()],
+        )
+
+    def test_user_orders_export_queries_do_not_grow(self):
+        url = reverse("shopapp:export_user_orders", kwargs={"user_id": self.user.pk})
+        self.add_orders(2)
+        few = self.count_queries(url)
+        self.add_orders(20)
+        self.assertEqual(self.count_queries(url), few)
+
+
+@override_settings(LANGUAGE_CODE="en", CACHES=LOCMEM_CACHES)
+class ProductsBulkViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='bulk_owner', password='password')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f"Product {i}", price=10 + i, count=5, created_by=cls.user) for i in range(3)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def send(self, method, payload):
+        return getattr(self.client, method)(
+            reverse("shopapp:product-bulk"),
+            json.dumps(payload),
+            content_type="application/json",
+            HTTP_USER_AGENT='Mozilla/5.0',
+        )
+
+    def test_bulk_create(self):
+        response = self.send("post", [
+            {"name": "New 1", "price": "1.50", "count": 1, "created_by": self.user.pk},
+            {"name": "New 2", "price": "2.50", "count": 2, "created_by": self.user.pk},
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([item["name"] for item in response.json()], ["New 1", "New 2"])
+        self.assertTrue(all(item["id"] for item in response.json()))
+        self.assertEqual(Product.objects.filter(name__startswith="New").count(), 2)
+
+    def test_bulk_partial_update_in_one_statement(self):
+        payload = [{"id": product.pk, "price": "99.00", "count": i} for i, product in enumerate(self.products)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.send("patch", payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sum(query["sql"].startswith('UPDATE "shopapp_product"') for query in queries), 1)
+        self.assertEqual(
+            list(Product.objects.order_by("pk").values_list("price", "count")),
+            [(99, 0), (99, 1), (99, 2)],
+        )
+
+    def test_bulk_update_accepts_string_ids(self):
+        response = self.send("patch", [{"id": str(self.products[0].pk), "price": "7.00"}])
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).price, 7)
+
+    def test_errors_are_reported_per_item_and_nothing_is_saved(self):
+        response = self.send("patch", [
+            {"id": self.products[0].pk, "count": 100},
+            {"id": self.products[1].pk, "price": "not a price"},
+            {"id": 0, "count": 1},
+            {"id": self.products[0].pk, "count": 1},
+        ])
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()
+        self.assertEqual(errors[0], {})
+        self.assertIn("price", errors[1])
+        self.assertIn("id", errors[2])
+        self.assertIn("id", errors[3])
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).count, 5)
+
+    def test_full_update_requires_all_fields(self):
+        response = self.send("put", [{"id": self.products[0].pk, "count": 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("name", response.json()[0])
+
+    def test_list_cache_is_invalidated(self):
+        url = reverse("shopapp:product-list")
+        self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0')
+        self.send("patch", [{"id": self.products[0].pk, "name": "Renamed"}])
+        names = [item["name"] for item in self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0').json()["results"]]
+        self.assertIn("Renamed", names)
+
+
+@override_settings(LANGUAGE_CODE="en", CACHES=LOCMEM_CACHES)
+class StockReservationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username='stock_owner', password='password')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f"Stock {i}", price=10, count=2, created_by=cls.user) for i in range(3)
+        ])
+        cls.ids = [product.pk for product in cls.products]
+
+    def setUp(self):
+        cache.clear()
+
+    def counts(self):
+        return list(Product.objects.filter(pk__in=self.ids).order_by("pk").values_list("count", flat=True))
+
+    def test_reserve_in_one_update_and_one_insert(self):
+        order = Order.objects.create(user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            reserve_products(order, self.ids, current=set())
+        statements = [query["sql"] for query in queries]
+        self.assertEqual(sum(sql.startswith('UPDATE "shopapp_product" SET') for sql in statements), 1)
+        self.assertEqual(sum(sql.startswith("INSERT") and "shopapp_order_products" in sql for sql in statements), 1)
+        self.assertEqual(self.counts(), [1, 1, 1])
+        self.assertEqual(sorted(order.products.values_list("pk", flat=True)), self.ids)
+
+    def test_oversell_is_rejected_and_rolled_back(self):
+        Product.objects.filter(pk=self.ids[1]).update(count=0)
+        order = Order.objects.create(user=self.user)
+        with self.assertRaises(OutOfStock) as raised:
+            reserve_products(order, self.ids)
+        self.assertEqual(raised.exception.product_ids, [self.ids[1]])
+        self.assertEqual(self.counts(), [2, 0, 2])
+        self.assertFalse(order.products.exists())
+
+    def test_api_create_and_update(self):
+        url = reverse("shopapp:order-list")
+        payload = {"user": self.user.pk, "delivery_address": "addr", "promocode": "", "products": self.ids[:2]}
+        response = self.client.post(url, payload, content_type="application/json", HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.counts(), [1, 1, 2])
+
+        detail = reverse("shopapp:order-detail", kwargs={"pk": response.json()["id"]})
+        response = self.client.patch(
+            detail, {"products": self.ids[1:]}, content_type="application/json", HTTP_USER_AGENT='Mozilla/5.0',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.counts(), [2, 1, 1])
+
+        Product.objects.filter(pk=self.ids[0]).update(count=0)
+        response = self.client.post(url, payload, content_type="application/json", HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("products", response.json())
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_order_create_view(self):
+        self.client.force_login(self.user)
+        Product.objects.filter(pk=self.ids[2]).update(count=0)
+        response = self.client.post(
+            reverse("shopapp:order_create"),
+            {"delivery_address": "addr", "promocode": "", "products": self.ids},
+            HTTP_USER_AGENT='Mozilla/5.0',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.counts(), [2, 2, 0])
+
+    def test_update_order_command(self):
+        order = Order.objects.create(user=self.user)
+        order.products.add(self.ids[0])
+        call_command("update_order", stdout=StringIO())
+        self.assertEqual(self.counts(), [2, 1, 1])
+        self.assertEqual(order.products.count(), 3)
+
+
+class StockReservationStressTestCase(TransactionTestCase):
+    def test_concurrent_orders_do_not_oversell(self):
+        out = StringIO()
+        call_command("stress_stock", threads=4, orders=20, stock=30, retries=200, stdout=out)
+        self.assertIn("units sold: 90", out.getvalue())
+
+
+@override_settings(LANGUAGE_CODE="en", CACHES=LOCMEM_CACHES)
+class OrderTotalsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='totals_owner', password='password')
+        cls.laptop = Product.objects.create(name="Laptop", price="1000.50", count=10, created_by=cls.user)
+        cls.mouse = Product.objects.create(name="Mouse", price="20.25", count=10, created_by=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def assertTotals(self, order, total, count):
+        order = Order.objects.get(pk=order.pk)
+        self.assertEqual((order.total, order.products_count), (Decimal(total), count))
+
+    def test_m2m_changes(self):
+        order = Order.objects.create(user=self.user)
+        order.products.add(self.laptop, self.mouse)
+        self.assertEqual(order.total, Decimal("1020.75"))
+        order.products.add(self.mouse)
+        self.assertTotals(order, "1020.75", 2)
+        order.products.remove(self.laptop, self.laptop)
+        self.assertTotals(order, "20.25", 1)
+        self.mouse.orders.add(Order.objects.create(user=self.user))
+        order.products.clear()
+        self.assertTotals(order, "0", 0)
+
+    def admin_change(self, url, change_row):
+        """Отправляет форму изменения в админке как есть, поменяв строки инлайна в ``change_row``."""
+        response = self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0')
+        data = {}
+        forms = [response.context["adminform"].form]
+        for inline in response.context["inline_admin_formsets"]:
+            formset = inline.formset
+            forms += [formset.management_form, *formset.forms]
+        for form in forms:
+            for name in form.fields:
+                # файлы не отправляются: остаётся сохранённый
+                value = form[name].value()
+                if (value or value == 0) and not isinstance(form.fields[name], FileField):
+                    data[form.add_prefix(name)] = value
+        change_row(data, response.context["inline_admin_formsets"][0].formset.prefix)
+        response = self.client.post(url, data, HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(response.status_code, 302)
+
+    def test_admin_inlines(self):
+        self.client.force_login(User.objects.create_superuser(username='totals_admin', password='password'))
+        # чек обязателен в форме заказа
+        order = Order.objects.create(user=self.user, receipt="orders/receipts/receipt.txt")
+        order.products.add(self.laptop)
+
+        def add_mouse(data, prefix):
+            data[f"{prefix}-TOTAL_FORMS"] = 2
+            data[f"{prefix}-1-product"] = self.mouse.pk
+            data[f"{prefix}-1-order"] = order.pk
+        self.admin_change(reverse("admin:shopapp_order_change", args=[order.pk]), add_mouse)
+        self.assertTotals(order, "1020.75", 2)
+
+        def delete_order(data, prefix):
+            data[f"{prefix}-0-DELETE"] = "on"
+        self.admin_change(reverse("admin:shopapp_product_change", args=[self.laptop.pk]), delete_order)
+        self.assertTotals(order, "20.25", 1)
+
+    def test_price_changes_and_product_delete(self):
+        orders = [Order.objects.create(user=self.user) for _ in range(2)]
+        for order in orders:
+            order.products.add(self.laptop, self.mouse)
+        laptop = Product.objects.get(pk=self.laptop.pk)
+        laptop.price = Decimal("900.00")
+        laptop.save()
+        self.assertTotals(orders[1], "920.25", 2)
+        Product.objects.get(pk=self.mouse.pk).delete()
+        self.assertTotals(orders[0], "900.00", 1)
+
+    def test_bulk_price_update(self):
+        order = Order.objects.create(user=self.user)
+        order.products.add(self.laptop, self.mouse)
+        self.client.patch(
+            reverse("shopapp:product-bulk"),
+            json.dumps([{"id": self.mouse.pk, "price": "30.00"}]),
+            content_type="application/json",
+            HTTP_USER_AGENT='Mozilla/5.0',
+        )
+        self.assertTotals(order, "1030.50", 2)
+
+    def test_rebuild_command_and_api(self):
+        order = Order.objects.create(user=self.user)
+        order.products.add(self.laptop)
+        Order.objects.update(total=0, products_count=0)
+        call_command("rebuild_order_totals", stdout=StringIO())
+        self.assertTotals(order, "1000.50", 1)
+
+        response = self.client.get(
+            reverse("shopapp:order-list"), {"ordering": "-total", "fields": "id,total,products_count"},
+            HTTP_USER_AGENT='Mozilla/5.0',
+        )
+        self.assertEqual(response.json()["results"], [{"id": order.pk, "total": "1000.50", "products_count": 1}])
+
+
+@override_settings(LANGUAGE_CODE="en", CACHES=LOCMEM_CACHES)
+class SalesAnalyticsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='analytics_owner', password='password')
+        cls.admin = User.objects.create_superuser(username='analytics_admin', password='password')
+        cls.laptop = Product.objects.create(name="Laptop", price="1000.00", discount=10, count=10, created_by=cls.user)
+        cls.mouse = Product.objects.create(name="Mouse", price="20.00", count=10, created_by=cls.user)
+        cls.today = timezone.localdate()
+        cls.yesterday = cls.today - timedelta(days=1)
+        cls.old_order = Order.objects.create(user=cls.user)
+        cls.old_order.products.add(cls.laptop, cls.mouse)
+        Order.objects.filter(pk=cls.old_order.pk).update(created_at=timezone.now() - timedelta(days=1))
+        Order.objects.create(user=cls.user).products.add(cls.mouse)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_report(self):
+        report = sales_report(self.yesterday, self.today)
+        self.assertEqual(report["revenue_per_day"], [
+            {"day": self.yesterday.isoformat(), "orders": 1, "items": 2, "revenue": "1020.00", "net_revenue": "920.00"},
+            {"day": self.today.isoformat(), "orders": 1, "items": 1, "revenue": "20.00", "net_revenue": "20.00"},
+        ])
+        self.assertEqual(report["totals"], {"orders": 2, "items": 3, "revenue": "1040.00", "net_revenue": "940.00"})
+        self.assertEqual(report["average_basket"], {"items": 1.5, "revenue": "520.00", "net_revenue": "470.00"})
+        self.assertEqual(report["discount_impact"]["discount_amount"], "100.00")
+        self.assertEqual(
+            [(item["name"], item["units"]) for item in report["top_products"]],
+            [("Laptop", 1), ("Mouse", 2)],
+        )
+
+    def test_closed_days_are_cached(self):
+        with CaptureQueriesContext(connection) as first:
+            sales_report(self.yesterday, self.today)
+        Order.objects.create(user=self.user).products.add(self.laptop)
+        with CaptureQueriesContext(connection) as second:
+            report = sales_report(self.yesterday, self.today)
+        # пересчитывается только сегодняшний день (3 запроса) + названия товаров
+        self.assertEqual((len(first), len(second)), (7, 4))
+        self.assertEqual(report["totals"]["orders"], 3)
+
+        Order.objects.get(pk=self.old_order.pk).products.remove(self.mouse)
+        self.assertEqual(sales_report(self.yesterday, self.today)["revenue_per_day"][0]["revenue"], "1000.00")
+        Product.objects.filter(pk=self.laptop.pk).get().save()
+        with CaptureQueriesContext(connection) as after_product_save:
+            sales_report(self.yesterday, self.today)
+        self.assertEqual(len(after_product_save), 7)
+
+    def test_view(self):
+        url = reverse("shopapp:sales-analytics")
+        self.assertEqual(self.client.get(url, HTTP_USER_AGENT='Mozilla/5.0').status_code, 403)
+        self.client.force_login(self.admin)
+        response = self.client.get(
+            url, {"start": self.yesterday.isoformat(), "top": 1}, HTTP_USER_AGENT='Mozilla/5.0',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["totals"]["revenue"], "1040.00")
+        self.assertEqual(len(response.json()["top_products"]), 1)
+        for params in ({"start": "yesterday"}, {"top": 0}, {"start": self.today.isoformat(), "end": self.yesterday.isoformat()}):
+            response = self.client.get(url, params, HTTP_USER_AGENT='Mozilla/5.0')
+            self.assertEqual(response.status_code, 400, params)
+
+
+@override_settings(LANGUAGE_CODE="en", CACHES=LOCMEM_CACHES)
+class RelatedProductsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='related_owner', password='password')
+        cls.laptop, cls.mouse, cls.bag, cls.pad = Product.objects.bulk_create([
+            Product(name=name, price=10, count=10, created_by=cls.user) for name in ("Laptop", "Mouse", "Bag", "Pad")
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def order(self, *products):
+        order = Order.objects.create(user=self.user)
+        order.products.add(*products)
+        return order
+
+    def assertIndexIsExact(self):
+        stored = set(RelatedProduct.objects.values_list("product_id", "related_id", "orders"))
+        self.assertEqual(stored, set(co_occurrences()))
+
+    def test_incremental_updates_match_rebuild(self):
+        first = self.order(self.laptop, self.mouse)
+        first.products.add(self.bag, self.mouse)
+        second = self.order(self.laptop, self.bag, self.pad)
+        self.order(self.mouse)
+        self.assertEqual(related_product_ids(self.laptop.pk), [(self.bag.pk, 2), (self.mouse.pk, 1), (self.pad.pk, 1)])
+        self.assertIndexIsExact()
+
+        first.products.remove(self.mouse, self.pad)
+        self.assertEqual(related_product_ids(self.laptop.pk), [(self.bag.pk, 2), (self.pad.pk, 1)])
+        self.assertIndexIsExact()
+        self.pad.orders.add(first)
+        self.assertIndexIsExact()
+        second.products.clear()
+        self.assertIndexIsExact()
+        first.delete()
+        self.assertEqual(RelatedProduct.objects.count(), 0)
+
+        self.order(self.laptop, self.mouse)
+        RelatedProduct.objects.all().delete()
+        call_command("rebuild_related_products", stdout=StringIO())
+        self.assertIndexIsExact()
+
+    def test_api_and_details_page(self):
+        self.order(self.laptop, self.mouse, self.bag)
+        self.order(self.laptop, self.mouse)
+        Product.objects.filter(pk=self.bag.pk).update(archived=True)
+        url = reverse("shopapp:product-related", kwargs={"pk": self.laptop.pk})
+
+        response = self.client.get(url, {"fields": "id,name"}, HTTP_USER_AGENT='Mozilla/5.0')
+        self.assertEqual(response.json(), [{"id": self.mouse.pk, "name": "Mouse", "orders_together": 2}])
+        self.assertEqual(self.client.get(url, {"limit": 0}, HTTP_USER_AGENT='Mozilla/5.0').status_code, 400)
+        missing = reverse("shopapp:product-related", kwargs={"pk": 10 ** 6})
+        self.assertEqual(self.client.get(missing, HTTP_USER_AGENT='Mozilla/5.0').status_code, 404)
+
+        response = self.client.get(
+            reverse("shopapp:product_details", kwargs={"pk": self.mouse.pk}), HTTP_USER_AGENT='Mozilla/5.0'
+        )
+        self.assertEqual([product.name for product in response.context["related_products"]], ["Laptop"])
+        self.assertContains(response, "Frequently bought together")
+
+    def test_lookup_is_cached(self):
+        self.order(self.laptop, self.mouse)
+        related_product_ids(self.laptop.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(related_product_ids(self.laptop.pk), [(self.mouse.pk, 1)])
+        self.order(self.laptop, self.pad)
+        self.assertEqual(related_product_ids(self.laptop.pk), [(self.mouse.pk, 1), (self.pad.pk, 1)])
@@ -0,0 +1,45 @@
+"""
+Хранимые ``Order.total`` и ``Order.products_count``.
+
+Поддерживаются сигналами из :mod:`shopapp.signals`: при добавлении товаров
+к заказу сумма растёт на их цены, при смене цены товара суммы всех заказов
+с ним меняются на разницу. Где разница неизвестна (удаление связей,
+массовые обновления), суммы пересчитываются только у затронутых заказов.
+Полный пересчёт — команда ``rebuild_order_totals``.
+"""
+from decimal import Decimal
+
+from django.db.models import F, OuterRef, Subquery, Sum, Count, Value, DecimalField, IntegerField
+from django.db.models.functions import Coalesce
+
+from .models import Order
+
+
+def order_items():
+    return Order.products.through.objects
+
+
+def orders_with_products(product_ids):
+    return Order.objects.filter(
+        pk__in=order_items().filter(product_id__in=product_ids).values("order_id")
+    )
+
+
+def rebuild_order_totals(orders=None) -> int:
+    """Пересчитывает суммы заказов ``orders`` (по умолчанию — всех) одним ``UPDATE``."""
+    if orders is None:
+        orders = Order.objects.all()
+    items = order_items().filter(order_id=OuterRef("pk")).order_by().values("order_id")
+    total = items.annotate(total=Sum("product__price")).values("total")
+    count = items.annotate(count=Count("pk")).values("count")
+    return orders.update(
+        total=Coalesce(Subquery(total), Value(Decimal(0)), output_field=DecimalField()),
+        products_count=Coalesce(Subquery(count), Value(0), output_field=IntegerField()),
+    )
+
+
+def add_to_totals(orders, amount, count=0) -> int:
+    return orders.update(
+        total=F("total") + amount,
+        products_count=F("products_count") + count,
+    )
@@ -20,6 +20,9 @@ from .views import (ShopIndexView,
                     LatestProductsFeed,
                     UserOrdersListView,
                     UserOrdersExportView,
+                    ImportJobViewSet,
+                    ColumnarExportView,
+                    SalesAnalyticsView,
                     )
 
 app_name = "shopapp"
@@ -27,10 +30,12 @@ app_name = "shopapp"
 routers = DefaultRouter()
 routers.register("products", ProductViewSet)
 routers.register("orders", OrderViewSet)
+routers.register("import-jobs", ImportJobViewSet)
 
 urlpatterns = [
     path("", ShopIndexView.as_view(), name="index"),
     path("api/", include(routers.urls)),
+    path("api/analytics/sales/", SalesAnalyticsView.as_view(), name="sales-analytics"),
     path("groups/", GroupsListView.as_view(), name="groups_list"),
     path("products/", ProductsListView.as_view(), name="products_list"),
     path("products/export/", ProductsDataExportView.as_view(), name="products-export"),
@@ -42,6 +47,7 @@ urlpatterns = [
     path("users/<int:user_id>/orders/", UserOrdersListView.as_view(), name="user_orders_list"),
     path('users/<int:user_id>/orders/export/', UserOrdersExportView.as_view(), name='export_user_orders'),
     path("orders/export/", OrdersExportView.as_view(), name="orders-export"),
+    path("export/columnar/", ColumnarExportView.as_view(), name="columnar-export"),
     path("orders/<int:pk>", OrderDetailsView.as_view(), name="orders_details"),
     path("orders/<int:pk>/update/", OrderUpdateView.as_view(), name="order_update"),
     path("orders/<int:pk>/delete/", OrderDeleteView.as_view(), name="order_delete"),
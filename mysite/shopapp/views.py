@@ -3,23 +3,27 @@
 
 Разные view интернет-магазина: по товарам, заказам и т.д.
 """
-from csv import DictWriter
+import json
 import logging
+import tempfile
+from itertools import groupby
+from operator import itemgetter
+from datetime import date, timedelta
 from timeit import default_timer
-from django.utils.decorators import method_decorator
 from django.contrib.syndication.views import Feed
-from django.views.decorators.cache import cache_page
 from rest_framework.response import Response
 from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
 from rest_framework.views import APIView
 
-from .common import save_csv_products, save_csv_orders
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
-from drf_spectacular.utils import extend_schema, OpenApiResponse
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema, OpenApiResponse, OpenApiParameter
 from django import forms
 from django.contrib.auth.models import Group, User
-from django.http import HttpRequest, HttpResponse, HttpResponseRedirect, JsonResponse, Http404
+from django.http import HttpRequest, HttpResponse, HttpResponseRedirect, JsonResponse, Http404, StreamingHttpResponse, \
+    FileResponse
 from django.shortcuts import render, redirect, reverse, get_object_or_404
 from django.urls import reverse_lazy
 from django.views.generic import TemplateView, ListView, DetailView, CreateView, UpdateView, DeleteView
@@ -27,11 +31,28 @@ from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMix
 from rest_framework.request import Request
 from rest_framework.parsers import MultiPartParser
 from .forms import GroupForm, ProductForm
-from shopapp.models import Product, Order, ProductImage
+from shopapp.models import Product, Order, ProductImage, ImportJob
+from .common import stream_csv, iter_batches, CSV_EXPORT_CHUNK_SIZE
+from .columnar import write_npz
+from .search import FullTextSearchFilter
+from .pagination import ShopPagination, PaginationAwareFilterBackend
+from .stock import reserve_products, set_order_products, OutOfStock
+from .totals import rebuild_order_totals, orders_with_products
+from .analytics import sales_report
+from .recommendations import related_products, RELATED_PRODUCTS_LIMIT
+from .caching import CachedListMixin, versioned_key, bump_version, user_orders_version, PRODUCTS_VERSION, ORDERS_VERSION, \
+    ANALYTICS_VERSION, EXPORT_CACHE_TIMEOUT
+from django.db import transaction
+from django.utils import timezone
 from django.views import View
-from rest_framework.viewsets import ModelViewSet
+from rest_framework import generics, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 from rest_framework.decorators import action
-from .serializers import ProductSerializer, OrderSerializer
+from .serializers import (
+    ProductSerializer, OrderSerializer, ImportJobSerializer, BulkListSerializer, prefetch_order_products,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -51,8 +72,46 @@ class LatestProductsFeed(Feed):
         return item.description
 
 
+class SparseFieldsetMixin:
+    """
+    ``?fields=id,name,price`` для ``list`` и ``retrieve``: сужает и сериализатор,
+    и запрос к базе (``only()`` по колонкам модели).
+    """
+    fields_query_param = "fields"
+    sparse_actions = ("list", "retrieve")
+
+    def get_requested_fields(self):
+        if getattr(self, "action", None) not in self.sparse_actions:
+            return None
+        if not hasattr(self, "_requested_fields"):
+            value = self.request.query_params.get(self.fields_query_param, "")
+            names = [name.strip() for name in value.split(",") if name.strip()] or None
+            if names:
+                unknown = set(names) - set(self.get_serializer_class()().fields)
+                if unknown:
+                    raise ValidationError({self.fields_query_param: [f"Unknown fields: {', '.join(sorted(unknown))}"]})
+            self._requested_fields = names
+        return self._requested_fields
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields:
+            kwargs["fields"] = fields
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_requested_fields()
+        if fields:
+            model_fields = {field.name for field in queryset.model._meta.concrete_fields}
+            columns = [name for name in fields if name in model_fields]
+            if columns:
+                queryset = queryset.only(*columns)
+        return queryset
+
+
 @extend_schema(description="Product views CRUD")
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(SparseFieldsetMixin, CachedListMixin, ModelViewSet):
     """
     Набор представлений для действий над Product
     \n
@@ -60,9 +119,12 @@ class ProductViewSet(ModelViewSet):
     """
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = ShopPagination
+    sparse_actions = ("list", "retrieve", "related")
+    bulk_max_items = 5000
     filter_backends = [
-        SearchFilter,
-        DjangoFilterBackend,
+        FullTextSearchFilter,
+        PaginationAwareFilterBackend,
         OrderingFilter
     ]
     search_fields = [
@@ -84,17 +146,33 @@ class ProductViewSet(ModelViewSet):
         "discount",
     ]
 
-    @method_decorator(cache_page(60 * 2))
     def list(self, request, *args, **kwargs):
-        print("Hello products list")
+        logger.debug("Listing products: %s", request.query_params.dict())
         return super().list(request, *args, **kwargs)
 
+    @extend_schema(
+        summary="Products frequently bought together with this one",
+        parameters=[OpenApiParameter("limit", OpenApiTypes.INT)],
+        responses={200: ProductSerializer(many=True)},
+    )
+    @action(methods=['get'], detail=True)
+    def related(self, request: Request, pk=None):
+        """Товары из тех же заказов; в ``orders_together`` — сколько заказов у них общих."""
+        product = generics.get_object_or_404(Product.objects.only("pk"), pk=pk)
+        try:
+            limit = int(request.query_params.get("limit", RELATED_PRODUCTS_LIMIT))
+            if not 1 <= limit <= RELATED_PRODUCTS_LIMIT:
+                raise ValueError
+        except ValueError:
+            raise ValidationError({"limit": [f"Integer from 1 to {RELATED_PRODUCTS_LIMIT}."]})
+        products = related_products(product.pk, limit, self.get_queryset())
+        data = self.get_serializer(products, many=True).data
+        for item, product in zip(data, products):
+            item["orders_together"] = product.orders_together
+        return Response(data)
+
     @action(methods=['get'], detail=False)
     def download_csv(self, request: Request):
-        response = HttpResponse(content_type="text/csv")
-        filename = "products-export.csv"
-        response["Content-Disposition"] = f"attachment; filename={filename}"
-        queryset = self.filter_queryset(self.get_queryset())
         fields = [
             "name",
             "description",
@@ -103,15 +181,13 @@ class ProductViewSet(ModelViewSet):
             "discount",
             "archived",
         ]
-        queryset = queryset.only(*fields)
-        writer = DictWriter(response, fieldnames=fields)
-        writer.writeheader()
-
-        for product in queryset:
-            writer.writerow({
-                field: getattr(product, field)
-                for field in fields
-            })
+        queryset = self.filter_queryset(self.get_queryset()).values_list(*fields)
+        response = StreamingHttpResponse(
+            stream_csv(fields, queryset.iterator(chunk_size=CSV_EXPORT_CHUNK_SIZE)),
+            content_type="text/csv",
+        )
+        filename = "products-export.csv"
+        response["Content-Disposition"] = f"attachment; filename={filename}"
         return response
 
     @action(methods=['post'],
@@ -119,12 +195,49 @@ class ProductViewSet(ModelViewSet):
             parser_classes=[MultiPartParser],
             )
     def upload_csv(self, request: Request):
-        products = save_csv_products(
-            request.FILES["file"].file,
-            encoding=request.encoding,
+        return create_import_job(request, ImportJob.TARGET_PRODUCTS)
+
+    @extend_schema(
+        summary="Bulk create (POST), update (PUT) or partially update (PATCH) products",
+        request=ProductSerializer(many=True),
+        responses={200: ProductSerializer(many=True), 201: ProductSerializer(many=True)},
+    )
+    @action(methods=['post', 'put', 'patch'], detail=False)
+    def bulk(self, request: Request):
+        """
+        Список товаров проверяется целиком и сохраняется в одной транзакции:
+        при любой ошибке ничего не записывается, а в ответе 400 — ошибки по индексам.
+        """
+        if request.method == "POST":
+            serializer = self.get_serializer(data=request.data, many=True, max_length=self.bulk_max_items)
+        else:
+            ids = []
+            if isinstance(request.data, list):
+                # то же правило, что и при проверке элементов: "1" — это id 1
+                ids = [BulkListSerializer.item_id(item) for item in request.data if isinstance(item, dict)]
+                ids = [pk for pk in ids if pk is not None]
+            serializer = self.get_serializer(
+                self.get_queryset().in_bulk(ids),
+                data=request.data,
+                many=True,
+                partial=request.method == "PATCH",
+                max_length=self.bulk_max_items,
+            )
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            products = serializer.save()
+            if request.method != "POST":
+                repriced = [product.pk for product in products if product.price != getattr(product, "_loaded_price", None)]
+                if repriced and rebuild_order_totals(orders_with_products(repriced)):
+                    bump_version(ORDERS_VERSION)
+        # bulk_create/bulk_update не вызывают post_save
+        bump_version(PRODUCTS_VERSION)
+        if request.method != "POST":
+            bump_version(ANALYTICS_VERSION)
+        return Response(
+            serializer.data,
+            status=status.HTTP_201_CREATED if request.method == "POST" else status.HTTP_200_OK,
         )
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
 
     @extend_schema(
         summary="Get one product by ID",
@@ -138,9 +251,10 @@ class ProductViewSet(ModelViewSet):
         return super().retrieve(*args, **kwargs)
 
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(SparseFieldsetMixin, ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    pagination_class = ShopPagination
     filter_backends = [
         SearchFilter,
         DjangoFilterBackend,
@@ -157,36 +271,86 @@ class OrderViewSet(ModelViewSet):
     ordering_fields = [
         'delivery_address',
         'promocode',
+        'total',
+        'products_count',
     ]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_requested_fields()
+        if self.action in self.sparse_actions and (fields is None or "products" in fields):
+            queryset = prefetch_order_products(queryset)
+        return queryset
+
+    def perform_create(self, serializer):
+        products = serializer.validated_data.pop("products", [])
+        try:
+            with transaction.atomic():
+                order = serializer.save()
+                reserve_products(order, products, current=set())
+        except OutOfStock as exc:
+            raise ValidationError({"products": [str(exc)]})
+
+    def perform_update(self, serializer):
+        products = serializer.validated_data.pop("products", None)
+        try:
+            with transaction.atomic():
+                order = serializer.save()
+                if products is not None:
+                    set_order_products(order, products)
+        except OutOfStock as exc:
+            raise ValidationError({"products": [str(exc)]})
+
     @action(methods=['get'], detail=False)
     def download_csv(self, request: Request):
-        response = HttpResponse(content_type="text/csv")
-        filename = "orders-export.csv"
-        response["Content-Disposition"] = f"attachment; filename={filename}"
-        queryset = self.filter_queryset(self.get_queryset())
         fields = [
             "delivery_address",
             "promocode",
         ]
-        queryset = queryset.only(*fields)
-        writer = DictWriter(response, fieldnames=fields)
-        writer.writeheader()
-
-        for order in queryset:
-            writer.writerow({
-                field: getattr(order, field)
-                for field in fields
-            })
+        queryset = self.filter_queryset(self.get_queryset()).values_list(*fields)
+        response = StreamingHttpResponse(
+            stream_csv(fields, queryset.iterator(chunk_size=CSV_EXPORT_CHUNK_SIZE)),
+            content_type="text/csv",
+        )
+        filename = "orders-export.csv"
+        response["Content-Disposition"] = f"attachment; filename={filename}"
         return response
 
+    @action(methods=['post'],
+            detail=False,
+            parser_classes=[MultiPartParser],
+            )
     def upload_csv(self, request: Request):
-        orders = save_csv_orders(
-            request.FILES["file"].file,
-            encoding=request.encoding,
-        )
-        serializer = self.get_serializer(orders, many=True)
-        return Response(serializer.data)
+        return create_import_job(request, ImportJob.TARGET_ORDERS)
+
+
+def create_import_job(request: Request, target: str) -> Response:
+    """
+    Ставит загруженный CSV в очередь фонового импорта и сразу возвращает id задачи.
+    """
+    job = ImportJob.objects.create(
+        target=target,
+        file=request.FILES["file"],
+        encoding=request.encoding or "utf-8",
+        upsert=request.query_params.get("upsert") in ("1", "true"),
+        created_by=request.user if request.user.is_authenticated else None,
+    )
+    return Response(
+        {
+            "job": job.pk,
+            "status": job.status,
+            "status_url": reverse("shopapp:importjob-detail", kwargs={"pk": job.pk}),
+        },
+        status=status.HTTP_202_ACCEPTED,
+    )
+
+
+class ImportJobViewSet(ReadOnlyModelViewSet):
+    """
+    Статус фоновых задач импорта: обработанные строки, скорость и ошибки.
+    """
+    queryset = ImportJob.objects.all()
+    serializer_class = ImportJobSerializer
 
 
 class ShopIndexView(View):
@@ -204,7 +368,7 @@ class ShopIndexView(View):
         }
         # log.debug("Products for shop index: %s", products)
         logger.info("Rendering shop index")
-        print("shop index context: ", context)
+        logger.debug("Shop index context: %s", context)
         return render(request, "shopapp/shop-index.html", context=context)
 
 
@@ -230,6 +394,11 @@ class ProductDetailsView(DetailView):
     queryset = Product.objects.prefetch_related("images")
     context_object_name = 'product'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['related_products'] = related_products(self.object.pk, queryset=Product.objects.only("pk", "name", "price"))
+        return context
+
 
 class ProductsListView(LoginRequiredMixin, ListView):
     template_name = "shopapp/products.html"
@@ -289,27 +458,47 @@ class ProductDeleteView(DeleteView):
 
 
 class ProductsDataExportView(View):
-    def get(self, request: HttpRequest) -> JsonResponse:
-        cache_key = "products_data_export"
-        products_data = cache.get(cache_key)
-        products = Product.objects.order_by('pk').all()
-        if products_data is None:
-            products_data = [
-                {
-                    "pk": product.pk,
-                    "name": product.name,
-                    "description": product.description,
-                    "price": product.price,
-                    "count": product.count,
-                    "discount": product.discount,
-                    "archived": product.archived,
-                    "created_by": product.created_by.pk
-                }
-                for product in products
-            ]
-            cache.set(cache_key, products_data, 300)
-
-        return JsonResponse({"products": products_data})
+    """
+    Выгрузка товаров в JSON.
+
+    Поддерживает постраничную выгрузку по ключу: ``?after=<pk>&limit=<n>``.
+    В кеше хранится готовое тело ответа, поэтому при попадании в кеш
+    нет ни запросов к БД, ни повторного кодирования JSON.
+    """
+    fields = "pk", "name", "description", "price", "count", "discount", "archived", "created_by_id"
+    max_limit = 10000
+
+    def get(self, request: HttpRequest) -> HttpResponse:
+        try:
+            after = int(request.GET.get("after", 0))
+            limit = min(int(request.GET.get("limit", 0)), self.max_limit)
+        except ValueError:
+            return JsonResponse({"error": "after и limit должны быть целыми числами"}, status=400)
+
+        cache_key = versioned_key(f"products_data_export:{after}:{limit}", PRODUCTS_VERSION)
+        content = cache.get(cache_key)
+        if content is None:
+            content = self.render_products(after, limit)
+            cache.set(cache_key, content, EXPORT_CACHE_TIMEOUT)
+
+        return HttpResponse(content, content_type="application/json")
+
+    def render_products(self, after: int, limit: int) -> bytes:
+        products = Product.objects.order_by("pk").values(*self.fields)
+        if after:
+            products = products.filter(pk__gt=after)
+        if limit > 0:
+            products = products[:limit]
+
+        products_data = []
+        for product in products:
+            product["created_by"] = product.pop("created_by_id")
+            products_data.append(product)
+
+        data = {"products": products_data}
+        if limit > 0:
+            data["next_after"] = products_data[-1]["pk"] if len(products_data) == limit else None
+        return json.dumps(data, cls=DjangoJSONEncoder).encode()
 
 
 class OrdersListView(LoginRequiredMixin, ListView):
@@ -335,9 +524,14 @@ class OrderCreateView(CreateView):
 
     def form_valid(self, form):
         form.instance.user = self.get_user()
-        form.save()
-        products = self.request.POST.getlist('products')
-        form.instance.products.set(products)
+        try:
+            with transaction.atomic():
+                form.save()
+                reserve_products(form.instance, self.request.POST.getlist('products'), current=set())
+        except OutOfStock as exc:
+            form.instance.pk = None
+            form.add_error(None, str(exc))
+            return self.form_invalid(form)
         return super().form_valid(form)
 
     def get_context_data(self, **kwargs):
@@ -354,6 +548,17 @@ class OrderUpdateView(UpdateView):
     fields = "delivery_address", "promocode", "products"
     template_name_suffix = "_update_form"
 
+    def form_valid(self, form):
+        try:
+            with transaction.atomic():
+                self.object = form.save(commit=False)
+                self.object.save()
+                set_order_products(self.object, form.cleaned_data["products"])
+        except OutOfStock as exc:
+            form.add_error("products", str(exc))
+            return self.form_invalid(form)
+        return HttpResponseRedirect(self.get_success_url())
+
     def get_success_url(self):
         return reverse("shopapp:orders_details", kwargs={"pk": self.object.pk})
 
@@ -368,20 +573,67 @@ class OrdersExportView(View):
         return self.request.user.is_staff
 
     def get(self, request):
-        orders = Order.objects.all()
-        data = {
-            'orders': [
-                {
-                    'id': order.id,
-                    'delivery_address': order.delivery_address,
-                    'promocode': order.promocode,
-                    'user_id': order.user_id,
-                    'product_ids': [product.id for product in order.products.all()]
-                }
-                for order in orders
-            ]
-        }
-        return JsonResponse(data)
+        return StreamingHttpResponse(stream_orders_json(), content_type="application/json")
+
+
+def stream_orders_json(chunk_size=CSV_EXPORT_CHUNK_SIZE):
+    """
+    JSON выгрузки заказов, отдаётся кусками.
+
+    Заказы и связи заказ-товар читаются двумя запросами, отсортированными по id заказа,
+    и сливаются на лету — без запроса ``order.products.all()`` на каждый заказ.
+    """
+    orders = (
+        Order.objects
+        .order_by("pk")
+        .values_list("id", "delivery_address", "promocode", "user_id")
+        .iterator(chunk_size=chunk_size)
+    )
+    links = groupby(
+        Order.products.through.objects
+        .order_by("order_id", *[
+            field.replace(field.lstrip("-"), f"product__{field.lstrip('-')}")
+            for field in Product._meta.ordering
+        ])
+        .values_list("order_id", "product_id")
+        .iterator(chunk_size=chunk_size),
+        key=itemgetter(0),
+    )
+    link_order_id, link_rows = next(links, (None, ()))
+    encoder = DjangoJSONEncoder()
+
+    yield '{"orders": ['
+    for batch_number, batch in enumerate(iter_batches(orders, chunk_size)):
+        items = []
+        for order_id, delivery_address, promocode, user_id in batch:
+            product_ids = []
+            while link_order_id is not None and link_order_id <= order_id:
+                if link_order_id == order_id:
+                    product_ids = [product_id for _, product_id in link_rows]
+                link_order_id, link_rows = next(links, (None, ()))
+            items.append(encoder.encode({
+                'id': order_id,
+                'delivery_address': delivery_address,
+                'promocode': promocode,
+                'user_id': user_id,
+                'product_ids': product_ids,
+            }))
+        yield (", " if batch_number else "") + ", ".join(items)
+    yield ']}'
+
+
+class ColumnarExportView(UserPassesTestMixin, View):
+    """
+    Колоночная выгрузка товаров, заказов и связей заказ-товар в ``.npz``.
+    """
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request: HttpRequest) -> FileResponse:
+        file = write_npz(tempfile.TemporaryFile())
+        file.seek(0)
+        return FileResponse(file, as_attachment=True, filename="shop-export.npz",
+                            content_type="application/octet-stream")
 
 
 class UserOrdersListView(LoginRequiredMixin, ListView):
@@ -402,7 +654,7 @@ class UserOrdersListView(LoginRequiredMixin, ListView):
 class UserOrdersExportView(APIView):
 
     def get(self, request, user_id):
-        cache_key = f'user_orders_{user_id}'
+        cache_key = versioned_key(f'user_orders_{user_id}', ORDERS_VERSION, user_orders_version(user_id))
         cached_data = cache.get(cache_key)
 
         if cached_data is not None:
@@ -412,7 +664,7 @@ class UserOrdersExportView(APIView):
         except User.DoesNotExist:
             raise Http404("Пользователь не найден")
 
-        orders = Order.objects.filter(user=user).order_by('-created_at')
+        orders = prefetch_order_products(Order.objects.filter(user=user).order_by('-created_at'))
         orders_data = OrderSerializer(orders, many=True).data
 
         response_data = {
@@ -420,5 +672,51 @@ class UserOrdersExportView(APIView):
             'user_name': user.username,
             'orders': orders_data
         }
-        cache.set(cache_key, response_data, timeout=3600)
+        cache.set(cache_key, response_data, timeout=EXPORT_CACHE_TIMEOUT)
         return JsonResponse(response_data, safe=False)
+
+
+class SalesAnalyticsView(APIView):
+    """
+    Аналитика продаж за ``?start=``..``?end=`` (YYYY-MM-DD, по умолчанию — последние 30 дней):
+    выручка по дням, топ ``?top=`` товаров, влияние скидок и средняя корзина.
+    """
+    permission_classes = [IsAdminUser]
+    default_days = 30
+    max_top = 100
+
+    @extend_schema(
+        summary="Sales analytics for a date range",
+        parameters=[
+            OpenApiParameter("start", OpenApiTypes.DATE),
+            OpenApiParameter("end", OpenApiTypes.DATE),
+            OpenApiParameter("top", OpenApiTypes.INT),
+        ],
+        responses={200: OpenApiResponse(description="Sales report")},
+    )
+    def get(self, request: Request) -> Response:
+        errors = {}
+        end = self.parse_date(request, "end", timezone.localdate(), errors)
+        start = self.parse_date(request, "start", end - timedelta(days=self.default_days - 1), errors)
+        try:
+            top = int(request.query_params.get("top", 10))
+            if not 1 <= top <= self.max_top:
+                raise ValueError
+        except ValueError:
+            errors["top"] = f"Integer from 1 to {self.max_top}."
+        if not errors and start > end:
+            errors["start"] = "Must not be after end."
+        if errors:
+            raise ValidationError(errors)
+        return Response(sales_report(start, end, top))
+
+    @staticmethod
+    def parse_date(request, name, default, errors):
+        value = request.query_params.get(name)
+        if not value:
+            return default
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            errors[name] = "Date in YYYY-MM-DD format."
+            return default